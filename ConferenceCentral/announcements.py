@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""announcements.py
+
+The nearly sold out conferences behind getAnnouncement.
+
+A conference is nearly sold out while it has free seats, but no more
+than its `nearlySoldOutThreshold`. The set is kept in one
+`NearlySoldOut` entity mapping websafe conference keys to names, and is
+updated wherever a conference's free seats are seen to change:
+registrations (with the live count), seat rollups and conference writes.
+Only a conference crossing its threshold writes the entity, so the
+common case is one cached read. getAnnouncement formats the entity on
+every call, so the announcement is as fresh as the last registration.
+
+The hourly cron only reconciles: it recomputes the set from the rolled-up
+Conference.seatsAvailable, in case an update was missed.
+
+$Id$
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import NearlySoldOut
+
+DEFAULT_THRESHOLD = 5
+MAX_THRESHOLD = 100     # bounds the reconciliation query
+TEMPLATE = ('Last chance to attend! The following conferences '
+            'are nearly sold out: %s')
+
+SET_KEY = ndb.Key(NearlySoldOut, 'all')
+
+
+def isNearlySoldOut(conf, seats):
+    """Return True if `seats` free seats make a Conference nearly sold
+    out."""
+    threshold = conf.nearlySoldOutThreshold
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD
+    return seats is not None and 0 < seats <= threshold
+
+
+def _conferences(entity):
+    return dict(entity.conferences or {}) if entity else {}
+
+
+@ndb.transactional
+def _store(wsck, name):
+    entity = SET_KEY.get() or NearlySoldOut(key=SET_KEY)
+    conferences = _conferences(entity)
+    if conferences.get(wsck) == name:
+        return
+    if name is None:
+        del conferences[wsck]
+    else:
+        conferences[wsck] = name
+    entity.conferences = conferences
+    entity.put()
+
+
+def track(conf, seats):
+    """Add a Conference with `seats` free seats to the set or remove it,
+    as needed. Joins the caller's transaction, which must then be xg.
+
+    Returns True if the set changed."""
+    wsck = conf.key.urlsafe()
+    name = conf.name if isNearlySoldOut(conf, seats) else None
+    if _conferences(SET_KEY.get()).get(wsck) == name:
+        return False
+    _store(wsck, name)
+    return True
+
+
+def announcement():
+    """Return the announcement text, empty if no conference is nearly
+    sold out."""
+    names = sorted(_conferences(SET_KEY.get()).itervalues())
+    return TEMPLATE % ', '.join(names) if names else ''
+
+
+@ndb.transactional
+def _replace(conferences):
+    entity = SET_KEY.get() or NearlySoldOut(key=SET_KEY)
+    if _conferences(entity) != conferences:
+        entity.conferences = conferences
+        entity.put()
+
+
+def reconcile():
+    """Recompute the set from Conference.seatsAvailable. Returns the
+    announcement."""
+    c_query = Conference.query(ndb.AND(
+        Conference.seatsAvailable > 0,
+        Conference.seatsAvailable <= MAX_THRESHOLD))
+    _replace(dict((conf.key.urlsafe(), conf.name) for conf in c_query
+                  if isNearlySoldOut(conf, conf.seatsAvailable)))
+    return announcement()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""bulk.py
+
+Streaming import and export of Profiles, Conferences, registrations,
+Sessions and wishlist entries.
+
+Entities are written one per line as JSON objects holding the kind, the
+key path (so dumps do not depend on the app id) and the properties:
+
+    {"kind": "Session", "key": ["Profile", "a@b.c", "Conference", 5,
+     "Session", 7], "properties": {"name": "Keynote", ...}}
+
+Exports page through each kind with query cursors and imports read the
+input in chunks, so memory use is bounded by the chunk size. Each import
+chunk costs one get_multi (existing entities are skipped unless
+overwritten) and one put_multi, and its conferences are indexed for
+search and counted in the facets. Afterwards the schedule documents,
+speaker tallies and search documents of the conferences that got
+sessions are rebuilt.
+
+Imports do not send conference confirmation emails unless asked to.
+See bulk_cli.py for running this offline against a datastore file.
+
+$Id$
+
+"""
+
+import base64
+import itertools
+import json
+import time
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import SeatReservation
+from models import Session
+from models import SessionForms
+from models import WishlistEntry
+from serializers import CONFERENCE_SERIALIZER
+from serializers import SESSION_SERIALIZER
+import cache
+import dispatch
+import queries
+import schedule
+import speakers
+import speaker_index
+import textsearch
+import facets
+import announcements
+
+# parents first, so a dump can be imported in order
+MODELS = (Profile, Conference, SeatReservation, Session, WishlistEntry)
+KINDS = dict((model._get_kind(), model) for model in MODELS)
+CHUNK_SIZE = 200
+
+_TIME_FORMATS = {
+    ndb.DateProperty: ('%Y-%m-%d',),
+    ndb.TimeProperty: ('%H:%M:%S.%f', '%H:%M:%S'),
+    ndb.DateTimeProperty: ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'),
+}
+
+
+def _encodeValue(prop, value):
+    if value is None:
+        return None
+    if isinstance(prop, ndb.KeyProperty):
+        return list(value.flat())
+    if isinstance(prop, ndb.DateTimeProperty):     # incl. Date and Time
+        return value.isoformat()
+    if isinstance(prop, (ndb.JsonProperty, ndb.TextProperty)):
+        return value
+    if isinstance(prop, ndb.BlobProperty):
+        return base64.b64encode(value)
+    return value
+
+
+def _decodeValue(prop, value):
+    if value is None:
+        return None
+    if isinstance(prop, ndb.KeyProperty):
+        return ndb.Key(flat=value)
+    if isinstance(prop, ndb.DateTimeProperty):
+        for fmt in _TIME_FORMATS[type(prop)]:
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            if isinstance(prop, ndb.DateProperty):
+                return parsed.date()
+            if isinstance(prop, ndb.TimeProperty):
+                return parsed.time()
+            return parsed
+        raise ValueError('Bad %s value: %r' % (prop._name, value))
+    if isinstance(prop, (ndb.JsonProperty, ndb.TextProperty)):
+        return value
+    if isinstance(prop, ndb.BlobProperty):
+        return base64.b64decode(value)
+    return value
+
+
+def encodeEntity(entity):
+    """Return the JSON line for an entity."""
+    props = {}
+    for name, prop in entity._properties.iteritems():
+        value = prop._get_value(entity)
+        if prop._repeated:
+            props[name] = [_encodeValue(prop, v) for v in value]
+        else:
+            props[name] = _encodeValue(prop, value)
+    return json.dumps({'kind': entity._get_kind(),
+                       'key': list(entity.key.flat()),
+                       'properties': props}, sort_keys=True)
+
+
+def decodeEntity(line):
+    """Return the entity of a JSON line."""
+    record = json.loads(line)
+    model = KINDS.get(record['kind'])
+    if model is None:
+        raise ValueError('Unknown kind: %r' % record['kind'])
+    entity = model(key=ndb.Key(flat=record['key']))
+    for name, value in record['properties'].iteritems():
+        prop = model._properties.get(name)
+        if prop is None:
+            continue
+        if prop._repeated:
+            value = [_decodeValue(prop, v) for v in value or []]
+        else:
+            value = _decodeValue(prop, value)
+        prop._set_value(entity, value)
+    if isinstance(entity, Conference):
+        # seat shards are not exported; start from seatsAvailable again
+        entity.seatShards = 0
+    elif isinstance(entity, SeatReservation):
+        # the seat is carried over like one taken before sharding
+        entity.shard = None
+    return entity
+
+
+def _stats(counts, skipped, start):
+    seconds = time.time() - start
+    entities = sum(counts.values())
+    return {
+        'counts': counts,
+        'entities': entities,
+        'skipped': skipped,
+        'seconds': seconds,
+        'perSecond': entities / seconds if seconds else 0.0,
+    }
+
+
+def exportEntities(out, models=MODELS, chunk_size=CHUNK_SIZE):
+    """Write all entities of `models` to the file-like `out`, one JSON
+    line each. Returns throughput stats."""
+    start = time.time()
+    counts = {}
+    for model in models:
+        kind = model._get_kind()
+        counts[kind] = 0
+        cursor, more = None, True
+        while more:
+            page, cursor, more = model.query().fetch_page(
+                chunk_size, start_cursor=cursor)
+            for entity in page:
+                out.write(encodeEntity(entity) + '\n')
+            counts[kind] += len(page)
+            # keep ndb's in-context cache from holding the whole kind
+            ndb.get_context().clear_cache()
+    return _stats(counts, 0, start)
+
+
+def _reserveIds(entities):
+    """Keep allocate_ids() from handing out imported numeric ids."""
+    maxima = {}
+    for entity in entities:
+        key = entity.key
+        if key.integer_id():
+            group = (type(entity), key.parent())
+            maxima[group] = max(maxima.get(group, 0), key.integer_id())
+    futures = [model.allocate_ids_async(max=top, parent=parent)
+               for (model, parent), top in maxima.iteritems()]
+    for future in futures:
+        future.check_success()
+
+
+def _sendConfirmations(confs):
+    o_keys = list(set(filter(None, (queries.organizerKey(c) for c in confs))))
+    emails = dict((p.key, p.mainEmail)
+                  for p in ndb.get_multi(o_keys) if p and p.mainEmail)
+    for conf in confs:
+        email = emails.get(queries.organizerKey(conf))
+        if email:
+            # same name as createConference, so each conference gets one
+            dispatch.enqueue(
+                params={'email': email, 'conferenceInfo':
+                        repr(CONFERENCE_SERIALIZER.toForm(conf))},
+                url='/tasks/send_confirmation_email',
+                name=dispatch.taskName('confirm-conference',
+                                       conf.key.urlsafe()))
+
+
+def _sessionForms(c_key):
+    s_query = Session.query(ancestor=c_key)
+    s_query = s_query.order(Session.date)
+    s_query = s_query.order(Session.startTime)
+    return SessionForms(items=SESSION_SERIALIZER.toForms(s_query))
+
+
+def _refreshSessions(c_key):
+    """Rebuild the data derived from a conference's sessions."""
+    schedule.rebuild(c_key, lambda: _sessionForms(c_key))
+    speakers.update(c_key, build=lambda: Session.query(ancestor=c_key).fetch(),
+                    rebuild=True)
+    cache.invalidate(c_key.urlsafe(), cache.SESSIONS)
+    sessions = Session.query(ancestor=c_key).fetch()
+    speaker_index.add(sessions)
+    textsearch.indexSessions(sessions)
+
+
+def importEntities(lines, chunk_size=CHUNK_SIZE, overwrite=False,
+                   send_emails=False):
+    """Import entities from an iterable of JSON lines (e.g. a file).
+
+    Entities that already exist are skipped unless `overwrite` is set.
+    Confirmation emails for imported conferences are only sent with
+    `send_emails`. Returns throughput stats."""
+    start = time.time()
+    counts, skipped = {}, 0
+    c_keys = set()
+    lines = (line for line in lines if line.strip())
+    while True:
+        chunk = [decodeEntity(line)
+                 for line in itertools.islice(lines, chunk_size)]
+        if not chunk:
+            break
+        if not overwrite:
+            existing = ndb.get_multi([e.key for e in chunk])
+            skipped += len([e for e in existing if e])
+            chunk = [e for e, old in zip(chunk, existing) if not old]
+        _reserveIds(chunk)
+        ndb.put_multi(chunk)
+        for entity in chunk:
+            kind = entity._get_kind()
+            counts[kind] = counts.get(kind, 0) + 1
+            if isinstance(entity, Session):
+                c_keys.add(entity.key.parent())
+            elif overwrite and isinstance(entity, Conference):
+                cache.invalidate(entity.key.urlsafe(), cache.CONFERENCE)
+        confs = [e for e in chunk if isinstance(e, Conference)]
+        textsearch.indexConferences(confs)
+        if not overwrite:
+            facets.update(after=[value for conf in confs
+                                 for value in facets.values(conf)])
+        if send_emails:
+            _sendConfirmations(confs)
+        ndb.get_context().clear_cache()
+    for c_key in c_keys:
+        _refreshSessions(c_key)
+    if overwrite and counts.get('Conference'):
+        # the replaced conferences were not read, so recount
+        facets.rebuild()
+    if counts.get('Conference'):
+        announcements.reconcile()
+    return _stats(counts, skipped, start)
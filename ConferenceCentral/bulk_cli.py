@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""bulk_cli.py
+
+Command line front end for bulk.py, run offline against a local
+datastore file (e.g. the dev_appserver's) through the SDK stubs:
+
+    python bulk_cli.py --sdk ~/google_appengine --app-id dev~nice-tiger \
+        --datastore /tmp/datastore export conferences.jsonl
+    python bulk_cli.py ... import conferences.jsonl [--overwrite] [--emails]
+
+Email tasks are only queued with --emails, and go nowhere offline.
+
+$Id$
+
+"""
+
+import argparse
+import os
+import sys
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _setupStubs(sdk, app_id, datastore):
+    """Put the SDK on sys.path and back the APIs with local stubs."""
+    if sdk:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.ext import testbed
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id=app_id, overwrite=True)
+    tb.init_datastore_v3_stub(datastore_file=datastore, save_changes=True)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_ROOT)
+    return tb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', help='App Engine SDK directory')
+    parser.add_argument('--app-id', default='dev~nice-tiger')
+    parser.add_argument('--datastore', required=True,
+                        help='datastore file to read or update')
+    parser.add_argument('--chunk-size', type=int, default=200)
+    sub = parser.add_subparsers(dest='command')
+    export = sub.add_parser('export')
+    export.add_argument('path')
+    load = sub.add_parser('import')
+    load.add_argument('path')
+    load.add_argument('--overwrite', action='store_true',
+                      help='replace entities that already exist')
+    load.add_argument('--emails', action='store_true',
+                      help='queue conference confirmation emails')
+    args = parser.parse_args(argv)
+
+    tb = _setupStubs(args.sdk, args.app_id, args.datastore)
+    sys.path.insert(0, APP_ROOT)
+    import bulk
+    try:
+        if args.command == 'export':
+            with open(args.path, 'w') as out:
+                stats = bulk.exportEntities(out, chunk_size=args.chunk_size)
+        else:
+            with open(args.path) as lines:
+                stats = bulk.importEntities(
+                    lines, chunk_size=args.chunk_size,
+                    overwrite=args.overwrite, send_emails=args.emails)
+        # the file stub only writes its file when asked to
+        tb.get_stub('datastore_v3').Write()
+    finally:
+        tb.deactivate()
+    for kind, count in sorted(stats['counts'].items()):
+        print '%-12s %8d' % (kind, count)
+    print '%d entities (%d skipped) in %.1f s: %.0f entities/s' % (
+        stats['entities'], stats['skipped'], stats['seconds'],
+        stats['perSecond'])
+
+
+if __name__ == '__main__':
+    main()
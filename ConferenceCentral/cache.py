@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Versioned memcache read-through cache for per-conference API payloads.
+
+Serialized ProtoRPC messages are stored under keys that include a
+per-conference, per-group version number. Invalidating a group just
+bumps its version, so every payload of that group for that conference
+(e.g. all the session listings) is dropped at once without having to
+know which ones were cached. Hit and miss counters are kept in memcache
+to help size it.
+
+$Id$
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from protorpc import protobuf
+
+# payload groups, invalidated independently
+CONFERENCE = 'conference'
+SESSIONS = 'sessions'
+
+CACHE_TIME = 60 * 60    # seconds
+MEMCACHE_VERSION_KEY = 'cacheVersion_%s_%s'
+MEMCACHE_PAYLOAD_KEY = 'cache_%s_%s_%d_%s'
+MEMCACHE_HITS_KEY = 'cacheHits'
+MEMCACHE_MISSES_KEY = 'cacheMisses'
+
+
+def _version(wck, group):
+    vkey = MEMCACHE_VERSION_KEY % (group, wck)
+    version = memcache.get(vkey)
+    if version is None:
+        # Start from the clock so a version that was evicted never comes
+        # back with a number that old payloads were stored under.
+        memcache.add(vkey, int(time.time() * 1000))
+        version = memcache.get(vkey) or 0
+    return version
+
+
+def getOrSet(wck, group, name, message_type, build):
+    """Return the cached `message_type` payload `name` of a conference,
+    calling build() and caching its result on a miss."""
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    key = MEMCACHE_PAYLOAD_KEY % (group, wck, _version(wck, group), name)
+    data = memcache.get(key)
+    if data is not None:
+        memcache.incr(MEMCACHE_HITS_KEY, initial_value=0)
+        return protobuf.decode_message(message_type, data)
+    memcache.incr(MEMCACHE_MISSES_KEY, initial_value=0)
+    message = build()
+    memcache.set(key, protobuf.encode_message(message), time=CACHE_TIME)
+    return message
+
+
+def invalidate(wck, group):
+    """Drop every cached payload of `group` for a conference."""
+    # a missing version needs no bump; it restarts from the clock
+    memcache.incr(MEMCACHE_VERSION_KEY % (group, wck))
+
+
+def stats():
+    """Return (hits, misses, memcache stats dict or None)."""
+    counts = memcache.get_multi([MEMCACHE_HITS_KEY, MEMCACHE_MISSES_KEY])
+    return (counts.get(MEMCACHE_HITS_KEY, 0),
+            counts.get(MEMCACHE_MISSES_KEY, 0),
+            memcache.get_stats())
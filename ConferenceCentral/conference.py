@@ -14,6 +14,7 @@ modifed by JWJ on 2015 aug 12
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+import logging
 from os import environ
 from datetime import datetime, time
 from functools import wraps
@@ -23,10 +24,11 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 from google.appengine.api import users
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
 from models import ConflictException
 from models import Profile
@@ -34,6 +36,8 @@ from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
+from models import CacheStatsForm
+from models import DispatchStatsForm
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
@@ -42,22 +46,51 @@ from models import ConferenceQueryForms
 from models import Session
 from models import SessionForm
 from models import SessionForms
-#from models import SessionQueryForm  # Not yet implemented
-#from models import SessionQueryForms  # Not yet implemented
+from models import SessionResult
+from models import SessionResults
+from models import WishlistForm
+from models import WishlistResult
+from models import WishlistResults
+from models import SessionQueryForms
 from models import TeeShirtSize
+from models import RegistrationTicketForm
+from models import AttendeeForm
+from models import AttendeeForms
+from models import SpeakerForm
+from models import SpeakerForms
+from models import SearchResultForm
+from models import SearchResultForms
+from models import FacetValueForm
+from models import FacetForm
+from models import FacetForms
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from serializers import CONFERENCE_SERIALIZER
+from serializers import PROFILE_SERIALIZER
+from serializers import SESSION_SERIALIZER
 from utils import getUserId
+import seats
+import registration_queue
+import queries
+import cache
+import schedule
+import tokeninfo
+import requestcontext
+import speakers
+import dispatch
+import wishlist
+import planner
+import speaker_index
+import textsearch
+import facets
+import announcements
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -65,8 +98,19 @@ DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": [ "Default", "Topic" ],
+    "nearlySoldOutThreshold": announcements.DEFAULT_THRESHOLD,
 }
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# entities per transaction are limited to 500, incl. schedule and tally
+MAX_SESSIONS_PER_BATCH = 400
+SESSION_PUT_CHUNK = 100
+MAX_WISHLIST_BATCH = 100
+DEFAULT_SPEAKER_SUGGESTIONS = 10
+MAX_SPEAKER_SUGGESTIONS = 50
+
 OPERATORS = {
             'EQ':   '=',
             'GT':   '>',
@@ -83,11 +127,42 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+SESSION_FIELDS = {
+            'TYPE': 'typeOfSession',
+            'SPEAKER': 'speaker',
+            'DATE': 'date',
+            'START_TIME': 'startTime',
+            'DURATION': 'duration',
+            }
+
+# filter values arrive as strings; properties that are not get converted
+FILTER_VALUES = {
+            'month': int,
+            'maxAttendees': int,
+            'duration': int,
+            'date': lambda v: datetime.strptime(v[:10], "%Y-%m-%d").date(),
+            'startTime': lambda v: datetime.strptime(v[:5], "%H:%M").time(),
+            }
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+    fields=messages.StringField(3),
+)
+
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 CONF_GET_REQUEST_BY_TYPE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -103,6 +178,22 @@ CONF_GET_REQUEST_BY_SPEAKER = endpoints.ResourceContainer(
 SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    fields=messages.StringField(2),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    q=messages.StringField(1),
+    kind=messages.StringField(2),
+    limit=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+)
+
+SPEAKER_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
 )
 
 CONF_PUT_REQUEST = endpoints.ResourceContainer(
@@ -110,6 +201,11 @@ CONF_PUT_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeTicketKey=messages.StringField(1),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
@@ -120,6 +216,16 @@ SESS_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESS_BATCH_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SESS_QUERY_REQUEST = endpoints.ResourceContainer(
+    SessionQueryForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESS_PUT_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeSessionKey=messages.StringField(1),
@@ -137,25 +243,26 @@ def checks_authorization(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # If testing app, ensure it is running on dev_appserver localhost
-        if TEST_APP and environ['SERVER_SOFTWARE'].startswith('Dev'):
-            if TEST_WITH_MOCK_AUTH:
-                # Always authorized
-                user = users.User(email='authorize@all.com')
-            else:
-                # Use current user if it exists
-                user = users.get_current_user()
-            if not user:
-                raise endpoints.UnauthorizedException('Authorization required')
-        else:
-            # Endpoints login check
-            user = endpoints.get_current_user()
-            if not user:
-                raise endpoints.UnauthorizedException('Authorization required')
+        # resolved once per request, however many checks are nested
+        user = requestcontext.memoize('user', _currentUser)
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
 
         return func(*args, user=user, **kwargs)
     return wrapper
 
+def _currentUser():
+    """Return the logged in user, or None."""
+    # If testing app, ensure it is running on dev_appserver localhost
+    if TEST_APP and environ['SERVER_SOFTWARE'].startswith('Dev'):
+        if TEST_WITH_MOCK_AUTH:
+            # Always authorized
+            return users.User(email='authorize@all.com')
+        # Use current user if it exists
+        return users.get_current_user()
+    # Endpoints login check
+    return endpoints.get_current_user()
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -169,22 +276,10 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, fields=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return CONFERENCE_SERIALIZER.toForm(
+            conf, fields, organizerDisplayName=displayName)
 
 
     @checks_authorization
@@ -214,6 +309,7 @@ class ConferenceApi(remote.Service):
         if data['endDate']:
             data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
 
+        self._checkThreshold(data['nearlySoldOutThreshold'])
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
@@ -227,17 +323,55 @@ class ConferenceApi(remote.Service):
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(
+        conf = Conference(**data)
+        self._putConference(conf)
+        textsearch.indexConferences([conf])
+        dispatch.enqueue(
             params={'email': p_key.get().mainEmail,
                     'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
+            url='/tasks/send_confirmation_email',
+            name=dispatch.taskName('confirm-conference', c_key.urlsafe()),
         )
         return request
 
 
+    @staticmethod
+    def _checkThreshold(threshold):
+        if threshold is not None and \
+                not 0 <= threshold <= announcements.MAX_THRESHOLD:
+            raise endpoints.BadRequestException(
+                "'nearlySoldOutThreshold' must be between 0 and %d." %
+                announcements.MAX_THRESHOLD)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putConference(conf, resized=False):
+        """Put a Conference and move it from the facet values of the
+        stored copy to its current ones in the same transaction. Also
+        updates the nearly sold out set once committed, if the seats or
+        the threshold changed.
+
+        The seat fields are kept from the stored copy, since the shards
+        may have been created or rolled up since `conf` was read; only
+        a `resized` conference brings its own seatsAvailable."""
+        stored = conf.key.get()
+        if stored is not None:
+            conf.seatShards = stored.seatShards
+            if not resized:
+                conf.seatsAvailable = stored.seatsAvailable
+        conf.put()
+        facets.update(facets.values(stored), facets.values(conf))
+        if stored is None or \
+                stored.seatsAvailable != conf.seatsAvailable or \
+                stored.nearlySoldOutThreshold != conf.nearlySoldOutThreshold:
+            # after commit, so reading the live count from the seat shards
+            # does not add their entity groups to this transaction
+            ndb.get_context().call_on_commit(
+                lambda: announcements.track(conf, seats.seatsAvailable(conf)))
+
+
     @checks_authorization
-    @ndb.transactional
     def _updateConferenceObject(self, request, user=None):
         # copy ConferenceForm/ProtoRPC Message into dict
         user_id = getUserId(user)
@@ -255,9 +389,42 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        self._checkThreshold(request.nearlySoldOutThreshold)
+        # Resize the seat shards before accepting a new maxAttendees.
+        # They are separate entity groups, so this is not part of the
+        # Conference write; give the old capacity back if that fails.
+        maxAttendees = conf.maxAttendees
+        resized = request.maxAttendees is not None and \
+            request.maxAttendees != maxAttendees
+        if resized:
+            # shard first, so the resize and the put agree on the shards
+            conf = seats.ensureShards(conf)
+            available = seats.resize(conf, request.maxAttendees)
+            if available is None:
+                raise ConflictException(
+                    'More seats than maxAttendees are already taken.')
+            conf.seatsAvailable = available
+        try:
+            self._copyToConference(request, conf)
+            self._putConference(conf, resized)
+        except Exception:
+            if resized:
+                seats.resize(conf, maxAttendees)
+            raise
+        cache.invalidate(request.websafeConferenceKey, cache.CONFERENCE)
+        textsearch.indexConferences([conf])
+        prof = ndb.Key(Profile, user_id).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+
+    @staticmethod
+    def _copyToConference(request, conf):
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # seatsAvailable is maintained by the seat shards
+            if field.name == 'seatsAvailable':
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -268,9 +435,6 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -293,81 +457,124 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        wck = request.websafeConferenceKey
+        cf = cache.getOrSet(wck, cache.CONFERENCE, 'form', ConferenceForm,
+                            lambda: self._conferenceForm(wck))
+        # report live seat count rather than the last rollup
+        live = seats.liveSeatsAvailable(wck)
+        if live is not None:
+            cf.seatsAvailable = live
+        return cf
+
+
+    def _conferenceForm(self, wck):
+        """Build the ConferenceForm for getConference()."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=wck).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wck)
+        o_key = queries.organizerKey(conf)
+        prof = o_key.get() if o_key else None
+        conf.seatsAvailable = seats.seatsAvailable(conf)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName', None))
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             # 2015 Jul 4, JWJ, Changed from POST to GET
             http_method='GET', name='getConferencesCreated')
     @checks_authorization
     def getConferencesCreated(self, request, user=None):
-        """Return conferences created by user."""
+        """Return conferences created by user, one page at a time."""
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
         confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
-                   for conf in confs]
-        )
+        return self._copyConferencesToForms(*self._fetchPage(confs, request))
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _parseFields(self, form_class, fields):
+        """Parse a `fields` selector; None means all fields."""
+        try:
+            return queries.parseFields(form_class, fields)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
+
+    def _fetchPage(self, query, request, match=None):
+        """Fetch one page of a Conference query using the request's
+        `limit`, `pageToken` and `fields`, keeping only conferences
+        accepted by `match` if given. Returns (conferences, organiser
+        names, nextPageToken, fields); see queries.fetchPage()."""
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'limit' must be between 1 and %d." % MAX_PAGE_SIZE)
+        fields = self._parseFields(ConferenceForm, request.fields)
+        # only the requested fields are read: projection or keys-only,
+        # unless a post-filter needs the whole entity
+        options = {} if match else \
+            queries.fetchOptions(query, Conference, fields)
+        organizers = fields is None or 'organizerDisplayName' in fields
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) \
+                if request.pageToken else None
+            confs, names, next_cursor = queries.fetchPage(
+                query, limit, cursor, options, organizers, match)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        return confs, names, next_cursor and next_cursor.urlsafe(), fields
+
+
+    def _copyConferencesToForms(self, confs, names, next_token=None,
+                                fields=None):
+        """Copy Conferences to ConferenceForms with organiser names,
+        limited to `fields` if given."""
+        if fields is None or 'organizerDisplayName' in fields:
+            displayName = lambda conf: names.get(queries.organizerKey(conf))
         else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+            # projected entities may not even have the organiser id
+            displayName = lambda conf: None
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, displayName(conf), fields)
+                   for conf in confs],
+            nextPageToken=next_token,
+        )
+
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+    def _getQuery(self, request):
+        """Return the query plan for the submitted filters; see planner.py."""
+        return planner.plan(Conference, self._formatFilters(request.filters))
 
 
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+    def _formatFilters(self, filters, fields=FIELDS):
+        """Parse, check validity and format user supplied filters as
+        (property, operator, value) tuples."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
-
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                field = fields[f.field]
+                operator = OPERATORS[f.operator]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            value = f.value
+            if field in FILTER_VALUES:
+                try:
+                    value = FILTER_VALUES[field](value)
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on '%s' has an invalid value." % f.field)
 
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+            # inequalities on any number of fields are fine: the planner
+            # runs the ones no index covers as a post-filter
+            formatted_filters.append((field, operator, value))
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -375,53 +582,99 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        """Query for conferences, one page at a time.
+
+        Set `debug` to get the chosen query plan in `queryPlan`."""
+        plan = self._getQuery(request)
+        # organiser names are looked up while the page is fetched
+        forms = self._copyConferencesToForms(
+            *self._fetchPage(plan.query, request, plan.match))
+        if request.debug:
+            forms.queryPlan = planner.describe(plan)
+        return forms
+
+
+    @endpoints.method(SEARCH_REQUEST, SearchResultForms,
+            path='search',
+            http_method='GET', name='search')
+    def search(self, request):
+        """Full-text search over conference and session names, descriptions,
+        highlights and speakers, best matches first. Set `kind` to
+        Conference or Session to search only one of them."""
+        if not request.q or not textsearch.tokenize(request.q):
+            raise endpoints.BadRequestException("'q' has no search terms.")
+        if request.kind not in (None, textsearch.CONFERENCE,
+                                textsearch.SESSION):
+            raise endpoints.BadRequestException(
+                "'kind' must be %s or %s." % (textsearch.CONFERENCE,
+                                              textsearch.SESSION))
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'limit' must be between 1 and %d." % MAX_PAGE_SIZE)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if not 0 <= offset < textsearch.MAX_RESULTS:
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        limit = min(limit, textsearch.MAX_RESULTS - offset)
+        hits, total = textsearch.query(request.q, request.kind, limit, offset)
+        end = offset + len(hits)
+        more = hits and end < min(total, textsearch.MAX_RESULTS)
+        return SearchResultForms(
+            items=[SearchResultForm(kind=hit.kind, websafeKey=hit.docId,
+                                    name=hit.name, score=hit.score)
+                   for hit in hits],
+            total=total, nextPageToken=str(end) if more else None)
+
+
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+            path='conferences/facets',
+            http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences per city, topic, month and
+        free seat bucket, e.g. for labels like "London (42)"."""
+        # precomputed counts: one read, usually from memcache
+        found = dict((name, []) for name in facets.FACETS)
+        for value, count in facets.counts().iteritems():
+            name, _, label = value.partition(':')
+            found[name].append((label, count))
+        buckets = [label for _, label in facets.SEAT_BUCKETS]
+
+        def order(name, label, count):
+            if name == 'month':
+                return int(label)
+            if name == 'seats':
+                return buckets.index(label)
+            # cities and topics with the most conferences come first
+            return -count, label
+        return FacetForms(items=[
+            FacetForm(name=name, values=[
+                FacetValueForm(value=label, count=count)
+                for label, count in sorted(
+                    found[name], key=lambda item: order(name, *item))])
+            for name in facets.FACETS])
 
 
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date and Time to string; just copy others
-                if field.name in ['date', 'startTime']:
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == 'websafeKey':
-                # Add datastore key for reference
-                setattr(sf, field.name, sess.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return SESSION_SERIALIZER.toForm(sess)
 
 
-    @checks_authorization
-    def _createSessionObject(self, request, user=None):
-        """Create Session object, returning SessionForm/request."""
-        user_id = getUserId(user)
+    def _copySessionsToForms(self, sessions, fields=None):
+        """Copy a batch of Sessions to SessionForms, limited to `fields`
+        if given."""
+        return SessionForms(items=SESSION_SERIALIZER.toForms(sessions, fields))
+
+
+    def _organizerConference(self, wck, user_id, action='add sessions'):
+        """Return the Conference for adding sessions to; only its creator
+        may add them (or perform `action`)."""
         # get Conference object from request; bail if not found
-        wck = request.websafeConferenceKey
-        c_key = ndb.Key(urlsafe=wck)
-        conf = c_key.get()
+        conf = ndb.Key(urlsafe=wck).get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wck)
@@ -429,52 +682,113 @@ class ConferenceApi(remote.Service):
         # Check editing authorization. Creater and user match
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
-                'Only conference creator may add sessions')
+                'Only conference creator may %s' % action)
+        return conf
+
 
-        if not request.name or not request.date or not request.startTime:
+    def _sessionData(self, form, conf):
+        """Check a SessionForm for a new session of `conf` and return the
+        Session properties, without a key."""
+        if not form.name or not form.date or not form.startTime:
             raise endpoints.BadRequestException(
                 "Session 'name', 'date', and 'startTime' fields required")
 
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
-        data['conferenceKey'] = wck
+        data = {field.name: getattr(form, field.name)
+                for field in form.all_fields()}
+        data['conferenceKey'] = conf.key.urlsafe()
         data.pop('websafeConferenceKey', None)
         data.pop('websafeKey', None)
 
         # convert date/time strings to Date/Time objects
-        if data['date']:
+        try:
             data['date'] = datetime.strptime(
                                 data['date'][:10], "%Y-%m-%d").date()
-        if data['startTime']:
             data['startTime'] = datetime.strptime(
                                     data['startTime'][:10], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session 'date' or 'startTime' is not valid.")
 
         # Check date is within conference date range (if specified)
         if conf.startDate and conf.endDate:
             if data['date'] < conf.startDate or data['date'] > conf.endDate:
                 raise endpoints.BadRequestException(
                     "Session date is not within conference timeframe.")
+        return data
+
+
+    @checks_authorization
+    def _createSessionObject(self, request, user=None):
+        """Create Session object, returning SessionForm/request."""
+        user_id = getUserId(user)
+        conf = self._organizerConference(request.websafeConferenceKey,
+                                         user_id)
+        data = self._sessionData(request, conf)
 
         # generate Session Key based on parent key
+        c_key = conf.key
         s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
+        data['key'] = ndb.Key(Session, s_id, parent=c_key)
 
         # create Session & return (modified) SessionForm
         sess = Session(**data)
-        sess.put()
-
-        # Send speaker names to taskqueue for processing featured speaker
-        for speaker in data['speaker']:
-            taskqueue.add(
-                url='/tasks/set_featured_speaker',
-                params={'speaker': speaker, 'websafeConferenceKey': wck}
-            )
+        def put():
+            sess.put()
+            self._sessionsChanged(c_key, changed=[sess])
+        ndb.transaction(put)
 
         return self._copySessionToForm(sess)
 
 
+    @checks_authorization
+    def _createSessionObjects(self, request, user=None):
+        """Create a batch of Sessions, returning SessionResults.
+
+        Invalid items are reported and skipped; the valid ones are written
+        in one transaction with their derived data."""
+        user_id = getUserId(user)
+        conf = self._organizerConference(request.websafeConferenceKey,
+                                         user_id)
+        if len(request.items) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per batch.' % MAX_SESSIONS_PER_BATCH)
+
+        results = [SessionResult(index=i) for i in range(len(request.items))]
+        valid = []
+        for result, form in zip(results, request.items):
+            try:
+                valid.append((result, self._sessionData(form, conf)))
+            except endpoints.BadRequestException as e:
+                result.error = str(e)
+        if not valid:
+            return SessionResults(items=results)
+
+        # one id allocation for the whole batch
+        c_key = conf.key
+        first, _ = Session.allocate_ids(size=len(valid), parent=c_key)
+        sessions = []
+        for i, (result, data) in enumerate(valid):
+            data['key'] = ndb.Key(Session, first + i, parent=c_key)
+            sessions.append(Session(**data))
+
+        def put():
+            futures = []
+            for i in range(0, len(sessions), SESSION_PUT_CHUNK):
+                futures.extend(ndb.put_multi_async(
+                    sessions[i:i + SESSION_PUT_CHUNK]))
+            for future in futures:
+                future.check_success()
+            # schedule, speaker counts and caches are updated once
+            self._sessionsChanged(c_key, changed=sessions)
+        ndb.transaction(put)
+
+        forms = SESSION_SERIALIZER.toForms(sessions)
+        for (result, _), form in zip(valid, forms):
+            result.session = form
+        return SessionResults(items=results)
+
+
     @checks_authorization
     @ndb.transactional
     def _updateSessionObject(self, request, user=None):
@@ -515,6 +829,7 @@ class ConferenceApi(remote.Service):
 
         # Commit changes and return SessionForm
         sess.put()
+        self._sessionsChanged(s_key.parent(), changed=[sess])
         return self._copySessionToForm(sess)
 
 
@@ -532,28 +847,65 @@ class ConferenceApi(remote.Service):
 
         # Delete entity and return boolean
         s_key.delete()
+        self._sessionsChanged(s_key.parent(), deleted=[s_key])
         return BooleanMessage(data=True)
 
 
+    def _sessionsChanged(self, c_key, changed=(), deleted=()):
+        """Bring data derived from a conference's sessions up to date
+        after `changed` Sessions were put and `deleted` Session keys were
+        removed. Call inside the transaction that writes the sessions."""
+        schedule.update(c_key,
+                        changed=SESSION_SERIALIZER.toForms(changed),
+                        deleted=[k.urlsafe() for k in deleted],
+                        build=lambda: self._querySessionForms(c_key))
+        # featured speaker is published by at most one task per write
+        speakers.update(c_key, changed=changed, deleted=deleted,
+                        build=lambda: Session.query(ancestor=c_key).fetch())
+        # runs straight away when not in a transaction
+        ndb.get_context().call_on_commit(
+            lambda: cache.invalidate(c_key.urlsafe(), cache.SESSIONS))
+        # speaker entries are other entity groups; each gets its own
+        # transaction once the sessions are committed
+        if changed:
+            ndb.get_context().call_on_commit(
+                lambda: speaker_index.add(changed))
+        ndb.get_context().call_on_commit(
+            lambda: textsearch.indexSessions(changed, deleted))
+
+
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/session',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions in chronological order."""
         wck = request.websafeConferenceKey
-        # get Conference object from request; bail if not found
+        return cache.getOrSet(wck, cache.SESSIONS, 'all', SessionForms,
+                              lambda: self._conferenceSessions(wck))
+
+
+    def _conferenceSessions(self, wck):
+        """Build the SessionForms for getConferenceSessions() from the
+        conference's precomputed schedule."""
         c_key = ndb.Key(urlsafe=wck)
+        # an oversized schedule is not stored; query without writing
+        forms = schedule.get(c_key, lambda: self._querySessionForms(c_key))
+        if forms is not None:
+            return forms
+
+        # get Conference object from request; bail if not found
         if not c_key.get():
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wck)
+        return schedule.rebuild(c_key, lambda: self._querySessionForms(c_key))
 
-        # Get sessions for conference ordered by time and return list
+
+    def _querySessionForms(self, c_key):
+        """Query the sessions of a conference in chronological order."""
         s_query = Session.query(ancestor=c_key)
         s_query = s_query.order(Session.date)
         s_query = s_query.order(Session.startTime)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in s_query]
-        )
+        return self._copySessionsToForms(s_query)
 
 
     @endpoints.method(CONF_GET_REQUEST_BY_TYPE, SessionForms,
@@ -563,6 +915,13 @@ class ConferenceApi(remote.Service):
         """Given a conference, return all sessions of a specified type (eg
         lecture, keynote, workshop)."""
         wck = request.websafeConferenceKey
+        return cache.getOrSet(
+            wck, cache.SESSIONS, 'type:' + request.typeOfSession, SessionForms,
+            lambda: self._conferenceSessionsByType(wck, request.typeOfSession))
+
+
+    def _conferenceSessionsByType(self, wck, typeOfSession):
+        """Build the SessionForms for getConferenceSessionsByType()."""
         # get Conference object from request; bail if not found
         c_key = ndb.Key(urlsafe=wck)
         if not c_key.get():
@@ -571,12 +930,10 @@ class ConferenceApi(remote.Service):
 
         # Get sessions for conference and particular type and return list
         s_query = Session.query(ancestor=c_key)
-        s_query = s_query.filter(Session.typeOfSession==request.typeOfSession)
+        s_query = s_query.filter(Session.typeOfSession==typeOfSession)
         s_query = s_query.order(Session.date)
         s_query = s_query.order(Session.startTime)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in s_query]
-        )
+        return self._copySessionsToForms(s_query)
 
 
     @endpoints.method(SPEAKER_GET_REQUEST, SessionForms,
@@ -585,14 +942,30 @@ class ConferenceApi(remote.Service):
     def getSessionsBySpeaker(self, request):
         """Given a speaker, return all sessions given by this particular
         speaker, across all conferences."""
-        # Get sessions for particular speaker and return list
-        s_query = Session.query()
-        s_query = s_query.filter(Session.speaker == request.speaker)
-        s_query = s_query.order(Session.date)
-        s_query = s_query.order(Session.startTime)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in s_query]
-        )
+        fields = self._parseFields(SessionForm, request.fields)
+        # One key get on the speaker index and one get_multi of sessions;
+        # names match regardless of case and spacing
+        return self._copySessionsToForms(
+            speaker_index.sessions(request.speaker), fields)
+
+
+    @endpoints.method(SPEAKER_LIST_REQUEST, SpeakerForms,
+              path='speakers',
+              http_method='GET', name='getSpeakers')
+    def getSpeakers(self, request):
+        """Return speaker names in alphabetical order, only those starting
+        with `prefix` if given; for speaker lists and autocomplete."""
+        limit = request.limit or DEFAULT_SPEAKER_SUGGESTIONS
+        if not 0 < limit <= MAX_SPEAKER_SUGGESTIONS:
+            raise endpoints.BadRequestException(
+                "'limit' must be between 1 and %d." % MAX_SPEAKER_SUGGESTIONS)
+        prefix = speaker_index.normalize(request.prefix or u'')
+        if request.pageToken and not request.pageToken.startswith(prefix):
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        # one get of a directory bucket for prefixes of two letters or more
+        names, token = speaker_index.suggest(prefix, limit, request.pageToken)
+        return SpeakerForms(items=[SpeakerForm(name=name) for name in names],
+                            nextPageToken=token)
 
 
     @staticmethod
@@ -619,13 +992,12 @@ class ConferenceApi(remote.Service):
     def getConferenceSessionsBySpeaker(self, request):
         """Given a conference and speaker, return all sessions given by this
         particular speaker at this particular conference."""
-        sessions = self._conferenceSessionsBySpeaker(
-                            request.websafeConferenceKey,
-                            request.speaker
-        )
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        wck = request.websafeConferenceKey
+        def build():
+            sessions = self._conferenceSessionsBySpeaker(wck, request.speaker)
+            return self._copySessionsToForms(sessions)
+        return cache.getOrSet(wck, cache.SESSIONS, 'speaker:' + request.speaker,
+                              SessionForms, build)
 
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
@@ -636,6 +1008,15 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
+    @endpoints.method(SESS_BATCH_POST_REQUEST, SessionResults,
+                      path='conference/{websafeConferenceKey}/sessions',
+                      http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create a batch of sessions, reporting the result of each one.
+        Open only to the organizer of the conference."""
+        return self._createSessionObjects(request)
+
+
     @endpoints.method(SESS_PUT_REQUEST, SessionForm,
                       path='session/{websafeSessionKey}',
                       http_method='PUT', name='updateSession')
@@ -652,6 +1033,20 @@ class ConferenceApi(remote.Service):
         return self._deleteSessionObject(request)
 
 
+    @staticmethod
+    def _sessionKey(wsk):
+        """Return the Session key of a websafe key; raise BadRequest if it
+        is not one."""
+        try:
+            s_key = ndb.Key(urlsafe=wsk)
+        except (TypeError, ProtocolBufferDecodeError):
+            s_key = None
+        if s_key is None or s_key.kind() != Session._get_kind():
+            raise endpoints.BadRequestException(
+                'Invalid session key: %s' % wsk)
+        return s_key
+
+
     @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
                       path='wishlist/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
@@ -661,24 +1056,89 @@ class ConferenceApi(remote.Service):
         # get user Profile
         prof = self._getProfileFromUser()
         # check if session exists
-        s_key = ndb.Key(urlsafe=wsk)
+        s_key = self._sessionKey(wsk)
         if not s_key.get():
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % wsk)
 
-        # check if user already added session
-        if wsk in prof.sessionKeysToAttend:
+        # Add a wishlist entry; fails if user already added session
+        if not wishlist.add(prof.key, s_key):
             raise ConflictException(
                 "You have already added this session to your wishlist")
+        return BooleanMessage(data=True)
 
-        # Add session key to the list in user profile
-        prof.sessionKeysToAttend.append(wsk)
 
-        # write things back to the datastore & return
-        prof.put()
+    @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
+                      path='wishlist/{websafeSessionKey}',
+                      http_method='DELETE', name='removeSessionFromWishlist')
+    def removeSessionFromWishlist(self, request):
+        """Remove session from user's wishlist."""
+        wsk = request.websafeSessionKey
+        prof = self._getProfileFromUser()
+        if not wishlist.remove(prof.key, self._sessionKey(wsk)):
+            raise endpoints.NotFoundException(
+                'Session not in your wishlist: %s' % wsk)
         return BooleanMessage(data=True)
 
 
+    def _wishlistBatch(self, request, add):
+        """Add or remove a batch of sessions, returning WishlistResults.
+
+        Sessions are checked with one get_multi and the wishlist entries
+        are written in one transaction; each key gets its own result."""
+        prof = self._getProfileFromUser()
+        if len(request.websafeSessionKeys) > MAX_WISHLIST_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per batch.' % MAX_WISHLIST_BATCH)
+
+        results, s_keys = [], {}
+        for wsk in request.websafeSessionKeys:
+            result = WishlistResult(websafeSessionKey=wsk, changed=False)
+            results.append(result)
+            try:
+                s_key = ndb.Key(urlsafe=wsk)
+            except (TypeError, ProtocolBufferDecodeError):
+                s_key = None
+            if s_key is None or s_key.kind() != Session._get_kind():
+                result.error = 'Invalid session key.'
+            elif s_key in s_keys:
+                result.error = 'Duplicate session key.'
+            else:
+                s_keys[s_key] = result
+
+        # removing does not need the session, so deleted ones can go too
+        if add:
+            for s_key, sess in zip(s_keys.keys(), ndb.get_multi(s_keys.keys())):
+                if not sess:
+                    s_keys.pop(s_key).error = 'No session found.'
+            changed = wishlist.addMany(prof.key, s_keys.keys())
+            unchanged = 'Already in your wishlist.'
+        else:
+            changed = wishlist.removeMany(prof.key, s_keys.keys())
+            unchanged = 'Not in your wishlist.'
+        for s_key, result in s_keys.iteritems():
+            result.changed = s_key in changed
+            if not result.changed:
+                result.error = unchanged
+        return WishlistResults(items=results)
+
+
+    @endpoints.method(WishlistForm, WishlistResults,
+                      path='wishlist/batch/add',
+                      http_method='POST', name='addSessionsToWishlist')
+    def addSessionsToWishlist(self, request):
+        """Add a batch of sessions to user's wishlist."""
+        return self._wishlistBatch(request, add=True)
+
+
+    @endpoints.method(WishlistForm, WishlistResults,
+                      path='wishlist/batch/remove',
+                      http_method='POST', name='removeSessionsFromWishlist')
+    def removeSessionsFromWishlist(self, request):
+        """Remove a batch of sessions from user's wishlist."""
+        return self._wishlistBatch(request, add=False)
+
+
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='wishlist/{websafeConferenceKey}',
                       http_method='GET', name='getSessionsInWishlist')
@@ -694,11 +1154,8 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wck)
 
-        # Convert session IDs to ndb Keys
-        s_keys = [ndb.Key(urlsafe=s_id) for s_id in prof.sessionKeysToAttend]
-
-        # Filter the keys with the correct conference parent key
-        s_keys = [k for k in s_keys if k.parent() == c_key]
+        # Keys of the sessions wishlisted for this conference only
+        s_keys = wishlist.sessionKeysFor(prof.key, c_key)
 
         # Load entities, skipping deleted sessions (NoneType)
         sessions = [s for s in ndb.get_multi(s_keys) if s]
@@ -706,9 +1163,7 @@ class ConferenceApi(remote.Service):
         # Order the sessions by date and time
         sessions = sorted(sessions, key=lambda s: (s.date, s.startTime))
 
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        return self._copySessionsToForms(sessions)
 
 
     @endpoints.method(CONF_GET_REQUEST, StringMessage,
@@ -722,8 +1177,8 @@ class ConferenceApi(remote.Service):
         if not c_key.get():
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wck)
-        # Return memcache string for a particular conference
-        return StringMessage(data=memcache.get('featuredSpeaker_' + wck) or "")
+        # Served from memcache, falling back to the speaker tally
+        return StringMessage(data=speakers.featured(c_key))
 
 
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
@@ -741,55 +1196,99 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wck)
 
-        # Get sessions for conference and particular speaker and return list
-        s_query = Session.query(ancestor=c_key)
-        s_query = s_query.filter(Session.typeOfSession != 'workshop')
-        s_query = s_query.order(Session.typeOfSession)
-        s_query = s_query.order(Session.date)
-        s_query = s_query.order(Session.startTime)
+        # The planner runs the time range in the datastore and checks the
+        # type on each batch of sessions as it arrives
+        plan = self._sessionPlan(c_key, [
+            ('typeOfSession', '!=', 'workshop'),
+            ('startTime', '<', time(19)),
+        ])
+        records = sorted(planner.iterate(plan),
+                         key=lambda s: (s.date, s.startTime))
 
-        records = [sess for sess in s_query if sess.startTime < time(19)]
+        return self._copySessionsToForms(records)
 
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in records]
-        )
+
+    def _sessionPlan(self, c_key, filters):
+        """Return the query plan for a conference's sessions, in schedule
+        order after any range pushed to the datastore; see planner.py."""
+        return planner.plan(Session, filters, ancestor=c_key,
+                            orders=('date', 'startTime'))
+
+
+    @endpoints.method(SESS_QUERY_REQUEST, SessionForms,
+                      path='conference/{websafeConferenceKey}/sessions/query',
+                      http_method='POST', name='querySessions')
+    def querySessions(self, request):
+        """Query a conference's sessions, one page at a time.
+
+        Filters on TYPE, SPEAKER, DATE, START_TIME and DURATION can be
+        combined freely. Set `debug` to get the chosen query plan in
+        `queryPlan`."""
+        wck = request.websafeConferenceKey
+        # get Conference object from request; bail if not found
+        c_key = ndb.Key(urlsafe=wck)
+        if not c_key.get():
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wck)
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'limit' must be between 1 and %d." % MAX_PAGE_SIZE)
+
+        plan = self._sessionPlan(
+            c_key, self._formatFilters(request.filters, SESSION_FIELDS))
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) \
+                if request.pageToken else None
+            sessions, next_cursor = planner.fetchPage(plan, limit, cursor)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        forms = self._copySessionsToForms(sessions)
+        forms.nextPageToken = next_cursor and next_cursor.urlsafe()
+        if request.debug:
+            forms.queryPlan = planner.describe(plan)
+        return forms
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_SERIALIZER.toForm(
+            prof, conferenceKeysToAttend=seats.registrationIds(prof.key),
+            sessionKeysToAttend=wishlist.sessionKeys(prof.key))
 
 
     @checks_authorization
     def _getProfileFromUser(self, user=None):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile from datastore, creating new one if non-existent.
+
+        The same Profile object is returned for the rest of the request."""
         user_id = getUserId(user)
-        # get Profile from datastore
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
-        # create new Profile if not there
-        if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(),
-                mainEmail= user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
 
-        return profile      # return Profile
+        def load():
+            # get Profile from datastore
+            p_key = ndb.Key(Profile, user_id)
+            profile = p_key.get()
+            # create new Profile if not there
+            if not profile:
+                profile = Profile(
+                    key = p_key,
+                    displayName = user.nickname(),
+                    mainEmail= user.email(),
+                    teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+                )
+                profile.put()
+            if profile.sessionKeysToAttend:
+                # move a legacy wishlist into WishlistEntry children
+                profile = wishlist.migrate(p_key)
+            if profile.conferenceKeysToAttend:
+                # and legacy registrations into SeatReservations
+                profile = seats.migrate(p_key)
+            return profile
+
+        return requestcontext.memoize(('profile', user_id), load)
 
 
     def _doProfile(self, save_request=None):
@@ -830,44 +1329,58 @@ class ConferenceApi(remote.Service):
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
-
-
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return the announcement of nearly sold out conferences."""
+        # read on every call; registrations keep the set up to date
+        return StringMessage(data=announcements.announcement())
+
+
+    @endpoints.method(message_types.VoidMessage, CacheStatsForm,
+            path='cache/stats',
+            http_method='GET', name='getCacheStats')
+    def getCacheStats(self, request):
+        """Return read-through and token cache hit/miss counts and
+        memcache usage."""
+        hits, misses, mc_stats = cache.stats()
+        csf = CacheStatsForm(hits=hits, misses=misses)
+        if hits + misses:
+            csf.hitRatio = float(hits) / (hits + misses)
+        if mc_stats:
+            csf.items = mc_stats.get('items')
+            csf.bytes = mc_stats.get('bytes')
+        csf.tokenHits, csf.tokenMisses = tokeninfo.stats()
+        if csf.tokenHits + csf.tokenMisses:
+            csf.tokenHitRatio = (float(csf.tokenHits) /
+                                 (csf.tokenHits + csf.tokenMisses))
+        return csf
+
+
+    @endpoints.method(message_types.VoidMessage, DispatchStatsForm,
+            path='tasks/stats',
+            http_method='GET', name='getDispatchStats')
+    def getDispatchStats(self, request):
+        """Return task enqueue counts and latencies."""
+        stats = dispatch.stats()
+        dsf = DispatchStatsForm(tasks=stats['tasks'],
+                                duplicates=stats['duplicates'],
+                                batches=stats['batches'])
+        if stats['batches']:
+            dsf.addMsPerBatch = float(stats['addMs']) / stats['batches']
+        if stats['tasks']:
+            dsf.waitMsPerTask = float(stats['waitMs']) / stats['tasks']
+        return dsf
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
+        """Register or unregister user for selected conference.
+
+        Seats are taken from the conference's seat shards (see seats.py),
+        so registrations do not write the Conference entity."""
         retval = None
         prof = self._getProfileFromUser() # get user Profile
 
@@ -878,39 +1391,51 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        conf = seats.ensureShards(conf)
 
         # register
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            status = seats.reserve(conf, prof.key)
+            # check if user already registered
+            if status == seats.ALREADY_RESERVED:
                 raise ConflictException(
                     "You have already registered for this conference")
 
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            if status == seats.SOLD_OUT:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            # seats may be free, but could not be taken right now
+            if status == seats.BUSY:
+                raise ConflictException(
+                    "Registration is busy, please try again.")
             retval = True
 
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+            retval = seats.release(conf, prof.key) == seats.RELEASED
+
+        if retval:
+            live = seats.seatsAvailable(conf)
+            # the free seat facet follows Conference.seatsAvailable; roll
+            # it up now if the live count has moved to another bucket
+            if facets.seatsBucket(live) != \
+                    facets.seatsBucket(conf.seatsAvailable):
+                try:
+                    seats.rollup(conf.key)
+                except datastore_errors.Error:
+                    # the seat is taken; the rollup task seatsChanged()
+                    # enqueued will move the facet instead
+                    logging.warning('Seat rollup failed for %s', wsck,
+                                    exc_info=True)
+            # only a crossing of the threshold writes the set; if that
+            # fails, the rollup or the hourly reconcile fixes it later
+            try:
+                announcements.track(conf, live)
+            except datastore_errors.Error:
+                logging.warning('Nearly sold out update failed for %s',
+                                wsck, exc_info=True)
         return BooleanMessage(data=retval)
 
 
@@ -920,22 +1445,41 @@ class ConferenceApi(remote.Service):
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # the user's seat reservations hold the conference keys
+        conf_keys = seats.conferenceKeysAsync(prof.key).get_result()
+        # get conferences and their organizers, skipping deleted ones
+        conferences, names = queries.getMulti(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        # return set of ConferenceForm objects per Conference
+        return self._copyConferencesToForms(conferences, names)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
 
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+    @endpoints.method(CONF_PAGE_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @checks_authorization
+    def getConferenceAttendees(self, request, user=None):
+        """Return the attendees of a conference, one page at a time.
+        Open only to the organizer of the conference."""
+        conf = self._organizerConference(request.websafeConferenceKey,
+                                         getUserId(user), 'list attendees')
+        limit = request.limit or DEFAULT_PAGE_SIZE
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'limit' must be between 1 and %d." % MAX_PAGE_SIZE)
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) \
+                if request.pageToken else None
+            p_keys, next_cursor = seats.attendeesPage(conf.key, limit, cursor)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        # the registration index points at the attendees' profiles
+        profiles = [p for p in ndb.get_multi(p_keys) if p]
+        return AttendeeForms(
+            items=[AttendeeForm(displayName=p.displayName,
+                                mainEmail=p.mainEmail) for p in profiles],
+            nextPageToken=next_cursor and next_cursor.urlsafe())
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -954,7 +1498,62 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    def _copyTicketToForm(self, ticket):
+        """Copy relevant fields from RegistrationTicket to its form."""
+        tf = RegistrationTicketForm(
+            websafeTicketKey=ticket.key.urlsafe(),
+            status=ticket.status,
+            error=ticket.error,
+        )
+        if ticket.status == registration_queue.DONE:
+            tf.result = BooleanMessage(data=ticket.result)
+        return tf
+
+
+    def _queueRegistration(self, request, reg=True):
+        """Queue (un)registration for the batched registration worker."""
+        prof = self._getProfileFromUser() # get user Profile
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        if not c_key.get():
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        ticket = registration_queue.enqueue(c_key, prof.key, register=reg)
+        return self._copyTicketToForm(ticket)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/{websafeConferenceKey}/queue',
+            http_method='POST', name='queueRegistration')
+    def queueRegistration(self, request):
+        """Queue registration for selected conference; returns a ticket."""
+        return self._queueRegistration(request)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/{websafeConferenceKey}/queue',
+            http_method='DELETE', name='queueUnregistration')
+    def queueUnregistration(self, request):
+        """Queue unregistration from selected conference; returns a ticket."""
+        return self._queueRegistration(request, reg=False)
+
+
+    @endpoints.method(TICKET_GET_REQUEST, RegistrationTicketForm,
+            path='registration/{websafeTicketKey}',
+            http_method='GET', name='getRegistrationTicket')
+    def getRegistrationTicket(self, request):
+        """Poll a queued registration; result is set once status is DONE."""
+        prof = self._getProfileFromUser() # get user Profile
+        wtk = request.websafeTicketKey
+        t_key = ndb.Key(urlsafe=wtk)
+        ticket = t_key.get() if t_key.parent() == prof.key else None
+        if not ticket:
+            raise endpoints.NotFoundException(
+                'No registration ticket found with key: %s' % wtk)
+        return self._copyTicketToForm(ticket)
+
+
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
     def filterPlayground(self, request):
@@ -971,9 +1570,8 @@ class ConferenceApi(remote.Service):
 #        q = q.order(Conference.name)
         q = q.filter(Conference.maxAttendees > 10)
 
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
-        )
+        return self._copyConferencesToForms(*self._fetchPage(q, request))
 
 
-api = endpoints.api_server([ConferenceApi]) # register API
+# register API; memoizes identity and logs datastore RPCs per request
+api = requestcontext.middleware(endpoints.api_server([ConferenceApi]))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""dispatch.py
+
+Coalescing task dispatch.
+
+Tasks enqueued while serving an API request are collected and sent when
+its response is ready, with one asynchronous Queue.add per queue (per
+100 tasks), instead of one blocking taskqueue.add each. Outside an API
+request (task handlers, tests) tasks are sent straight away. Tasks
+enqueued inside a transaction are only sent once it commits.
+
+Every task gets a deterministic name, given by the caller or derived
+from its contents, so a task enqueued twice in a request is sent once
+and a retried request cannot add it again while the name is
+tombstoned. Callers that need a task to run again later must vary its
+name (e.g. with a time bucket).
+
+Enqueue counts and latencies are kept in memcache; see stats().
+
+$Id$
+
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import requestcontext
+
+DEFAULT_QUEUE = 'default'
+MAX_TASKS_PER_ADD = 100     # taskqueue limit per add call
+PENDING_KEY = 'dispatchPending'
+
+# memcache counters
+MEMCACHE_TASKS_KEY = 'dispatchTasks'
+MEMCACHE_DUPLICATES_KEY = 'dispatchDuplicates'
+MEMCACHE_BATCHES_KEY = 'dispatchBatches'
+MEMCACHE_ADD_MS_KEY = 'dispatchAddMs'
+MEMCACHE_WAIT_MS_KEY = 'dispatchWaitMs'
+
+
+def taskName(*parts):
+    """Return a task name made of `parts`, e.g. a url-safe key and a
+    time bucket."""
+    return '-'.join(str(part) for part in parts)
+
+
+def _contentName(url, params, kwargs):
+    content = json.dumps([url, params, kwargs], sort_keys=True, default=str)
+    return 'task-' + hashlib.sha1(content).hexdigest()
+
+
+def enqueue(url=None, params=None, name=None, queue_name=DEFAULT_QUEUE,
+            **kwargs):
+    """Enqueue a task; `kwargs` are passed on to taskqueue.Task (e.g.
+    countdown, or payload, method='PULL' and tag for pull queues).
+    Returns the task."""
+    if name is None:
+        name = _contentName(url, params, kwargs)
+    task = taskqueue.Task(url=url, params=params, name=name, **kwargs)
+    if ndb.in_transaction():
+        # runs straight away if the transaction already committed
+        ndb.get_context().call_on_commit(lambda: _add(queue_name, task))
+    else:
+        _add(queue_name, task)
+    return task
+
+
+def _add(queue_name, task):
+    pending = requestcontext.memoize(PENDING_KEY, collections.OrderedDict)
+    if requestcontext.atEnd(PENDING_KEY, flush):
+        pending.setdefault((queue_name, task.name), (task, time.time()))
+    else:
+        _send([(queue_name, task, time.time())])
+
+
+def flush():
+    """Send the tasks collected during the current request."""
+    pending = requestcontext.memoize(PENDING_KEY, collections.OrderedDict)
+    tasks = [(queue_name, task, queued)
+             for (queue_name, _), (task, queued) in pending.items()]
+    pending.clear()
+    if tasks:
+        _send(tasks)
+
+
+def _send(tasks):
+    """Add (queue name, task, enqueue time) tuples, one asynchronous add
+    per queue and chunk, and record the latencies."""
+    by_queue = collections.OrderedDict()
+    for queue_name, task, queued in tasks:
+        by_queue.setdefault(queue_name, []).append(task)
+    start = time.time()
+    rpcs = []
+    for queue_name, queue_tasks in by_queue.items():
+        queue = taskqueue.Queue(queue_name)
+        for i in range(0, len(queue_tasks), MAX_TASKS_PER_ADD):
+            chunk = queue_tasks[i:i + MAX_TASKS_PER_ADD]
+            rpcs.append((queue.add_async(chunk), chunk))
+    duplicates = 0
+    for rpc, chunk in rpcs:
+        try:
+            rpc.get_result()
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # the other tasks of the chunk were still added
+            duplicates += len([t for t in chunk if not t.was_enqueued])
+    done = time.time()
+    add_ms = int((done - start) * 1000)
+    wait_ms = int(sum(done - queued for _, _, queued in tasks) * 1000)
+    logging.info('dispatch: %d tasks, %d duplicates, %d adds in %d ms',
+                 len(tasks), duplicates, len(rpcs), add_ms)
+    memcache.offset_multi({
+        MEMCACHE_TASKS_KEY: len(tasks),
+        MEMCACHE_DUPLICATES_KEY: duplicates,
+        MEMCACHE_BATCHES_KEY: len(rpcs),
+        MEMCACHE_ADD_MS_KEY: add_ms,
+        MEMCACHE_WAIT_MS_KEY: wait_ms,
+    }, initial_value=0)
+
+
+def stats():
+    """Return a dict of enqueue counters: tasks, duplicates, batches (add
+    RPCs), addMs (total add RPC time) and waitMs (total time tasks spent
+    between enqueue() and being added)."""
+    counts = memcache.get_multi([
+        MEMCACHE_TASKS_KEY, MEMCACHE_DUPLICATES_KEY, MEMCACHE_BATCHES_KEY,
+        MEMCACHE_ADD_MS_KEY, MEMCACHE_WAIT_MS_KEY])
+    return {
+        'tasks': counts.get(MEMCACHE_TASKS_KEY, 0),
+        'duplicates': counts.get(MEMCACHE_DUPLICATES_KEY, 0),
+        'batches': counts.get(MEMCACHE_BATCHES_KEY, 0),
+        'addMs': counts.get(MEMCACHE_ADD_MS_KEY, 0),
+        'waitMs': counts.get(MEMCACHE_WAIT_MS_KEY, 0),
+    }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Precomputed conference counts per city, topic, month and free seats.
+
+The counts live in SHARD_COUNT `FacetShard` root entities, each holding
+a partial count for every facet value (e.g. "city:London") as JSON. A
+write adds its changes to one random shard, in the transaction that
+writes the Conference where there is one, so writes spread over the
+shards and the counts never drift from the conferences. Reading every
+facet is one get_multi of the shards, summed and cached in memcache.
+
+Free seats are counted in SEAT_BUCKETS of the rolled-up
+Conference.seatsAvailable (see seats.rollup()), so the counts agree with
+what queryConferences returns. The /tasks/rebuild_facets task recounts
+all conferences, e.g. for data that predates the counters.
+
+$Id$
+
+"""
+
+import collections
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetShard
+
+SHARD_COUNT = 20    # xg transactions are limited to 25 entity groups
+MEMCACHE_FACETS_KEY = 'facetCounts'
+CACHE_SECONDS = 30  # bounds a stale count cached while a write commits
+REBUILD_BATCH_SIZE = 500
+
+FACETS = ('city', 'topic', 'month', 'seats')
+
+# (lowest free seat count, label); conferences without a seat limit
+# are not counted
+SEAT_BUCKETS = (
+    (0, '0'),
+    (1, '1-9'),
+    (10, '10-49'),
+    (50, '50-99'),
+    (100, '100+'),
+)
+
+
+def shardKeys():
+    """Return the keys of all facet count shards."""
+    return [ndb.Key(FacetShard, i + 1) for i in range(SHARD_COUNT)]
+
+
+def seatsBucket(seats):
+    """Return the label of the bucket for a free seat count, or None."""
+    if seats is None:
+        return None
+    label = SEAT_BUCKETS[0][1]
+    for lowest, name in SEAT_BUCKETS:
+        if seats >= lowest:
+            label = name
+    return label
+
+
+def values(conf):
+    """Return the facet values of a Conference, e.g. 'city:London'."""
+    if conf is None:
+        return []
+    found = ['topic:%s' % topic for topic in set(conf.topics)]
+    if conf.city:
+        found.append('city:%s' % conf.city)
+    if conf.month:
+        found.append('month:%d' % conf.month)
+    bucket = seatsBucket(conf.seatsAvailable)
+    if bucket:
+        found.append('seats:%s' % bucket)
+    return found
+
+
+@ndb.transactional
+def _addToShard(deltas):
+    s_key = random.choice(shardKeys())
+    shard = s_key.get() or FacetShard(key=s_key, counts={})
+    for value, delta in deltas.iteritems():
+        count = shard.counts.get(value, 0) + delta
+        if count:
+            shard.counts[value] = count
+        else:
+            shard.counts.pop(value, None)
+    shard.put()
+
+
+def update(before=(), after=()):
+    """Count a conference under its `after` facet values instead of its
+    `before` ones (see values()).
+
+    Joins the caller's transaction, which must then be xg."""
+    deltas = collections.Counter(after)
+    deltas.subtract(before)
+    deltas = dict((value, delta) for value, delta in deltas.iteritems()
+                  if delta)
+    if not deltas:
+        return
+    _addToShard(deltas)
+    # runs straight away when not in a transaction
+    ndb.get_context().call_on_commit(
+        lambda: memcache.delete(MEMCACHE_FACETS_KEY))
+
+
+def _sum(shards):
+    totals = collections.Counter()
+    for shard in shards:
+        if shard:
+            totals.update(shard.counts)
+    return dict((value, count) for value, count in totals.iteritems()
+                if count > 0)
+
+
+def counts():
+    """Return {facet value: number of conferences} for all facets."""
+    totals = memcache.get(MEMCACHE_FACETS_KEY)
+    if totals is None:
+        totals = _sum(ndb.get_multi(shardKeys()))
+        memcache.add(MEMCACHE_FACETS_KEY, totals, time=CACHE_SECONDS)
+    return totals
+
+
+@ndb.transactional(xg=True)
+def _store(totals):
+    shards = [FacetShard(key=s_key, counts={}) for s_key in shardKeys()]
+    shards[0].counts = totals
+    ndb.put_multi(shards)
+
+
+def rebuild():
+    """Recount all conferences into the shards.
+
+    Writes made while the conferences are read may be miscounted; run it
+    when conferences are not being edited."""
+    totals = collections.Counter()
+    for conf in Conference.query().iter(batch_size=REBUILD_BATCH_SIZE):
+        totals.update(values(conf))
+    _store(dict(totals))
+    memcache.delete(MEMCACHE_FACETS_KEY)
+    return totals
@@ -18,14 +18,22 @@ import webapp2
 import unittest
 from google.appengine.api import app_identity
 from google.appengine.api import mail
-from google.appengine.api import memcache
-from conference import ConferenceApi
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+import seats
+import registration_queue
+import speakers
+import wishlist
+import speaker_index
+import textsearch
+import facets
+import announcements
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        """Reconcile the nearly sold out conferences."""
+        announcements.reconcile()
         self.response.set_status(204)
 
 
@@ -45,12 +53,66 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
+        """Copy a conference's featured speaker into memcache."""
         wck = self.request.get('websafeConferenceKey')
-        speaker = self.request.get('speaker')
-        # Set new featured speaker in memcache if necessary
-        sessions = ConferenceApi._conferenceSessionsBySpeaker(wck, speaker)
-        if sessions.count() >= 2:
-            memcache.set(key="featuredSpeaker_" + wck, value=speaker)
+        speakers.publish(ndb.Key(urlsafe=wck))
+
+
+class RollupSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy seat shard totals into Conference.seatsAvailable."""
+        wck = self.request.get('websafeConferenceKey')
+        seats.rollup(ndb.Key(urlsafe=wck))
+
+
+class DrainRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply queued registrations for a conference in batches."""
+        wck = self.request.get('websafeConferenceKey')
+        registration_queue.drain(ndb.Key(urlsafe=wck))
+
+
+class MigrateWishlistsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move legacy profile wishlists into WishlistEntry children."""
+        cursor = self.request.get('cursor')
+        wishlist.migrateAll(Cursor(urlsafe=cursor) if cursor else None)
+    get = post
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move legacy profile registrations into SeatReservations."""
+        cursor = self.request.get('cursor')
+        seats.migrateAll(Cursor(urlsafe=cursor) if cursor else None)
+    get = post
+
+
+class IndexSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add sessions to the speaker index, for one conference or all."""
+        wck = self.request.get('websafeConferenceKey')
+        cursor = self.request.get('cursor')
+        speaker_index.backfill(ndb.Key(urlsafe=wck) if wck else None,
+                               Cursor(urlsafe=cursor) if cursor else None)
+    get = post
+
+
+class IndexSearchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index conferences and their sessions for search, one or all."""
+        wck = self.request.get('websafeConferenceKey')
+        cursor = self.request.get('cursor')
+        textsearch.reindex(ndb.Key(urlsafe=wck) if wck else None,
+                           Cursor(urlsafe=cursor) if cursor else None)
+    get = post
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recount the conference facet counters."""
+        facets.rebuild()
+    get = post
 
 
 class TestSuiteHandler(webapp2.RequestHandler):
@@ -66,6 +128,19 @@ class TestSuiteHandler(webapp2.RequestHandler):
             self.response.write(" Localhost Tests \n")
             self.response.write("=================\n\n")
             suite.addTest(loader.discover('tests', 'test_datastore.py'))
+            suite.addTest(loader.discover('tests', 'test_seats.py'))
+            suite.addTest(loader.discover('tests', 'test_tokeninfo.py'))
+            suite.addTest(loader.discover('tests', 'test_requestcontext.py'))
+            suite.addTest(loader.discover('tests', 'test_speakers.py'))
+            suite.addTest(loader.discover('tests', 'test_dispatch.py'))
+            suite.addTest(loader.discover('tests', 'test_bulk.py'))
+            suite.addTest(loader.discover('tests', 'test_wishlist.py'))
+            suite.addTest(loader.discover('tests', 'test_planner.py'))
+            suite.addTest(loader.discover('tests', 'test_speaker_index.py'))
+            suite.addTest(loader.discover('tests', 'test_textsearch.py'))
+            suite.addTest(loader.discover('tests', 'test_facets.py'))
+            suite.addTest(loader.discover('tests', 'test_announcements.py'))
+            suite.addTest(loader.discover('tests', 'test_registration_queue.py'))
             suite.addTest(loader.discover('tests', 'test_endpoints.py'))
         else:
             # Run datastore and UNauthorized enpoint tests
@@ -73,15 +148,44 @@ class TestSuiteHandler(webapp2.RequestHandler):
             self.response.write(" Deployment Tests \n")
             self.response.write("==================\n\n")
             suite.addTest(loader.discover('tests', 'test_datastore.py'))
+            suite.addTest(loader.discover('tests', 'test_seats.py'))
+            suite.addTest(loader.discover('tests', 'test_tokeninfo.py'))
+            suite.addTest(loader.discover('tests', 'test_requestcontext.py'))
+            suite.addTest(loader.discover('tests', 'test_speakers.py'))
+            suite.addTest(loader.discover('tests', 'test_dispatch.py'))
+            suite.addTest(loader.discover('tests', 'test_bulk.py'))
+            suite.addTest(loader.discover('tests', 'test_wishlist.py'))
+            suite.addTest(loader.discover('tests', 'test_planner.py'))
+            suite.addTest(loader.discover('tests', 'test_speaker_index.py'))
+            suite.addTest(loader.discover('tests', 'test_textsearch.py'))
+            suite.addTest(loader.discover('tests', 'test_facets.py'))
+            suite.addTest(loader.discover('tests', 'test_announcements.py'))
             suite.addTest(loader.discover('tests', 'test_unauth*.py'))
         # TextTestRunner requires flush-able stream. Add empty function.
         self.response.flush = lambda: None
         unittest.TextTestRunner(self.response).run(suite)
 
 
+class BenchmarkHandler(webapp2.RequestHandler):
+    def get(self):
+        """Run the datastore stub benchmarks in tests/bench_*.py."""
+        suite = unittest.TestLoader().discover('tests', 'bench_*.py')
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.flush = lambda: None
+        unittest.TextTestRunner(self.response, verbosity=2).run(suite)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/rollup_seats', RollupSeatsHandler),
+    ('/tasks/drain_registrations', DrainRegistrationsHandler),
+    ('/tasks/migrate_wishlists', MigrateWishlistsHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/index_speakers', IndexSpeakersHandler),
+    ('/tasks/index_search', IndexSearchHandler),
+    ('/tasks/rebuild_facets', RebuildFacetsHandler),
     ('/tests', TestSuiteHandler),
+    ('/benchmarks', BenchmarkHandler),
 ], debug=True)
@@ -26,8 +26,8 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True)  # legacy; see seats.py
+    sessionKeysToAttend = ndb.StringProperty(repeated=True)  # legacy; see wishlist.py
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -50,6 +50,25 @@ class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class CacheStatsForm(messages.Message):
+    """CacheStatsForm -- read-through cache statistics outbound message"""
+    hits = messages.IntegerField(1)
+    misses = messages.IntegerField(2)
+    hitRatio = messages.FloatField(3)
+    items = messages.IntegerField(4)
+    bytes = messages.IntegerField(5)
+    tokenHits = messages.IntegerField(6)
+    tokenMisses = messages.IntegerField(7)
+    tokenHitRatio = messages.FloatField(8)
+
+class DispatchStatsForm(messages.Message):
+    """DispatchStatsForm -- task enqueue statistics outbound message"""
+    tasks = messages.IntegerField(1)
+    duplicates = messages.IntegerField(2)
+    batches = messages.IntegerField(3)
+    addMsPerBatch = messages.FloatField(4)
+    waitMsPerTask = messages.FloatField(5)
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -62,6 +81,77 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    # see announcements.DEFAULT_THRESHOLD
+    nearlySoldOutThreshold = ndb.IntegerProperty(default=5, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a conference's seat capacity"""
+    conference      = ndb.KeyProperty(kind=Conference, required=True)
+    index           = ndb.IntegerProperty(required=True, indexed=False)
+    capacity        = ndb.IntegerProperty(default=0, indexed=False)
+    reserved        = ndb.IntegerProperty(default=0, indexed=False)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- names of nearly sold out conferences by websafe key
+
+    Single root entity; see announcements.py."""
+    conferences     = ndb.JsonProperty()
+
+class FacetShard(ndb.Model):
+    """FacetShard -- partial conference counts per facet value
+
+    Root entity; the shards add up to the counts. See facets.py."""
+    counts          = ndb.JsonProperty()
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- conference count for one facet value"""
+    value           = messages.StringField(1)
+    count           = messages.IntegerField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- conference counts of one facet outbound form message"""
+    name = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class FacetForms(messages.Message):
+    """FacetForms -- conference counts of all facets outbound form message"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
+
+class SeatReservation(ndb.Model):
+    """SeatReservation -- registration and reserved seat; child of Profile
+
+    The key id is the websafe key of the conference. The shard is None
+    for seats taken before the conference was sharded."""
+    conference      = ndb.KeyProperty(kind=Conference, required=True)
+    shard           = ndb.IntegerProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- conference attendee outbound form message"""
+    displayName     = messages.StringField(1)
+    mainEmail       = messages.StringField(2)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- one page of attendees outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class RegistrationTicket(ndb.Model):
+    """RegistrationTicket -- queued (un)registration request; child of Profile"""
+    conference      = ndb.KeyProperty(kind=Conference, required=True)
+    register        = ndb.BooleanProperty(default=True)
+    status          = ndb.StringProperty(default='PENDING')
+    result          = ndb.BooleanProperty()
+    error           = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- queued registration outbound form message"""
+    websafeTicketKey = messages.StringField(1)
+    status          = messages.StringField(2)
+    result          = messages.MessageField(BooleanMessage, 3)
+    error           = messages.StringField(4)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,10 +167,13 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    nearlySoldOutThreshold = messages.IntegerField(13)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -109,6 +202,10 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    limit = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    fields = messages.StringField(4)
+    debug = messages.BooleanField(5)
 
 class Session(ndb.Model):
     """Session -- Session object
@@ -139,3 +236,103 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3)
+
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- Session query inbound form message"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    limit = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    debug = messages.BooleanField(4)
+
+class SessionResult(messages.Message):
+    """SessionResult -- outcome of one item of a session batch"""
+    index           = messages.IntegerField(1)
+    session         = messages.MessageField(SessionForm, 2)
+    error           = messages.StringField(3)
+
+class SessionResults(messages.Message):
+    """SessionResults -- outcomes of a session batch outbound message"""
+    items = messages.MessageField(SessionResult, 1, repeated=True)
+
+class WishlistForm(messages.Message):
+    """WishlistForm -- session keys to add to or remove from a wishlist"""
+    websafeSessionKeys = messages.StringField(1, repeated=True)
+
+class WishlistResult(messages.Message):
+    """WishlistResult -- outcome for one session key of a wishlist batch"""
+    websafeSessionKey = messages.StringField(1)
+    changed         = messages.BooleanField(2)
+    error           = messages.StringField(3)
+
+class WishlistResults(messages.Message):
+    """WishlistResults -- outcomes of a wishlist batch outbound message"""
+    items = messages.MessageField(WishlistResult, 1, repeated=True)
+
+class ConferenceSchedule(ndb.Model):
+    """ConferenceSchedule -- sorted, serialized SessionForms of a conference
+
+    Child of the Conference; see schedule.py."""
+    payload         = ndb.BlobProperty(compressed=True)
+    count           = ndb.IntegerProperty(indexed=False)
+    oversized       = ndb.BooleanProperty(default=False, indexed=False)
+
+class SpeakerTally(ndb.Model):
+    """SpeakerTally -- session counts per speaker of a conference
+
+    Child of the Conference; see speakers.py."""
+    sessionSpeakers = ndb.JsonProperty(compressed=True)
+    counts          = ndb.JsonProperty(compressed=True)
+    featured        = ndb.StringProperty(indexed=False)
+    version         = ndb.IntegerProperty(indexed=False, default=0)
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- session in a user's wishlist; child of Profile
+
+    The key id is the websafe key of the session; see wishlist.py."""
+    conferenceKey   = ndb.KeyProperty(kind=Conference, required=True)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class Speaker(ndb.Model):
+    """Speaker -- keys of a speaker's sessions across all conferences
+
+    Root entity keyed by the normalised speaker name; see speaker_index.py."""
+    name            = ndb.StringProperty(indexed=False)
+    sessionKeys     = ndb.KeyProperty(kind=Session, repeated=True, indexed=False)
+
+class SpeakerPrefix(ndb.Model):
+    """SpeakerPrefix -- sorted speaker names sharing their first letters
+
+    Root entity keyed by the prefix of the normalised names; `names` holds
+    the display names in the order of `canonical`. See speaker_index.py."""
+    canonical       = ndb.StringProperty(repeated=True, indexed=False)
+    names           = ndb.StringProperty(repeated=True, indexed=False)
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- speaker directory entry outbound form message"""
+    name            = messages.StringField(1)
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- speaker names in name order outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- conference or session search hit outbound form"""
+    kind            = messages.StringField(1)
+    websafeKey      = messages.StringField(2)
+    name            = messages.StringField(3)
+    score           = messages.FloatField(4)
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- one page of ranked search hits outbound form"""
+    items = messages.MessageField(SearchResultForm, 1, repeated=True)
+    total = messages.IntegerField(2)
+    nextPageToken = messages.StringField(3)
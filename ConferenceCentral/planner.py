@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Query planner for queryConferences and querySessions.
+
+The datastore allows inequality filters on one property only, and each
+combination of filters and sort orders needs its own composite index.
+The planner instead pushes a selective part of the filters down to the
+datastore, limited to what an index in index.yaml (or a built-in index)
+can serve, and the remaining filters are applied to the entities as
+they stream in (see fetchPage() and queries.fetchPageAsync). Any
+number of fields can then carry range and `!=` filters, and only one
+batch of entities is held in memory while they are checked.
+
+Filters are ranked by a rough selectivity estimate: an equality is
+taken to be the most selective, then a range bounded on both sides,
+then a one-sided range. The best one is pushed down, and more are added
+while an index still covers them. `!=` filters are never pushed down,
+since the datastore runs them as two merged queries.
+
+$Id$
+
+"""
+
+import collections
+import operator
+
+from google.appengine.ext import ndb
+
+import queries
+
+EQ = '='
+NE = '!='
+LOWER = ('>', '>=')
+UPPER = ('<', '<=')
+ORDER = 'name'      # results are sorted on the name after any range
+BATCH_SIZE = 100    # entities per datastore batch when post-filtering
+MAX_SCAN = 1000     # rejected entities read per page
+
+# estimated fraction of entities a filter lets through
+SELECTIVITY = {
+    'equality': 0.1,
+    'bounded': 0.25,
+    'range': 0.5,
+}
+
+_COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+Plan = collections.namedtuple('Plan', 'query match pushed post orders')
+
+
+def _candidates(filters):
+    """Return the filter groups that could be pushed down, best first.
+
+    Each group is (score, position, property, filters, is_range): one
+    equality filter, or all range filters on one property."""
+    groups, ranges = [], collections.OrderedDict()
+    for position, (name, op, value) in enumerate(filters):
+        if op == EQ:
+            groups.append((SELECTIVITY['equality'], position, name,
+                           [(name, op, value)], False))
+        elif op != NE:
+            ranges.setdefault(name, (position, []))[1].append(
+                (name, op, value))
+    for name, (position, group) in ranges.iteritems():
+        ops = set(op for _, op, _ in group)
+        bounded = ops & set(LOWER) and ops & set(UPPER)
+        score = SELECTIVITY['bounded' if bounded else 'range']
+        groups.append((score, position, name, group, True))
+    return sorted(groups)
+
+
+def _orders(equality, range_name, orders):
+    # a range sorts first; properties fixed by an equality need no sort
+    names = ([range_name] if range_name else []) + \
+        [name for name in orders if name != range_name]
+    return [name for name in names if name not in equality]
+
+
+def plan(model, filters, ancestor=None, orders=(ORDER,)):
+    """Plan a query on `model` for (property, operator, value) filters,
+    sorted on `orders` after any pushed down range property.
+
+    Returns a Plan holding the datastore query, a predicate for the
+    filters left over (None if all were pushed down), the pushed and the
+    post filters and the sort order."""
+    kind = model._get_kind()
+    default_orders = list(orders)
+    equality, range_name = [], None
+    pushed = []
+    for score, _, name, group, is_range in _candidates(filters):
+        if is_range:
+            if range_name:
+                continue
+            trial_eq, trial_range = equality, name
+        else:
+            if name in equality:
+                # one value per property; the index lists it once
+                continue
+            trial_eq, trial_range = equality + [name], range_name
+        orders = _orders(trial_eq, trial_range, default_orders)
+        if queries.hasSortIndex(kind, ancestor is not None, trial_eq, orders):
+            equality, range_name = trial_eq, trial_range
+            pushed.extend(group)
+
+    post = [f for f in filters if f not in pushed]
+    orders = _orders(equality, range_name, default_orders)
+    query = model.query(ancestor=ancestor)
+    for name, op, value in pushed:
+        query = query.filter(ndb.query.FilterNode(name, op, value))
+    for name in orders:
+        query = query.order(model._properties[name])
+    return Plan(query, matcher(post), pushed, post, orders)
+
+
+def matcher(filters):
+    """Return a predicate that checks an entity against filters the way
+    the datastore would, or None if there are none.
+
+    None sorts before all other values, and an empty repeated property
+    never matches. On a repeated property each filter needs one matching
+    value, and all range filters on it must be met by the same value."""
+    if not filters:
+        return None
+    by_name = collections.OrderedDict()
+    for name, op, value in filters:
+        by_name.setdefault(name, []).append((op, value))
+
+    def match(entity):
+        for name, checks in by_name.iteritems():
+            values = getattr(entity, name, None)
+            if not isinstance(values, list):
+                values = [values]
+            bounds = [(_COMPARE[op], value) for op, value in checks
+                      if op in LOWER + UPPER]
+            if bounds and not any(all(cmp(v, value) for cmp, value in bounds)
+                                  for v in values):
+                return False
+            for op, value in checks:
+                if op in (EQ, NE) and not any(_COMPARE[op](v, value)
+                                              for v in values):
+                    return False
+        return True
+    return match
+
+
+def iterate(plan, batch_size=BATCH_SIZE):
+    """Yield the entities matching a plan, reading batch by batch."""
+    for entity in plan.query.iter(batch_size=batch_size):
+        if plan.match is None or plan.match(entity):
+            yield entity
+
+
+def fetchPage(plan, limit, start_cursor=None):
+    """Fetch one page of the entities matching a plan.
+
+    Reading stops once the page is full or MAX_SCAN entities were
+    rejected, so a page can be short. Returns (entities, next_cursor);
+    next_cursor is None on the last page."""
+    it = plan.query.iter(start_cursor=start_cursor, produce_cursors=True,
+                         batch_size=BATCH_SIZE if plan.match else limit)
+    entities, rejected = [], 0
+    while len(entities) < limit and rejected < MAX_SCAN and it.has_next():
+        entity = it.next()
+        if plan.match is None or plan.match(entity):
+            entities.append(entity)
+        else:
+            rejected += 1
+    next_cursor = None
+    if (entities or rejected) and it.probably_has_next():
+        next_cursor = it.cursor_after()
+    return entities, next_cursor
+
+
+def _format(filters):
+    return ' AND '.join('%s %s %s' % f for f in filters)
+
+
+def describe(plan):
+    """Return a one line description of a plan for debugging."""
+    text = 'datastore: %s ORDER BY %s' % (
+        _format(plan.pushed) or 'all', ', '.join(plan.orders))
+    if plan.post:
+        text += '; post-filter: %s' % _format(plan.post)
+    return text
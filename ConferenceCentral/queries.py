@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+"""queries.py
+
+Conference query executor shared by the listing endpoints.
+
+Results are materialised once, and the organiser Profile lookups are
+deduplicated and issued asynchronously while the query is still
+fetching, so listing N conferences from M organisers costs one query
+plus M batched key gets. Missing organiser profiles are tolerated.
+
+Listing endpoints can also ask for a subset of form fields. The query
+is then run as a projection query when an index in index.yaml can serve
+it, and otherwise as a keys-only query whose entities come from ndb's
+memcache-backed entity cache.
+
+$Id$
+
+"""
+
+import os
+
+import yaml
+from google.appengine.datastore import datastore_query
+from google.appengine.ext import ndb
+
+from models import Profile
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'index.yaml')
+
+# form fields that are not entity properties -> properties they need
+DERIVED_FIELDS = {
+    'websafeKey': (),
+    'organizerDisplayName': ('organizerUserId',),
+}
+
+MAX_SCAN = 1000     # entities read per page when post-filtering
+
+_indexes = None
+
+
+def parseFields(form_class, fields):
+    """Parse a comma separated `fields` selector into a set of form field
+    names, or None for all fields. Raises ValueError on unknown names."""
+    if not fields:
+        return None
+    names = set(name.strip() for name in fields.split(',') if name.strip())
+    unknown = names - set(field.name for field in form_class.all_fields())
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    return names
+
+
+def _loadIndexes():
+    global _indexes
+    if _indexes is None:
+        with open(INDEX_FILE) as f:
+            indexes = yaml.safe_load(f).get('indexes') or []
+        _indexes = [(idx['kind'], bool(idx.get('ancestor')),
+                     [prop['name'] for prop in idx.get('properties', [])])
+                    for idx in indexes]
+    return _indexes
+
+
+def _orderNames(order):
+    if order is None:
+        return []
+    if isinstance(order, datastore_query.CompositeOrder):
+        return [name for o in order.orders for name in _orderNames(o)]
+    return [order.prop]
+
+
+def _queryShape(query):
+    """Return (equality properties, sort order properties) of a query,
+    or None if its filters are too complex to plan a projection for."""
+    equality, inequality = set(), set()
+    nodes = [query.filters] if query.filters else []
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ndb.query.ConjunctionNode):
+            nodes.extend(node)
+        elif isinstance(node, ndb.query.FilterNode):
+            name, opsymbol, _ = node.__getnewargs__()
+            (equality if opsymbol == '=' else inequality).add(name)
+        else:
+            return None
+    orders = _orderNames(query.orders)
+    # an inequality sorts on its property first, even if not ordered
+    orders = [name for name in inequality if name not in orders] + orders
+    return equality, orders
+
+
+def _hasIndex(kind, ancestor, equality, orders, projected):
+    """Check whether an index can serve a projection query."""
+    # single property projections use the built-in indexes
+    if not ancestor and not equality and len(projected) == 1 and \
+            set(orders) <= projected:
+        return True
+    n, m = len(equality), len(orders)
+    for i_kind, i_ancestor, names in _loadIndexes():
+        if i_kind != kind or i_ancestor != ancestor:
+            continue
+        if set(names[:n]) == equality and names[n:n + m] == orders and \
+                set(names[n + m:]) == projected - set(orders):
+            return True
+    return False
+
+
+def hasSortIndex(kind, ancestor, equality, orders):
+    """Check whether an index can serve a query with `equality` filters
+    sorted on `orders` (the inequality property first, if any)."""
+    if not ancestor and not equality and len(orders) <= 1:
+        return True
+    n = len(equality)
+    for i_kind, i_ancestor, names in _loadIndexes():
+        if i_kind == kind and i_ancestor == ancestor and \
+                set(names[:n]) == set(equality) and names[n:] == orders:
+            return True
+    return False
+
+
+def fetchOptions(query, model_class, fields):
+    """Choose how to run `query` when only form `fields` are needed.
+
+    Returns query options for iter()/fetch(): {} for full entities,
+    {'projection': [...]} or {'keys_only': True}."""
+    if fields is None:
+        return {}
+    props = set()
+    for name in fields:
+        props.update(DERIVED_FIELDS.get(name, (name,)))
+    props &= set(model_class._properties)
+    shape = _queryShape(query)
+    if props and shape is not None:
+        equality, orders = shape
+        projectable = all(
+            model_class._properties[name]._indexed and
+            not model_class._properties[name]._repeated
+            for name in props)
+        if projectable and not props & equality and _hasIndex(
+                model_class._get_kind(), query.ancestor is not None,
+                equality, orders, props):
+            return {'projection': sorted(props)}
+    # entities then come from ndb's memcache cache when they can
+    return {'keys_only': True}
+
+
+@ndb.tasklet
+def fetchAllAsync(query, options=None):
+    """Run a query with fetchOptions() and return full or projected
+    entities."""
+    options = options or {}
+    if options.get('keys_only'):
+        keys = yield query.fetch_async(keys_only=True)
+        entities = yield ndb.get_multi_async(keys)
+        raise ndb.Return([e for e in entities if e])
+    entities = yield query.fetch_async(**options)
+    raise ndb.Return(entities)
+
+
+def fetchAll(query, options=None):
+    """Synchronous version of fetchAllAsync()."""
+    return fetchAllAsync(query, options).get_result()
+
+
+def organizerKey(conf):
+    """Return the Profile key of a conference's organiser, or None."""
+    if conf.organizerUserId:
+        return ndb.Key(Profile, conf.organizerUserId)
+    # conferences are created as children of the organiser's Profile
+    parent = conf.key.parent() if conf.key else None
+    if parent and parent.kind() == Profile._get_kind():
+        return parent
+    return None
+
+
+def _displayNames(keys, profiles):
+    return dict((key, getattr(prof, 'displayName', None) or '')
+                for key, prof in zip(keys, profiles))
+
+
+@ndb.tasklet
+def fetchPageAsync(query, limit, start_cursor=None, options=None,
+                   organizers=True, match=None):
+    """Fetch one page of a Conference query with organiser names.
+
+    `options` come from fetchOptions(). If `match` is given, only the
+    full entities it accepts are returned; the query is read until the
+    page is full or MAX_SCAN entities were rejected, so a page can be
+    short. Returns (conferences, names, next_cursor) where `names` maps
+    organiser Profile keys to display names (empty unless `organizers`)
+    and `next_cursor` is None on the last page."""
+    options = options or {}
+    keys_only = options.get('keys_only', False)
+    if match is None:
+        # one extra result tells whether there is a next page; the loop
+        # stops before reading it, like ndb's fetch_page()
+        it = query.iter(limit=limit + 1, start_cursor=start_cursor,
+                        produce_cursors=True, keys_only=keys_only,
+                        projection=options.get('projection'))
+    else:
+        it = query.iter(start_cursor=start_cursor, produce_cursors=True,
+                        batch_size=limit)
+    confs, lookups = [], {}
+    scanned = 0
+
+    def lookup(conf):
+        key = organizerKey(conf)
+        if key and key not in lookups:
+            lookups[key] = key.get_async()
+
+    while (yield it.has_next_async()):
+        conf = it.next()
+        scanned += 1
+        if match is not None and not match(conf):
+            if scanned >= MAX_SCAN:
+                break
+            continue
+        confs.append(conf)
+        if organizers and not keys_only:
+            # started now, so it overlaps the rest of the query fetch
+            lookup(conf)
+        if len(confs) >= limit:
+            break
+    next_cursor = None
+    if scanned and it.probably_has_next():
+        next_cursor = it.cursor_after()
+    if keys_only:
+        confs = [conf for conf in (yield ndb.get_multi_async(confs)) if conf]
+        if organizers:
+            for conf in confs:
+                lookup(conf)
+    keys = lookups.keys()
+    profiles = yield [lookups[key] for key in keys]
+    raise ndb.Return((confs, _displayNames(keys, profiles), next_cursor))
+
+
+def fetchPage(query, limit, start_cursor=None, options=None,
+              organizers=True, match=None):
+    """Synchronous version of fetchPageAsync()."""
+    return fetchPageAsync(query, limit, start_cursor, options,
+                          organizers, match).get_result()
+
+
+@ndb.tasklet
+def getMultiAsync(c_keys):
+    """Get conferences by key with organiser names.
+
+    Organisers are looked up from the parent of each conference key
+    together with the conferences themselves; conferences without a
+    Profile parent are resolved once they arrive. Deleted conferences
+    are skipped. Returns (conferences, names)."""
+    p_keys = list(set(k.parent() for k in c_keys if k.parent() and
+                      k.parent().kind() == Profile._get_kind()))
+    confs, profiles = yield (ndb.get_multi_async(c_keys),
+                             ndb.get_multi_async(p_keys))
+    confs = [conf for conf in confs if conf]
+    names = _displayNames(p_keys, profiles)
+    # organizerUserId wins over the key parent (see organizerKey)
+    extra = list(set(organizerKey(c) for c in confs) - set(names))
+    extra = [key for key in extra if key]
+    if extra:
+        names.update(_displayNames(extra, (yield ndb.get_multi_async(extra))))
+    raise ndb.Return((confs, names))
+
+
+def getMulti(c_keys):
+    """Synchronous version of getMultiAsync()."""
+    return getMultiAsync(c_keys).get_result()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""registration_queue.py
+
+Batched registration mode for sold-out rushes.
+
+Instead of running one transaction per `registerForConference` call,
+requests are recorded as `RegistrationTicket` entities and queued on the
+`registrations` pull queue, tagged with the conference key. A drain task
+leases a batch of requests for one conference and applies all of them
+in a single cross-group transaction over the attendees' reservations
+and a few seat shards. Requests whose shards were filled in the meantime
+are planned again; only once every shard is seen full are they refused.
+Clients poll their ticket for the final result.
+
+$Id$
+
+"""
+
+import json
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.ext import ndb
+
+from models import RegistrationTicket
+from models import SeatReservation
+import dispatch
+import seats
+
+QUEUE_NAME = 'registrations'
+BATCH_SIZE = 16     # profiles per transaction; leaves room for shards
+MAX_GROUPS = 25     # entity group limit of an xg transaction
+LEASE_SECONDS = 60
+DRAIN_INTERVAL = 1  # seconds; drain tasks are coalesced per interval
+
+PENDING = 'PENDING'
+DONE = 'DONE'
+
+ALREADY_REGISTERED = 'You have already registered for this conference'
+NO_SEATS = 'There are no seats available.'
+
+
+def enqueue(c_key, p_key, register=True):
+    """Queue a (un)registration request and return its ticket."""
+    ticket = RegistrationTicket(parent=p_key, conference=c_key,
+                                register=register, status=PENDING)
+    ticket.put()
+    wsck = c_key.urlsafe()
+    dispatch.enqueue(
+        payload=json.dumps({'ticket': ticket.key.urlsafe()}),
+        name=dispatch.taskName('ticket', ticket.key.urlsafe()),
+        queue_name=QUEUE_NAME, method='PULL', tag=wsck)
+    scheduleDrain(wsck)
+    return ticket
+
+
+def scheduleDrain(wsck, countdown=DRAIN_INTERVAL):
+    """Add a drain task for a conference unless one is already pending."""
+    dispatch.enqueue(
+        url='/tasks/drain_registrations',
+        params={'websafeConferenceKey': wsck},
+        name=dispatch.taskName('drain-registrations', wsck,
+                               int(time.time() // DRAIN_INTERVAL)),
+        countdown=countdown,
+    )
+
+
+def drain(c_key):
+    """Apply queued requests for a conference until its queue is empty.
+
+    Returns the number of requests applied."""
+    q = taskqueue.Queue(QUEUE_NAME)
+    conf = seats.ensureShards(c_key.get())
+    applied = 0
+    while True:
+        tasks = q.lease_tasks_by_tag(LEASE_SECONDS, BATCH_SIZE,
+                                     tag=c_key.urlsafe())
+        if not tasks:
+            return applied
+        t_keys = [ndb.Key(urlsafe=json.loads(t.payload)['ticket'])
+                  for t in tasks]
+        try:
+            done = applyBatch(conf, t_keys)
+        except TransactionFailedError:
+            # leases run out and the requests are picked up again
+            scheduleDrain(c_key.urlsafe(), countdown=LEASE_SECONDS)
+            return applied
+        q.delete_tasks([t for t, k in zip(tasks, t_keys) if k in done])
+        # hand back whatever did not fit into this transaction
+        for task, t_key in zip(tasks, t_keys):
+            if t_key not in done:
+                q.modify_task_lease(task, 0)
+        applied += len(done)
+
+
+def _planBatch(conf, tickets, reservations):
+    """Choose, outside of the transaction, which tickets of a batch fit
+    into one transaction and which seat shards it must touch.
+
+    Returns (tickets, shard keys, complete); `complete` is True if the
+    shard keys include every shard that had free seats."""
+    s_keys = seats.shardKeys(conf.key, conf.seatShards)
+    shards = [s for s in ndb.get_multi(s_keys) if s]
+    # registrations share a pool of the shards with the most free seats
+    wanted = len([t for t in tickets if t.register])
+    pool, free = [], 0
+    for shard in sorted(shards, key=lambda s: s.reserved - s.capacity):
+        if free >= wanted or shard.capacity <= shard.reserved:
+            break
+        pool.append(shard.key)
+        free += shard.capacity - shard.reserved
+    complete = len(pool) == len([s for s in shards
+                                 if s.reserved < s.capacity])
+    # seats taken before sharding can go back to the fullest shard
+    legacy = max(shards, key=lambda s: s.reserved) if shards else None
+
+    profiles, shard_keys = set(), set(pool)
+    chosen = []
+    for ticket in tickets:
+        p_key = ticket.key.parent()
+        reservation = reservations.get(p_key)
+        need = set()
+        if ticket.register or not reservation:
+            pass
+        elif reservation.shard is not None:
+            need.add(s_keys[reservation.shard])
+        elif legacy:
+            need.add(legacy.key)
+        groups = len(profiles | set([p_key])) + len(shard_keys | need)
+        if groups <= MAX_GROUPS:
+            profiles.add(p_key)
+            shard_keys |= need
+            chosen.append(ticket)
+    return chosen, list(shard_keys), complete
+
+
+def applyBatch(conf, t_keys):
+    """Apply the requests of a batch of tickets in one transaction.
+
+    All tickets must be for `conf`. Returns the set of ticket keys that
+    were handled; the rest did not fit into the transaction, or found
+    their shards filled by registrations outside the batch and must be
+    planned again."""
+    fetched = [t for t in ndb.get_multi(t_keys) if t]
+    # deleted or already applied tickets count as handled
+    done = set(t_keys) - set(t.key for t in fetched if t.status == PENDING)
+    tickets = [t for t in fetched if t.status == PENDING]
+    p_keys = list(set(t.key.parent() for t in tickets))
+    r_keys = [seats.reservationKey(conf.key, p_key) for p_key in p_keys]
+    reservations = dict((r.key.parent(), r)
+                        for r in ndb.get_multi(r_keys) if r)
+    tickets, s_keys, complete = _planBatch(conf, tickets, reservations)
+    p_keys = list(set(t.key.parent() for t in tickets))
+    handled = _applyBatch(conf.key, [t.key for t in tickets], p_keys, s_keys,
+                          complete)
+    return handled | done
+
+
+@ndb.transactional(xg=True)
+def _applyBatch(c_key, t_keys, p_keys, s_keys, complete):
+    r_keys = [seats.reservationKey(c_key, p_key) for p_key in p_keys]
+    entities = ndb.get_multi(t_keys + r_keys + s_keys)
+    n, m = len(t_keys), len(p_keys)
+    tickets = entities[:n]
+    reservations = dict(zip(p_keys, entities[n:n + m]))
+    shards = [s for s in entities[n + m:] if s]
+    by_index = dict((s.index, s) for s in shards)
+    created = {}
+    deleted = []
+    replan = set()
+    delta = 0
+
+    for ticket in tickets:
+        if not ticket or ticket.status != PENDING:
+            # already applied by an earlier lease of the same task
+            continue
+        p_key = ticket.key.parent()
+        reservation = reservations[p_key]
+        if ticket.register:
+            shard = next((s for s in shards if s.reserved < s.capacity), None)
+            if reservation:
+                ticket.result, ticket.error = False, ALREADY_REGISTERED
+            elif not shard and not complete:
+                # other shards had free seats; only sold out once every
+                # shard was seen full, as in seats.reserve()
+                replan.add(ticket.key)
+                continue
+            elif not shard:
+                ticket.result, ticket.error = False, NO_SEATS
+            else:
+                shard.reserved += 1
+                reservation = SeatReservation(
+                    key=seats.reservationKey(c_key, p_key),
+                    conference=c_key, shard=shard.index)
+                reservations[p_key] = created[p_key] = reservation
+                ticket.result = True
+                delta -= 1
+        else:
+            if reservation and reservation.shard is not None:
+                shard = by_index.get(reservation.shard)
+            else:
+                shard = next((s for s in shards if s.reserved > 0), None)
+            if not reservation or not shard:
+                ticket.result = False
+            else:
+                shard.reserved -= 1
+                if created.pop(p_key, None) is None:
+                    deleted.append(reservation.key)
+                reservations[p_key] = None
+                ticket.result = True
+                delta += 1
+        ticket.status = DONE
+
+    tickets = [t for t in tickets if t and t.key not in replan]
+    ndb.put_multi(tickets + shards + created.values())
+    ndb.delete_multi(deleted)
+    # only touch memcache and the task queue once the batch commits
+    ndb.get_context().call_on_commit(lambda: seats.seatsChanged(c_key, delta))
+    return set(t.key for t in tickets)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""requestcontext.py
+
+Request-scoped memo and datastore RPC instrumentation.
+
+`middleware()` wraps a WSGI app so each request starts with an empty
+memo. Values such as the current user, their user id and their Profile
+are resolved once per request through `memoize()`, however many helpers
+ask for them. Outside a wrapped request nothing is memoized.
+
+Work can also be deferred to the end of the request with `atEnd()`,
+e.g. to send everything a request produced in one batch.
+
+The middleware also counts the datastore RPCs a request issues (through
+an apiproxy pre-call hook, so asynchronous calls are counted too) and
+logs them per endpoint.
+
+$Id$
+
+"""
+
+import collections
+import logging
+import threading
+
+from google.appengine.api import apiproxy_stub_map
+
+SERVICE = 'datastore_v3'
+HOOK_NAME = 'requestcontext_rpc_counter'
+
+_state = threading.local()
+
+
+def memoize(key, factory):
+    """Return the request's value for `key`, calling factory() to
+    resolve it the first time in the request."""
+    memo = getattr(_state, 'memo', None)
+    if memo is None:
+        return factory()
+    if key not in memo:
+        memo[key] = factory()
+    return memo[key]
+
+
+def forget(key):
+    """Drop a memoized value, e.g. after replacing it."""
+    memo = getattr(_state, 'memo', None)
+    if memo is not None:
+        memo.pop(key, None)
+
+
+def atEnd(key, callback):
+    """Run callback() once, when the request's response is ready.
+
+    Callbacks registered under the same key run only once. Returns False,
+    without registering, outside a request."""
+    callbacks = getattr(_state, 'callbacks', None)
+    if callbacks is None:
+        return False
+    callbacks.setdefault(key, callback)
+    return True
+
+
+def rpcCounts():
+    """Return a dict of datastore call name -> count for this request."""
+    return dict(getattr(_state, 'rpcs', None) or {})
+
+
+def _countRpc(service, call, request, response):
+    rpcs = getattr(_state, 'rpcs', None)
+    if rpcs is not None:
+        rpcs[call] = rpcs.get(call, 0) + 1
+
+
+def _installHook():
+    # hooks are process wide; the counters are per thread (request)
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        HOOK_NAME, _countRpc, SERVICE)
+
+
+def _begin():
+    _state.memo = {}
+    _state.rpcs = {}
+    _state.callbacks = collections.OrderedDict()
+
+
+def _runCallbacks():
+    callbacks = _state.callbacks
+    while callbacks:
+        # callbacks may register more callbacks
+        key, callback = callbacks.popitem(last=False)
+        callback()
+
+
+def _end(name):
+    rpcs = rpcCounts()
+    _state.memo = _state.rpcs = _state.callbacks = None
+    logging.info('%s: %d datastore RPCs %s',
+                 name, sum(rpcs.values()), sorted(rpcs.items()))
+    return rpcs
+
+
+def middleware(app):
+    """Wrap a WSGI app with a request context per request."""
+    _installHook()
+
+    def wrapped(environ, start_response):
+        _begin()
+        try:
+            result = app(environ, start_response)
+            _runCallbacks()
+            return result
+        finally:
+            # SPI paths look like /_ah/spi/ConferenceApi.getProfile
+            _end(environ.get('PATH_INFO', '').rsplit('/', 1)[-1])
+    return wrapped
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Precomputed per-conference schedule document.
+
+The chronologically sorted, already serialized `SessionForms` of a
+conference are kept in a single `ConferenceSchedule` entity that is a
+child of the conference. Session writes patch it incrementally inside
+their own transaction (it shares their entity group), so listing all
+sessions of a conference is a single key get.
+
+A schedule too big for one entity is stored as an `oversized` marker
+without a payload. It is not patched, and readers query the sessions
+instead of rebuilding it on every read.
+
+$Id$
+
+"""
+
+import bisect
+
+from google.appengine.ext import ndb
+from protorpc import protobuf
+
+from models import ConferenceSchedule
+from models import SessionForms
+
+SCHEDULE_ID = 'schedule'
+MAX_PAYLOAD = 900 * 1024    # stay clear of the 1MB entity size limit
+
+
+def scheduleKey(c_key):
+    """Return the key of a conference's schedule document."""
+    return ndb.Key(ConferenceSchedule, SCHEDULE_ID, parent=c_key)
+
+
+def _sortKey(form):
+    # ISO date and time strings sort chronologically
+    return (form.date, form.startTime)
+
+
+def _store(c_key, forms):
+    payload = protobuf.encode_message(SessionForms(items=forms))
+    if len(payload) > MAX_PAYLOAD:
+        # too big to keep in one entity; readers fall back to querying
+        ConferenceSchedule(key=scheduleKey(c_key), payload=None,
+                           count=len(forms), oversized=True).put()
+        return
+    ConferenceSchedule(key=scheduleKey(c_key), payload=payload,
+                       count=len(forms)).put()
+
+
+def get(c_key, query=None):
+    """Return the SessionForms of a conference, or None if the schedule
+    has not been built.
+
+    If it is too big to store, return the SessionForms returned by
+    query() instead (None without one); nothing is written."""
+    sched = scheduleKey(c_key).get()
+    if sched is None:
+        return None
+    if sched.oversized:
+        return query() if query is not None else None
+    return protobuf.decode_message(SessionForms, sched.payload)
+
+
+@ndb.transactional
+def rebuild(c_key, build):
+    """Store and return the SessionForms returned by build()."""
+    forms = build()
+    _store(c_key, list(forms.items))
+    return forms
+
+
+@ndb.transactional
+def update(c_key, changed=(), deleted=(), build=None):
+    """Patch a conference's schedule after session writes.
+
+    `changed` holds the SessionForms of created or updated sessions and
+    `deleted` the websafe keys of deleted ones. If there is no schedule
+    yet it is built with build() first (when given). Joins the caller's
+    transaction, which must be on the conference's entity group."""
+    sched = scheduleKey(c_key).get()
+    if sched is not None and sched.oversized:
+        # readers query the sessions; there is nothing to patch
+        return
+    if sched is not None:
+        forms = protobuf.decode_message(SessionForms, sched.payload).items
+    elif build is not None:
+        # queries in a transaction do not see its own writes, so the
+        # changes below still need to be applied on top
+        forms = build().items
+    else:
+        return
+    gone = set(deleted) | set(form.websafeKey for form in changed)
+    forms = [form for form in forms if form.websafeKey not in gone]
+    keys = [_sortKey(form) for form in forms]
+    for form in changed:
+        i = bisect.bisect_right(keys, _sortKey(form))
+        keys.insert(i, _sortKey(form))
+        forms.insert(i, form)
+    _store(c_key, forms)
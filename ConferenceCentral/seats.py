@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counters for conference registration.
+
+A conference's capacity is split across SHARD_COUNT `SeatShard` root
+entities. A registration only locks the attendee's Profile entity group
+and a single shard, so popular conferences no longer serialize every
+registration on the Conference entity. The shard capacities always add
+up to `maxAttendees` and each shard refuses to go past its own capacity,
+so a conference can never be oversold.
+
+The `Conference.seatsAvailable` property becomes a rolled-up view that
+is refreshed by a coalesced task; a live total is kept in memcache.
+
+The `SeatReservation` children of a Profile are also its list of
+registrations: a registration writes a shard and a reservation but not
+the Profile. Profiles that still list conferences in the legacy
+`conferenceKeysToAttend` property are migrated when next loaded, or by
+the /tasks/migrate_registrations task.
+
+$Id$
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.api.datastore_errors import TransactionFailedError
+
+from models import Profile
+from models import SeatShard
+from models import SeatReservation
+import cache
+import dispatch
+import facets
+import announcements
+
+SHARD_COUNT = 20    # xg transactions are limited to 25 entity groups
+RESERVE_ATTEMPTS = 2    # passes over the shards that were contended
+ROLLUP_INTERVAL = 10    # seconds between Conference.seatsAvailable rollups
+MEMCACHE_SEATS_KEY = 'seatsAvailable_%s'
+MIGRATE_BATCH_SIZE = 100
+
+# reserve() / release() results
+RESERVED = 'RESERVED'
+RELEASED = 'RELEASED'
+ALREADY_RESERVED = 'ALREADY_RESERVED'
+NOT_RESERVED = 'NOT_RESERVED'
+SOLD_OUT = 'SOLD_OUT'
+BUSY = 'BUSY'
+_SHARD_FULL = '_SHARD_FULL'
+
+
+def shardKeys(c_key, count):
+    """Return the keys of the `count` seat shards of a conference."""
+    wsck = c_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (wsck, i)) for i in range(count)]
+
+
+def reservationKey(c_key, p_key):
+    """Return the ledger key for a Profile's seat at a conference."""
+    return ndb.Key(SeatReservation, c_key.urlsafe(), parent=p_key)
+
+
+def _split(total, count):
+    """Split `total` into `count` near-equal integer parts."""
+    base, extra = divmod(total, count)
+    return [base + (1 if i < extra else 0) for i in range(count)]
+
+
+@ndb.transactional(xg=True)
+def _initShards(c_key, count):
+    conf = c_key.get()
+    if conf.seatShards:
+        return conf
+    capacity = max(conf.maxAttendees or 0, 0)
+    # Seats taken before the conference was sharded were only recorded
+    # as a lower seatsAvailable; carry them over as reserved seats.
+    taken = min(max(capacity - (conf.seatsAvailable or 0), 0), capacity)
+    shards = []
+    for i, (s_key, cap) in enumerate(
+            zip(shardKeys(c_key, count), _split(capacity, count))):
+        reserved = min(cap, taken)
+        taken -= reserved
+        shards.append(SeatShard(key=s_key, conference=c_key, index=i,
+                                capacity=cap, reserved=reserved))
+    conf.seatShards = count
+    ndb.put_multi(shards + [conf])
+    return conf
+
+
+def ensureShards(conf, count=None):
+    """Create the seat shards for a conference if it has none yet.
+
+    Returns the (possibly updated) Conference entity."""
+    if conf.seatShards:
+        return conf
+    if count is None:
+        count = max(1, min(SHARD_COUNT, conf.maxAttendees or 0))
+    return _initShards(conf.key, count)
+
+
+def seatsAvailable(conf):
+    """Return the live number of free seats for a conference."""
+    if not conf.seatShards:
+        return conf.seatsAvailable or 0
+    mkey = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+    seats = memcache.get(mkey)
+    if seats is None:
+        seats = _sumShards(conf.key, conf.seatShards)
+        memcache.add(mkey, seats)
+    return seats
+
+
+def liveSeatsAvailable(wsck):
+    """Return the live free seat count kept in memcache, or None."""
+    return memcache.get(MEMCACHE_SEATS_KEY % wsck)
+
+
+def _sumShards(c_key, count):
+    shards = [s for s in ndb.get_multi(shardKeys(c_key, count)) if s]
+    return sum(s.capacity - s.reserved for s in shards)
+
+
+@ndb.transactional(xg=True)
+def _reserveOnShard(s_key, c_key, p_key):
+    r_key = reservationKey(c_key, p_key)
+    reservation, shard = ndb.get_multi([r_key, s_key])
+    if reservation:
+        return ALREADY_RESERVED
+    if shard.reserved >= shard.capacity:
+        return _SHARD_FULL
+    shard.reserved += 1
+    ndb.put_multi([
+        shard,
+        SeatReservation(key=r_key, conference=c_key, shard=shard.index),
+    ])
+    return RESERVED
+
+
+def _migrateLegacy(p_key):
+    # the ledger of a Profile still listing legacy registrations is
+    # incomplete until they are migrated
+    prof = p_key.get()
+    if prof and prof.conferenceKeysToAttend:
+        migrate(p_key)
+
+
+def reserve(conf, p_key):
+    """Reserve one seat at a sharded conference for a Profile.
+
+    Returns RESERVED, ALREADY_RESERVED, SOLD_OUT if every shard was seen
+    full, or BUSY if some shard stayed too contended to try."""
+    c_key = conf.key
+    _migrateLegacy(p_key)
+    # Only try shards that had free seats a moment ago, in random order
+    # so concurrent registrations spread over different entity groups.
+    shards = [s.key for s in ndb.get_multi(shardKeys(c_key, conf.seatShards))
+              if s and s.reserved < s.capacity]
+    for attempt in range(RESERVE_ATTEMPTS):
+        random.shuffle(shards)
+        contended = []
+        for s_key in shards:
+            try:
+                status = _reserveOnShard(s_key, c_key, p_key)
+            except TransactionFailedError:
+                # shard is too contended right now; come back to it
+                contended.append(s_key)
+                continue
+            if status == _SHARD_FULL:
+                continue
+            if status == RESERVED:
+                seatsChanged(c_key, -1)
+            return status
+        shards = contended
+        if not shards:
+            break
+    # No seat was taken; double check the ledger so a repeated
+    # registration is still reported as a conflict.
+    if reservationKey(c_key, p_key).get():
+        return ALREADY_RESERVED
+    # a shard that could not be tried may still have free seats
+    return BUSY if shards else SOLD_OUT
+
+
+@ndb.transactional(xg=True)
+def _releaseFromShard(s_key, c_key, p_key):
+    r_key = reservationKey(c_key, p_key)
+    reservation, shard = ndb.get_multi([r_key, s_key])
+    if not reservation:
+        return NOT_RESERVED
+    if shard.reserved <= 0:
+        return _SHARD_FULL
+    shard.reserved -= 1
+    shard.put()
+    r_key.delete()
+    return RELEASED
+
+
+def release(conf, p_key):
+    """Give back a Profile's seat at a sharded conference.
+
+    Returns RELEASED or NOT_RESERVED."""
+    c_key = conf.key
+    _migrateLegacy(p_key)
+    reservation = reservationKey(c_key, p_key).get()
+    if not reservation:
+        return NOT_RESERVED
+    if reservation.shard is not None:
+        candidates = [shardKeys(c_key, conf.seatShards)[reservation.shard]]
+    else:
+        # Registered before sharding: any shard holding a carried-over
+        # reservation can take the seat back.
+        candidates = [s.key for s in
+                      ndb.get_multi(shardKeys(c_key, conf.seatShards))
+                      if s and s.reserved > 0]
+    for s_key in candidates:
+        status = _releaseFromShard(s_key, c_key, p_key)
+        if status == _SHARD_FULL:
+            continue
+        if status == RELEASED:
+            seatsChanged(c_key, 1)
+        return status
+    return NOT_RESERVED
+
+
+def registrationIds(p_key):
+    """Return the websafe keys of the conferences a Profile attends."""
+    r_keys = SeatReservation.query(ancestor=p_key).fetch(keys_only=True)
+    return [r_key.id() for r_key in r_keys]
+
+
+def conferenceKeysAsync(p_key):
+    """Return a future for the keys of the conferences a Profile attends."""
+    r_query = SeatReservation.query(ancestor=p_key)
+    return r_query.map_async(lambda reservation: reservation.conference)
+
+
+def attendeesPage(c_key, limit, start_cursor=None):
+    """Fetch one page of a conference's attendees in registration order.
+
+    Reads the SeatReservations by their conference, so the cost does not
+    depend on the number of Profiles. Returns (Profile keys,
+    next_cursor); next_cursor is None on the last page."""
+    r_query = SeatReservation.query(SeatReservation.conference == c_key)
+    r_query = r_query.order(SeatReservation.created)
+    r_keys, cursor, more = r_query.fetch_page(
+        limit, start_cursor=start_cursor, keys_only=True)
+    return [r_key.parent() for r_key in r_keys], more and cursor or None
+
+
+@ndb.transactional(xg=True, propagation=ndb.TransactionOptions.INDEPENDENT)
+def _resizeShards(c_key, count, capacity):
+    shards = ndb.get_multi(shardKeys(c_key, count))
+    reserved = sum(s.reserved for s in shards)
+    if capacity < reserved:
+        return None
+    for shard, free in zip(shards, _split(capacity - reserved, count)):
+        shard.capacity = shard.reserved + free
+    ndb.put_multi(shards)
+    return capacity - reserved
+
+
+def resize(conf, capacity):
+    """Change the capacity of a conference to `capacity` seats.
+
+    Returns the new number of free seats, or None if more seats than
+    `capacity` are already taken. Does not put the Conference."""
+    if not conf.seatShards:
+        seats = (conf.seatsAvailable or 0) + capacity - (conf.maxAttendees or 0)
+        return seats if seats >= 0 else None
+    seats = _resizeShards(conf.key, conf.seatShards, capacity)
+    if seats is not None:
+        memcache.set(MEMCACHE_SEATS_KEY % conf.key.urlsafe(), seats)
+    return seats
+
+
+def seatsChanged(c_key, delta):
+    """Adjust the live memcache total and schedule a rollup."""
+    if not delta:
+        return
+    mkey = MEMCACHE_SEATS_KEY % c_key.urlsafe()
+    if delta < 0:
+        memcache.decr(mkey, -delta)
+    else:
+        memcache.incr(mkey, delta)
+    # One named task per conference per interval; later registrations in
+    # the same interval are folded into it.
+    wsck = c_key.urlsafe()
+    dispatch.enqueue(
+        url='/tasks/rollup_seats',
+        params={'websafeConferenceKey': wsck},
+        name=dispatch.taskName('rollup-seats', wsck,
+                               int(time.time() // ROLLUP_INTERVAL)),
+        countdown=ROLLUP_INTERVAL,
+    )
+
+
+@ndb.transactional(xg=True)
+def _storeRollup(c_key, seats):
+    conf = c_key.get()
+    if conf.seatsAvailable != seats:
+        before = facets.values(conf)
+        conf.seatsAvailable = seats
+        conf.put()
+        facets.update(before, facets.values(conf))
+        announcements.track(conf, seats)
+    return conf
+
+
+def rollup(c_key):
+    """Copy the shard totals into Conference.seatsAvailable, its free
+    seat facet and the nearly sold out set."""
+    conf = c_key.get()
+    if not conf or not conf.seatShards:
+        return conf
+    seats = _sumShards(c_key, conf.seatShards)
+    memcache.set(MEMCACHE_SEATS_KEY % c_key.urlsafe(), seats)
+    conf = _storeRollup(c_key, seats)
+    cache.invalidate(c_key.urlsafe(), cache.CONFERENCE)
+    return conf
+
+
+@ndb.transactional
+def migrate(p_key):
+    """Turn a Profile's legacy conferenceKeysToAttend into reservations.
+
+    Conferences the Profile has no reservation for yet get one without a
+    shard, like seats taken before sharding. Returns the updated Profile."""
+    prof = p_key.get()
+    if not prof or not prof.conferenceKeysToAttend:
+        return prof
+    c_keys = [ndb.Key(urlsafe=wsck)
+              for wsck in set(prof.conferenceKeysToAttend)]
+    r_keys = [reservationKey(c_key, p_key) for c_key in c_keys]
+    created = [SeatReservation(key=r_key, conference=c_key)
+               for c_key, r_key, reservation
+               in zip(c_keys, r_keys, ndb.get_multi(r_keys))
+               if not reservation]
+    prof.conferenceKeysToAttend = []
+    ndb.put_multi(created + [prof])
+    return prof
+
+
+def migrateAll(cursor=None):
+    """Migrate one page of Profiles and enqueue a task for the next."""
+    profiles, cursor, more = Profile.query().fetch_page(
+        MIGRATE_BATCH_SIZE, start_cursor=cursor)
+    for prof in profiles:
+        if prof.conferenceKeysToAttend:
+            migrate(prof.key)
+    if more and cursor:
+        dispatch.enqueue(url='/tasks/migrate_registrations',
+                         params={'cursor': cursor.urlsafe()})
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Precompiled entity to ProtoRPC form serializers.
+
+A FormSerializer works out once, per model/message pair, which message
+fields come from which entity properties and how each value must be
+converted. Copying an entity then just walks that plan, instead of
+reflecting over `all_fields()` with hasattr/getattr and string checks
+for every field of every entity.
+
+$Id$
+
+"""
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import TeeShirtSize
+
+
+class FormSerializer(object):
+    """FormSerializer -- copies ndb entities of one model to one form"""
+
+    def __init__(self, model_class, form_class, converters=None,
+                 key_field=None):
+        """`converters` maps field names to a function applied to
+        non-None values; `key_field` gets the websafe entity key."""
+        converters = converters or {}
+        self.form_class = form_class
+        self.key_field = key_field
+        plan = []
+        for field in form_class.all_fields():
+            if field.name in model_class._properties:
+                plan.append((field.name, converters.get(field.name)))
+        self.plan = tuple(plan)
+        self._subplans = {}
+
+    def _planFor(self, fields):
+        """Return the part of the plan for a set of field names."""
+        if fields is None:
+            return self.plan
+        fields = frozenset(fields)
+        plan = self._subplans.get(fields)
+        if plan is None:
+            plan = tuple(step for step in self.plan if step[0] in fields)
+            self._subplans[fields] = plan
+        return plan
+
+    def toForm(self, entity, fields=None, **extra):
+        """Copy an entity to a new form, limited to the form field names
+        in `fields` if given; the key field is always set. Truthy `extra`
+        keyword values are copied to the form fields of the same name."""
+        form = self.form_class()
+        for name, convert in self._planFor(fields):
+            value = getattr(entity, name)
+            if convert is not None and value is not None:
+                value = convert(value)
+            setattr(form, name, value)
+        if self.key_field:
+            setattr(form, self.key_field, entity.key.urlsafe())
+        for name, value in extra.iteritems():
+            if value and (fields is None or name in fields):
+                setattr(form, name, value)
+        return form
+
+    def toForms(self, entities, fields=None):
+        """Copy a batch of entities to a list of forms."""
+        toForm = self.toForm
+        return [toForm(entity, fields) for entity in entities]
+
+
+CONFERENCE_SERIALIZER = FormSerializer(
+    Conference, ConferenceForm,
+    converters={'startDate': str, 'endDate': str},
+    key_field='websafeKey',
+)
+
+SESSION_SERIALIZER = FormSerializer(
+    Session, SessionForm,
+    converters={'date': str, 'startTime': str},
+    key_field='websafeKey',
+)
+
+PROFILE_SERIALIZER = FormSerializer(
+    Profile, ProfileForm,
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)},
+)
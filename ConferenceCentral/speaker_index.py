@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""speaker_index.py
+
+Inverted index from speakers to their sessions across conferences, and
+the speaker directory.
+
+Each speaker has one `Speaker` root entity keyed by the normalised name
+(case and spacing folded), listing the keys of the speaker's sessions.
+Looking up a speaker's sessions is one key get plus one get_multi, so
+the result is strongly consistent, unlike a global query on
+`Session.speaker`.
+
+Session writes add their keys to the speakers' entries right after they
+commit, each speaker in its own transaction. Keys of sessions that were
+deleted or lost the speaker are skipped on lookup and pruned then. If
+an entry cannot be written, a /tasks/index_speakers task re-indexes the
+conference; the same task without a conference backfills every session.
+
+The directory lists speaker names in `SpeakerPrefix` buckets keyed by
+the first PREFIX_LENGTH letters of the normalised name, each holding its
+names in sorted order. A prefix of that length or longer is looked up
+with one get and a bisect, fast enough to call on every keystroke.
+Shorter prefixes read the buckets in a key range. A speaker is listed
+after its Speaker entity is first written, one transaction per bucket,
+and is unlisted when pruning removes its last session.
+
+$Id$
+
+"""
+
+import bisect
+import time
+
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.ext import ndb
+
+from models import Session
+from models import Speaker
+from models import SpeakerPrefix
+import dispatch
+
+BACKFILL_BATCH_SIZE = 200
+MAX_PRUNE = 23      # stale sessions re-checked in one xg transaction,
+                    # with the Speaker and its bucket
+PREFIX_LENGTH = 2   # letters of the normalised name keying a bucket
+REPAIR_INTERVAL = 10  # seconds between re-index tasks of a conference
+
+
+def normalize(name):
+    """Return the canonical form of a speaker name."""
+    return u' '.join(name.split()).lower()
+
+
+def speakerKey(name):
+    """Return the index key for a speaker name, or None if it is blank."""
+    canonical = normalize(name or u'')
+    return ndb.Key(Speaker, canonical) if canonical else None
+
+
+def prefixKey(canonical):
+    """Return the key of the directory bucket for a normalised name."""
+    return ndb.Key(SpeakerPrefix, canonical[:PREFIX_LENGTH])
+
+
+def _bySpeaker(sessions):
+    index = {}
+    for sess in sessions:
+        for name in sess.speaker:
+            sp_key = speakerKey(name)
+            if sp_key:
+                index.setdefault(sp_key, (name, set()))[1].add(sess.key)
+    return index
+
+
+@ndb.transactional_tasklet
+def _addAsync(sp_key, name, s_keys):
+    speaker = yield sp_key.get_async()
+    if speaker is None:
+        speaker = Speaker(key=sp_key)
+    new = s_keys - set(speaker.sessionKeys)
+    # a new speaker, or a new spelling, goes into the directory
+    renamed = speaker.name != name
+    if new or renamed:
+        speaker.name = name
+        speaker.sessionKeys.extend(sorted(new))
+        yield speaker.put_async()
+    raise ndb.Return(renamed)
+
+
+@ndb.transactional_tasklet
+def _listAsync(p_key, names):
+    bucket = yield p_key.get_async()
+    if bucket is None:
+        bucket = SpeakerPrefix(key=p_key)
+    changed = False
+    for canonical, name in sorted(names.iteritems()):
+        i = bisect.bisect_left(bucket.canonical, canonical)
+        if i < len(bucket.canonical) and bucket.canonical[i] == canonical:
+            if bucket.names[i] != name:
+                bucket.names[i] = name
+                changed = True
+        else:
+            bucket.canonical.insert(i, canonical)
+            bucket.names.insert(i, name)
+            changed = True
+    if changed:
+        yield bucket.put_async()
+
+
+def _unlist(canonical):
+    bucket = prefixKey(canonical).get()
+    if not bucket:
+        return
+    i = bisect.bisect_left(bucket.canonical, canonical)
+    if i < len(bucket.canonical) and bucket.canonical[i] == canonical:
+        del bucket.canonical[i], bucket.names[i]
+        if bucket.canonical:
+            bucket.put()
+        else:
+            bucket.key.delete()
+
+
+def _wait(futures):
+    failed = set()
+    for key, future in futures:
+        try:
+            future.check_success()
+        except TransactionFailedError:
+            failed.add(key)
+    return failed
+
+
+def add(sessions, relist=False):
+    """Add Sessions to the entries of their speakers and list new speakers
+    in the directory.
+
+    Call after the sessions are committed. Speakers whose entry could not
+    be written are re-indexed by a task. With `relist`, every speaker is
+    checked against the directory, not only new ones."""
+    # the transactions of different speakers run concurrently
+    speakers = _bySpeaker(sessions)
+    futures = [(sp_key, _addAsync(sp_key, name, s_keys))
+               for sp_key, (name, s_keys) in speakers.iteritems()]
+    failed = _wait(futures)
+    # then one transaction per directory bucket
+    buckets = {}
+    for sp_key, future in futures:
+        if sp_key not in failed and (relist or future.get_result()):
+            canonical = sp_key.id()
+            buckets.setdefault(prefixKey(canonical), {})[canonical] = \
+                speakers[sp_key][0]
+    failed |= _wait([(p_key, _listAsync(p_key, names))
+                     for p_key, names in buckets.iteritems()])
+    if failed:
+        # One named task per conference per interval, so a later failure
+        # re-indexes again instead of hitting a tombstoned name.
+        for c_key in set(s.key.parent() for s in sessions):
+            wsck = c_key.urlsafe()
+            dispatch.enqueue(
+                url='/tasks/index_speakers',
+                params={'websafeConferenceKey': wsck},
+                name=dispatch.taskName('index-speakers', wsck,
+                                       int(time.time() // REPAIR_INTERVAL)),
+                countdown=REPAIR_INTERVAL,
+            )
+    return failed
+
+
+@ndb.transactional(xg=True)
+def _prune(sp_key, s_keys):
+    # the sessions are read again in here, so a speaker added back by a
+    # later write is never pruned
+    speaker = sp_key.get()
+    if not speaker:
+        return
+    canonical = sp_key.id()
+    stale = set(k for k, s in zip(s_keys, ndb.get_multi(s_keys))
+                if not s or canonical not in map(normalize, s.speaker))
+    if stale:
+        speaker.sessionKeys = [k for k in speaker.sessionKeys
+                               if k not in stale]
+        if speaker.sessionKeys:
+            speaker.put()
+        else:
+            speaker.key.delete()
+            _unlist(canonical)
+
+
+def sessions(name):
+    """Return the Sessions of a speaker in schedule order."""
+    sp_key = speakerKey(name)
+    speaker = sp_key.get() if sp_key else None
+    if not speaker:
+        return []
+    canonical = sp_key.id()
+    found, stale = [], []
+    for s_key, sess in zip(speaker.sessionKeys,
+                           ndb.get_multi(speaker.sessionKeys)):
+        if sess and canonical in map(normalize, sess.speaker):
+            found.append(sess)
+        else:
+            stale.append(s_key)
+    if stale:
+        _prune(sp_key, stale[:MAX_PRUNE])
+    return sorted(found, key=lambda s: (s.date, s.startTime))
+
+
+def backfill(c_key=None, cursor=None):
+    """Index one batch of sessions, of one conference or of all, and
+    enqueue a task for the next batch."""
+    s_query = Session.query(ancestor=c_key) if c_key else Session.query()
+    batch, cursor, more = s_query.fetch_page(BACKFILL_BATCH_SIZE,
+                                             start_cursor=cursor)
+    add(batch, relist=True)
+    if more and cursor:
+        params = {'cursor': cursor.urlsafe()}
+        if c_key:
+            params['websafeConferenceKey'] = c_key.urlsafe()
+        dispatch.enqueue(url='/tasks/index_speakers', params=params)
+
+
+def _buckets(canonical, start):
+    if len(canonical) >= PREFIX_LENGTH:
+        bucket = prefixKey(canonical).get()
+        return [bucket] if bucket else []
+    # the buckets of a short prefix, in name order
+    p_query = SpeakerPrefix.query()
+    if start:
+        p_query = p_query.filter(
+            SpeakerPrefix.key >= ndb.Key(SpeakerPrefix, start[:PREFIX_LENGTH]))
+    if canonical:
+        p_query = p_query.filter(
+            SpeakerPrefix.key < ndb.Key(SpeakerPrefix, canonical + u'\ufffd'))
+    return p_query.order(SpeakerPrefix.key).iter()
+
+
+def suggest(prefix, limit, after=None):
+    """Return speaker names starting with `prefix` in alphabetical order,
+    at most `limit` of them, and the token that continues the list (None
+    after the last name). `after` is such a token."""
+    canonical = normalize(prefix or u'')
+    start = max(canonical, after or u'')
+    found = []
+    for bucket in _buckets(canonical, start):
+        i = bisect.bisect_left(bucket.canonical, start)
+        if i < len(bucket.canonical) and bucket.canonical[i] == after:
+            i += 1
+        for name_key, name in zip(bucket.canonical[i:], bucket.names[i:]):
+            if not name_key.startswith(canonical) or len(found) > limit:
+                break
+            found.append((name_key, name))
+        if len(found) > limit:
+            break
+    token = found[limit - 1][0] if len(found) > limit else None
+    return [name for _, name in found[:limit]], token
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Incrementally maintained speaker session counts and featured speaker.
+
+Each conference has one `SpeakerTally` child entity that records the
+speakers of every session and the number of sessions per speaker.
+Session writes patch it inside their own transaction, so creating,
+updating or deleting a session keeps the counts exact without querying
+the conference's sessions again. The featured speaker is derived from
+the counts and published to memcache by a single task per write.
+
+$Id$
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import SpeakerTally
+import dispatch
+
+TALLY_ID = 'speakers'
+FEATURED_MIN_SESSIONS = 2
+MEMCACHE_FEATURED_KEY = 'featuredSpeaker_%s'
+FEATURED_CACHE_TIME = 60 * 60   # seconds
+
+
+def tallyKey(c_key):
+    """Return the key of a conference's speaker tally."""
+    return ndb.Key(SpeakerTally, TALLY_ID, parent=c_key)
+
+
+def _sessionId(s_key):
+    # sessions are children of the conference, so the id is unique
+    return str(s_key.id())
+
+
+def _count(counts, speakers, delta):
+    for speaker in speakers:
+        n = counts.get(speaker, 0) + delta
+        if n > 0:
+            counts[speaker] = n
+        else:
+            counts.pop(speaker, None)
+
+
+def _featured(counts, current, candidates):
+    """Pick the featured speaker: the latest written speaker with enough
+    sessions, else the current one while it still qualifies, else the
+    speaker with the most sessions."""
+    for speaker in candidates:
+        if counts.get(speaker, 0) >= FEATURED_MIN_SESSIONS:
+            return speaker
+    if current and counts.get(current, 0) >= FEATURED_MIN_SESSIONS:
+        return current
+    if counts:
+        n, speaker = max((n, speaker) for speaker, n in counts.iteritems())
+        if n >= FEATURED_MIN_SESSIONS:
+            return speaker
+    return ''
+
+
+@ndb.transactional
+def update(c_key, changed=(), deleted=(), build=None, rebuild=False):
+    """Patch a conference's speaker tally after session writes.
+
+    `changed` holds created or updated Sessions and `deleted` the keys of
+    deleted ones. If there is no tally yet, or `rebuild` is set, the
+    Sessions returned by build() are counted first. Joins the caller's transaction, which must
+    be on the conference's entity group. Enqueues one task to publish
+    the featured speaker if it changed."""
+    tally = tallyKey(c_key).get()
+    if tally is None or rebuild:
+        old = tally
+        tally = SpeakerTally(key=tallyKey(c_key), sessionSpeakers={},
+                             counts={}, featured=old and old.featured or '',
+                             version=old and old.version or 0)
+        # queries in a transaction do not see its own writes, so the
+        # changes below still need to be applied on top
+        for sess in (build() if build else ()):
+            tally.sessionSpeakers[_sessionId(sess.key)] = sess.speaker
+            _count(tally.counts, sess.speaker, 1)
+    candidates = []
+    for s_id, speakers in ([(_sessionId(k), []) for k in deleted] +
+                           [(_sessionId(s.key), s.speaker) for s in changed]):
+        _count(tally.counts, tally.sessionSpeakers.pop(s_id, []), -1)
+        _count(tally.counts, speakers, 1)
+        if speakers:
+            tally.sessionSpeakers[s_id] = speakers
+        candidates.extend(speakers)
+    featured = _featured(tally.counts, tally.featured, reversed(candidates))
+    tally.version = (tally.version or 0) + 1
+    if featured != tally.featured:
+        tally.featured = featured
+        # sent once the transaction commits
+        dispatch.enqueue(
+            url='/tasks/set_featured_speaker',
+            params={'websafeConferenceKey': c_key.urlsafe()},
+            name=dispatch.taskName('featured-speaker', c_key.urlsafe(),
+                                   tally.version))
+    tally.put()
+
+
+def publish(c_key):
+    """Copy a conference's featured speaker into memcache."""
+    tally = tallyKey(c_key).get()
+    featured = tally.featured if tally else ''
+    # expires, so a publish task lost after commit heals itself
+    memcache.set(MEMCACHE_FEATURED_KEY % c_key.urlsafe(), featured,
+                  time=FEATURED_CACHE_TIME)
+    return featured
+
+
+def featured(c_key):
+    """Return a conference's featured speaker, or ''."""
+    value = memcache.get(MEMCACHE_FEATURED_KEY % c_key.urlsafe())
+    if value is None:
+        value = publish(c_key)
+    return value
@@ -0,0 +1,70 @@
+"""Benchmark: attendee roster cost against the total number of profiles.
+
+Lists the same 50 attendees of a conference with the registration index
+(SeatReservation.conference) and by scanning every Profile for the
+legacy conferenceKeysToAttend list, as the number of other profiles
+grows. The index should stay flat; the scan grows with the profiles.
+"""
+
+import time
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile
+import seats
+
+ATTENDEES = 50
+PROFILES = (500, 2000, 5000)    # total profiles in the datastore
+PAGE_SIZE = 50
+
+
+class AttendeesBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _index(self, c_key):
+        p_keys, _ = seats.attendeesPage(c_key, PAGE_SIZE)
+        return ndb.get_multi(p_keys)
+
+    def _scan(self, c_key):
+        wsck = c_key.urlsafe()
+        return [p for p in Profile.query()
+                if wsck in p.conferenceKeysToAttend][:PAGE_SIZE]
+
+    def _time(self, run, c_key):
+        start = time.time()
+        found = run(c_key)
+        return time.time() - start, len(found)
+
+    def test_roster(self):
+        conf = Conference(name='Roster', maxAttendees=ATTENDEES,
+                          seatsAvailable=ATTENDEES)
+        conf.put()
+        conf = seats.ensureShards(conf)
+        wsck = conf.key.urlsafe()
+        attendees = ndb.put_multi([
+            Profile(id='attendee%d' % i, conferenceKeysToAttend=[wsck])
+            for i in range(ATTENDEES)])
+        for p_key in attendees:
+            seats.reserve(conf, p_key)
+        total = ATTENDEES
+        for profiles in PROFILES:
+            ndb.put_multi([Profile(id='other%d' % i)
+                           for i in range(total, profiles)])
+            total = profiles
+            index, found = self._time(self._index, conf.key)
+            self.assertEqual(ATTENDEES, found)
+            scan, found = self._time(self._scan, conf.key)
+            self.assertEqual(ATTENDEES, found)
+            print 'roster %5d profiles  index %7.1f ms  scan %8.1f ms' % (
+                profiles, index * 1e3, scan * 1e3)
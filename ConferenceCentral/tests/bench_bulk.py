@@ -0,0 +1,56 @@
+"""Benchmark: bulk export and import throughput on the datastore stub.
+
+Exports a generated data set to line-delimited JSON, wipes the datastore
+and imports it again, reporting entities per second for both.
+"""
+
+import unittest
+from datetime import date, time
+from StringIO import StringIO
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile, Session
+import bulk
+import textsearch
+
+CONFERENCES = 50
+SESSIONS = 20       # per conference
+
+
+class BulkBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+        self.previous_index = textsearch.setIndex(textsearch.MemoryIndex())
+        p_key = Profile(id='org', mainEmail='org@x.com').put()
+        for i in range(CONFERENCES):
+            c_key = Conference(parent=p_key, name='Conf %d' % i,
+                               organizerUserId='org').put()
+            ndb.put_multi([
+                Session(parent=c_key, name='Session %d' % j,
+                        speaker=['Speaker %d' % (j % 7)],
+                        date=date(2015,8,8), startTime=time(9,30),
+                        conferenceKey=c_key.urlsafe())
+                for j in range(SESSIONS)])
+
+    def tearDown(self):
+        textsearch.setIndex(self.previous_index)
+        self.testbed.deactivate()
+
+    def test_throughput(self):
+        out = StringIO()
+        exported = bulk.exportEntities(out)
+        ndb.delete_multi([k for model in bulk.MODELS
+                          for k in model.query().fetch(keys_only=True)])
+        imported = bulk.importEntities(StringIO(out.getvalue()))
+        for label, stats in (('export', exported), ('import', imported)):
+            print '%-7s %6d entities in %5.2f s  %8.0f entities/s' % (
+                label, stats['entities'], stats['seconds'],
+                stats['perSecond'])
+        self.assertEqual(exported['entities'], imported['entities'])
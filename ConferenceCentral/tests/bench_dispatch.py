@@ -0,0 +1,58 @@
+"""Micro-benchmark: one taskqueue.add per task vs batched dispatch.
+
+Enqueues the same tasks with a blocking taskqueue.add each, as session
+creation used to, and through dispatch.py inside a request context, and
+reports the time per task on the taskqueue stub.
+"""
+
+import time
+import unittest
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import testbed
+
+import dispatch
+import requestcontext
+
+TASKS = 500
+
+
+class DispatchBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _single(self):
+        for i in range(TASKS):
+            taskqueue.add(url='/tasks/bench', params={'i': 'single%d' % i})
+
+    def _batched(self):
+        def handler():
+            for i in range(TASKS):
+                dispatch.enqueue(url='/tasks/bench',
+                                 params={'i': 'batched%d' % i})
+            return []
+        app = requestcontext.middleware(
+            lambda environ, start_response: handler())
+        app({'PATH_INFO': '/bench'}, lambda status, headers: None)
+
+    def _time(self, run):
+        start = time.time()
+        run()
+        return time.time() - start
+
+    def test_enqueue(self):
+        single = self._time(self._single)
+        batched = self._time(self._batched)
+        print 'enqueue    single %6.1f us/task  batched %6.1f us/task' \
+              '  (%.1fx)' % (single * 1e6 / TASKS, batched * 1e6 / TASKS,
+                             single / batched)
+        tasks = self.taskqueue_stub.get_filtered_tasks(url='/tasks/bench')
+        self.assertEqual(2 * TASKS, len(tasks))
@@ -0,0 +1,71 @@
+"""Throughput benchmark: batched registration queue vs per-request path.
+
+Registers the same number of attendees for one conference, once with a
+transaction per registration (`seats.reserve`, as `registerForConference`
+does) and once through `registration_queue.applyBatch`, and reports
+registrations per second and the number of commits each path needed.
+"""
+
+import time
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile, RegistrationTicket
+import registration_queue
+import seats
+
+SEATS = 400
+ATTENDEES = 400
+
+
+class RegistrationQueueBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+        conf = Conference(name='Rush', maxAttendees=SEATS,
+                          seatsAvailable=SEATS)
+        conf.put()
+        self.conf = seats.ensureShards(conf)
+        self.p_keys = ndb.put_multi(
+            [Profile(id='user%d' % i) for i in range(ATTENDEES)])
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _report(self, label, count, commits, elapsed):
+        print '%-12s %7.1f registrations/s  %4d commits' % (
+            label, count / elapsed, commits)
+
+    def test_per_request(self):
+        start = time.time()
+        results = [seats.reserve(self.conf, p_key) for p_key in self.p_keys]
+        elapsed = time.time() - start
+        self._report('per-request', len(results), len(results), elapsed)
+        self.assertEqual(min(SEATS, ATTENDEES),
+                         results.count(seats.RESERVED))
+
+    def test_batched(self):
+        # tickets are written at enqueue time; only time the worker
+        t_keys = ndb.put_multi([
+            RegistrationTicket(parent=p_key, conference=self.conf.key)
+            for p_key in self.p_keys])
+        pending, commits = list(t_keys), 0
+        start = time.time()
+        while pending:
+            batch = pending[:registration_queue.BATCH_SIZE]
+            done = registration_queue.applyBatch(self.conf, batch)
+            pending = [k for k in pending if k not in done]
+            commits += 1
+        elapsed = time.time() - start
+        self._report('batched', len(t_keys), commits, elapsed)
+        results = [t.result for t in ndb.get_multi(t_keys)]
+        self.assertEqual(min(SEATS, ATTENDEES), results.count(True))
@@ -0,0 +1,59 @@
+"""Benchmark: full-text query latency over 100k sessions.
+
+Indexes generated session documents in the in-process index (no
+datastore or Search API involved) and times ranked queries of one to
+three terms, from rare to very common ones, reporting the median and
+95th percentile latency of each.
+"""
+
+import random
+import time
+import unittest
+
+import textsearch
+
+SESSIONS = 100000
+VOCABULARY = 5000   # distinct words; drawn with a skew, like real text
+QUERIES = 50        # timed runs per query
+PAGE_SIZE = 20
+
+
+class SearchBenchmark(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.words = ['word%d' % i for i in range(VOCABULARY)]
+
+        def text(count):
+            # low numbered words are the common ones
+            return ' '.join(self.words[int(rnd.paretovariate(1.2) - 1) %
+                                       VOCABULARY] for _ in range(count))
+        self.index = textsearch.MemoryIndex()
+        start = time.time()
+        self.index.put(textsearch.Document(
+            'session%d' % i, textsearch.SESSION, 'Session %d' % i,
+            [('name', text(4)), ('text', text(30)),
+             ('speaker', 'Speaker %d' % (i % 997))])
+            for i in range(SESSIONS))
+        self.seconds = time.time() - start
+
+    def _time(self, terms):
+        timings = []
+        for _ in range(QUERIES):
+            start = time.time()
+            hits, total = self.index.search(terms, limit=PAGE_SIZE)
+            timings.append(time.time() - start)
+        timings.sort()
+        return timings[len(timings) // 2], timings[len(timings) * 95 // 100], \
+            total
+
+    def test_latency(self):
+        print 'indexed %d sessions in %.1f s' % (SESSIONS, self.seconds)
+        for terms in ([self.words[1000]],
+                      [self.words[50]],
+                      [self.words[0]],
+                      [self.words[0], self.words[1]],
+                      [self.words[0], self.words[1], self.words[50]]):
+            median, p95, total = self._time(terms)
+            print '%-28s %6d matches  p50 %7.2f ms  p95 %7.2f ms' % (
+                ' '.join(terms), total, median * 1e3, p95 * 1e3)
+            self.assertTrue(median < 1.0)
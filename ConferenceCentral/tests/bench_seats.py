@@ -0,0 +1,107 @@
+"""Load benchmark for conference registration against the datastore stub.
+
+Fires concurrent registrations at a single conference, once through a
+single-entity transaction like the original `_conferenceRegistration`
+and once through the sharded seat counters, and reports throughput,
+contention failures and whether the conference was oversold.
+"""
+
+import threading
+import time
+import unittest
+
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile, SeatReservation, SeatShard
+import seats
+
+SEATS = 200
+ATTENDEES = 250
+THREADS = 10
+
+
+@ndb.transactional(xg=True)
+def _registerUnsharded(c_key, p_key):
+    """The pre-shard registration path: one Conference write per seat."""
+    conf, prof = ndb.get_multi([c_key, p_key])
+    if conf.seatsAvailable <= 0:
+        return seats.SOLD_OUT
+    prof.conferenceKeysToAttend.append(c_key.urlsafe())
+    conf.seatsAvailable -= 1
+    ndb.put_multi([conf, prof])
+    return seats.RESERVED
+
+
+class RegistrationBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # Apply every write immediately so only transaction contention,
+        # not eventual consistency, shows up in the numbers.
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _run(self, register, sharded=False):
+        conf = Conference(name='Rush', maxAttendees=SEATS,
+                          seatsAvailable=SEATS)
+        conf.put()
+        if sharded:
+            conf = seats.ensureShards(conf)
+        p_keys = ndb.put_multi(
+            [Profile(id='user%d' % i) for i in range(ATTENDEES)])
+        results = []
+        lock = threading.Lock()
+
+        def worker(chunk):
+            ndb.get_context().set_cache_policy(False)
+            for p_key in chunk:
+                try:
+                    status = register(conf, p_key)
+                except TransactionFailedError:
+                    status = 'FAILED'
+                with lock:
+                    results.append(status)
+
+        threads = [threading.Thread(target=worker,
+                                    args=(p_keys[i::THREADS],))
+                   for i in range(THREADS)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        return conf, results, elapsed
+
+    def _report(self, label, results, elapsed):
+        print '%-10s %6.1f registrations/s  reserved=%d sold_out=%d ' \
+              'failed=%d' % (label, len(results) / elapsed,
+                             results.count(seats.RESERVED),
+                             results.count(seats.SOLD_OUT),
+                             results.count('FAILED'))
+
+    def test_unsharded(self):
+        conf, results, elapsed = self._run(
+            lambda conf, p_key: _registerUnsharded(conf.key, p_key))
+        self._report('unsharded', results, elapsed)
+        self.assertTrue(results.count(seats.RESERVED) <= SEATS)
+        self.assertTrue(conf.key.get().seatsAvailable >= 0)
+
+    def test_sharded(self):
+        conf, results, elapsed = self._run(seats.reserve, sharded=True)
+        self._report('sharded', results, elapsed)
+        reserved = sum(s.reserved for s in SeatShard.query())
+        # never oversell: shards, ledger and results must all agree
+        self.assertTrue(reserved <= SEATS)
+        self.assertEqual(reserved, results.count(seats.RESERVED))
+        self.assertEqual(reserved, SeatReservation.query().count())
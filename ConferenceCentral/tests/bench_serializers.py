@@ -0,0 +1,92 @@
+"""Micro-benchmark: compiled serializers vs reflective form copying.
+
+Copies the same in-memory entities with the reflective loop the
+`_copy*ToForm` helpers used to run and with serializers.py, and reports
+the cost per entity.
+"""
+
+import timeit
+import unittest
+from datetime import date, time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, ConferenceForm, Session, SessionForm
+from serializers import CONFERENCE_SERIALIZER, SESSION_SERIALIZER
+
+ENTITIES = 2000
+REPEAT = 3
+
+
+def _reflectiveConference(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def _reflectiveSession(sess):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(sess, field.name):
+            if field.name in ['date', 'startTime']:
+                setattr(sf, field.name, str(getattr(sess, field.name)))
+            else:
+                setattr(sf, field.name, getattr(sess, field.name))
+        elif field.name == 'websafeKey':
+            setattr(sf, field.name, sess.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+class SerializerBenchmark(unittest.TestCase):
+    def setUp(self):
+        # only needed for an app id to build keys with
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        c_key = ndb.Key(Conference, 1)
+        self.confs = [
+            Conference(key=ndb.Key(Conference, i + 1), name='Conf %d' % i,
+                       description='x' * 200, topics=['Web', 'Cloud'],
+                       city='London', startDate=date(2015, 8, 8),
+                       endDate=date(2015, 8, 10), month=8,
+                       maxAttendees=100, seatsAvailable=50)
+            for i in range(ENTITIES)]
+        self.sessions = [
+            Session(key=ndb.Key(Session, i + 1, parent=c_key),
+                    name='Session %d' % i, highlights='y' * 200,
+                    speaker=['Frodo Baggins'], typeOfSession='lecture',
+                    date=date(2015, 8, 8), startTime=time(9, 30),
+                    duration=60, conferenceKey=c_key.urlsafe())
+            for i in range(ENTITIES)]
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _compare(self, label, entities, reflective, serializer):
+        old = min(timeit.repeat(lambda: [reflective(e) for e in entities],
+                                number=1, repeat=REPEAT))
+        new = min(timeit.repeat(lambda: serializer.toForms(entities),
+                                number=1, repeat=REPEAT))
+        print '%-10s reflective %6.1f us/entity  compiled %6.1f us/entity' \
+              '  (%.1fx)' % (label, old * 1e6 / len(entities),
+                             new * 1e6 / len(entities), old / new)
+        # both paths must produce the same forms
+        self.assertEqual(reflective(entities[0]),
+                         serializer.toForm(entities[0]))
+
+    def test_conferences(self):
+        self._compare('conference', self.confs, _reflectiveConference,
+                      CONFERENCE_SERIALIZER)
+
+    def test_sessions(self):
+        self._compare('session', self.sessions, _reflectiveSession,
+                      SESSION_SERIALIZER)
@@ -0,0 +1,77 @@
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, NearlySoldOut, Profile
+import announcements
+import seats
+
+
+class AnnouncementsTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _conference(self, name, seats_available, **props):
+        conf = Conference(name=name, maxAttendees=seats_available,
+                          seatsAvailable=seats_available, **props)
+        conf.put()
+        return conf
+
+    #### TESTS ####
+    def test_isNearlySoldOut(self):
+        conf = Conference(name='Conf')
+        self.assertTrue(announcements.isNearlySoldOut(conf, 5))
+        self.assertFalse(announcements.isNearlySoldOut(conf, 6))
+        self.assertFalse(announcements.isNearlySoldOut(conf, 0))
+        self.assertFalse(announcements.isNearlySoldOut(conf, None))
+        conf.nearlySoldOutThreshold = 20
+        self.assertTrue(announcements.isNearlySoldOut(conf, 20))
+
+    def test_track(self):
+        conf = self._conference('Conf', 6)
+        self.assertFalse(announcements.track(conf, 6))
+        self.assertEqual('', announcements.announcement())
+        self.assertTrue(announcements.track(conf, 5))
+        self.assertFalse(announcements.track(conf, 4))
+        self.assertEqual(announcements.TEMPLATE % 'Conf',
+                         announcements.announcement())
+        # sold out conferences are dropped straight away
+        self.assertTrue(announcements.track(conf, 0))
+        self.assertEqual('', announcements.announcement())
+
+    def test_registrations_update_set(self):
+        conf = seats.ensureShards(self._conference('Conf', 6), 2)
+        p_keys = ndb.put_multi([Profile(id='p%d' % i) for i in range(6)])
+        for p_key in p_keys[:1]:
+            seats.reserve(conf, p_key)
+        # the rollup runs the same check with the exact count
+        seats.rollup(conf.key)
+        self.assertEqual(announcements.TEMPLATE % 'Conf',
+                         announcements.announcement())
+        for p_key in p_keys[1:]:
+            seats.reserve(conf, p_key)
+        seats.rollup(conf.key)
+        self.assertEqual('', announcements.announcement())
+
+    def test_reconcile(self):
+        self._conference('B', 3)
+        self._conference('A', 1)
+        self._conference('Full', 0)
+        self._conference('Roomy', 50)
+        self._conference('Custom', 50, nearlySoldOutThreshold=50)
+        stale = self._conference('Stale', 40)
+        announcements.track(stale, 2)
+        self.assertEqual(announcements.TEMPLATE % 'A, B, Custom',
+                         announcements.reconcile())
+        self.assertEqual(3, len(NearlySoldOut.query().get().conferences))
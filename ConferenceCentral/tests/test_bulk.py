@@ -0,0 +1,99 @@
+import unittest
+from datetime import date, time
+from StringIO import StringIO
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile, Session
+import bulk
+import schedule
+import speakers
+import speaker_index
+import textsearch
+
+
+class BulkTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.search_index = textsearch.MemoryIndex()
+        self.previous_index = textsearch.setIndex(self.search_index)
+
+    def tearDown(self):
+        textsearch.setIndex(self.previous_index)
+        self.testbed.deactivate()
+
+    def _populate(self):
+        p_key = Profile(id='org@x.com', mainEmail='org@x.com',
+                        conferenceKeysToAttend=['abc']).put()
+        c_key = Conference(parent=p_key, name='Conf', topics=['Web'],
+                           organizerUserId='org@x.com', seatShards=3,
+                           startDate=date(2015,8,8)).put()
+        for name in ('A', 'B'):
+            Session(parent=c_key, name=name, speaker=['Frodo'],
+                    date=date(2015,8,8), startTime=time(9,30),
+                    conferenceKey=c_key.urlsafe()).put()
+        return c_key
+
+    def _dump(self):
+        out = StringIO()
+        stats = bulk.exportEntities(out, chunk_size=2)
+        return out.getvalue(), stats
+
+    def _reset(self):
+        # wipe the datastore, as if importing into a new app
+        ndb.delete_multi([k for model in bulk.MODELS
+                          for k in model.query().fetch(keys_only=True)])
+
+    #### TESTS ####
+    def test_round_trip(self):
+        c_key = self._populate()
+        dump, stats = self._dump()
+        self.assertEqual(4, stats['entities'])
+        self.assertEqual(4, len(dump.splitlines()))
+        self._reset()
+        stats = bulk.importEntities(StringIO(dump), chunk_size=3)
+        self.assertEqual({'Profile': 1, 'Conference': 1, 'Session': 2},
+                         stats['counts'])
+        conf = c_key.get()
+        self.assertEqual(date(2015,8,8), conf.startDate)
+        self.assertEqual(['Web'], conf.topics)
+        self.assertEqual(0, conf.seatShards)
+        self.assertEqual(time(9,30),
+                         Session.query(ancestor=c_key).get().startTime)
+        # derived session data is rebuilt
+        self.assertEqual(2, len(schedule.get(c_key).items))
+        self.assertEqual({'Frodo': 2}, speakers.tallyKey(c_key).get().counts)
+        self.assertEqual(['A', 'B'], sorted(
+            s.name for s in speaker_index.sessions('frodo')))
+        self.assertEqual(3, len(self.search_index))
+        # imported ids are not handed out again
+        first, _ = Conference.allocate_ids(size=1, parent=c_key.parent())
+        self.assertTrue(first > c_key.id())
+
+    def test_existing_skipped(self):
+        self._populate()
+        dump, _ = self._dump()
+        stats = bulk.importEntities(StringIO(dump))
+        self.assertEqual(0, stats['entities'])
+        self.assertEqual(4, stats['skipped'])
+
+    def test_emails_suppressed_by_default(self):
+        self._populate()
+        dump, _ = self._dump()
+        self._reset()
+        url = '/tasks/send_confirmation_email'
+        bulk.importEntities(StringIO(dump))
+        self.assertEqual(0, len(self.taskqueue_stub.get_filtered_tasks(url=url)))
+        self._reset()
+        bulk.importEntities(StringIO(dump), send_emails=True)
+        self.assertEqual(1, len(self.taskqueue_stub.get_filtered_tasks(url=url)))
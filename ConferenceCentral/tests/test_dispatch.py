@@ -0,0 +1,73 @@
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Profile
+import dispatch
+import requestcontext
+
+
+class DispatchTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _tasks(self):
+        return self.taskqueue_stub.get_filtered_tasks(url='/tasks/test')
+
+    def _request(self, handler):
+        app = requestcontext.middleware(
+            lambda environ, start_response: handler())
+        return app({'PATH_INFO': '/test'}, lambda status, headers: None)
+
+    #### TESTS ####
+    def test_sent_straight_away_outside_request(self):
+        dispatch.enqueue(url='/tasks/test', params={'a': '1'})
+        self.assertEqual(1, len(self._tasks()))
+
+    def test_batched_until_response(self):
+        counts = []
+        def handler():
+            for i in range(3):
+                dispatch.enqueue(url='/tasks/test', params={'i': str(i)})
+            counts.append(len(self._tasks()))
+            return []
+        self._request(handler)
+        self.assertEqual([0], counts)
+        self.assertEqual(3, len(self._tasks()))
+        stats = dispatch.stats()
+        self.assertEqual(3, stats['tasks'])
+        self.assertEqual(1, stats['batches'])
+
+    def test_deduplicated_by_name(self):
+        def handler():
+            dispatch.enqueue(url='/tasks/test', params={'a': '1'})
+            dispatch.enqueue(url='/tasks/test', params={'a': '1'})
+            return []
+        self._request(handler)
+        # a retried request cannot add the same task again
+        self._request(handler)
+        self.assertEqual(1, len(self._tasks()))
+        self.assertEqual(1, dispatch.stats()['duplicates'])
+
+    def test_sent_on_commit_only(self):
+        def write(fail):
+            Profile(id='user').put()
+            dispatch.enqueue(url='/tasks/test', name='commit-%s' % fail)
+            if fail:
+                raise ndb.Rollback()
+        ndb.transaction(lambda: write(True))
+        self.assertEqual(0, len(self._tasks()))
+        ndb.transaction(lambda: write(False))
+        self.assertEqual(1, len(self._tasks()))
@@ -9,7 +9,10 @@ from google.appengine.api import urlfetch
 from google.appengine.ext import testbed
 from google.appengine.api.app_identity import get_default_version_hostname
 
-from models import Conference, Session, Profile
+from models import Conference, Session, Profile, SeatShard, WishlistEntry
+import schedule
+import speaker_index
+import textsearch
 from datetime import date, time
 
 
@@ -34,8 +37,12 @@ class EndpointsTestCase(unittest.TestCase):
 #        ndb.get_context().set_cache_policy(False)
         self.urlbase = 'http://{0}/_ah/api/conference/v1'.format(
                                 get_default_version_hostname())
+        # search documents go to an in-process index
+        self.search_index = textsearch.MemoryIndex()
+        self.previous_index = textsearch.setIndex(self.search_index)
 
     def tearDown(self):
+        textsearch.setIndex(self.previous_index)
         ndb.get_context().clear_cache()
         self.testbed.deactivate()
 
@@ -82,6 +89,109 @@ class EndpointsTestCase(unittest.TestCase):
         sleep(0.1)
         self.assertEqual(len(Conference.query().fetch(5)), 0)
 
+    def test_queryConferences_paging(self):
+        # Create three conferences with an organizer profile
+        p_key = Profile(id='organizer', displayName='Org').put()
+        for name in ('A', 'B', 'C'):
+            Conference(name=name, organizerUserId='organizer',
+                       parent=p_key).put()
+        sleep(0.1)
+        url = '/queryConferences'
+        # First page holds two conferences and a token for the rest
+        res = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps({'filters': [], 'limit': 2}),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(len(page['items']), 2)
+        self.assertIn('nextPageToken', page)
+        # Second page holds the last conference and no token
+        params = {'filters': [], 'limit': 2,
+                  'pageToken': page['nextPageToken']}
+        res = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(len(page['items']), 1)
+        self.assertNotIn('nextPageToken', page)
+
+    def test_queryConferences_fullLastPage(self):
+        for name in ('A', 'B'):
+            Conference(name=name).put()
+        sleep(0.1)
+        res = urlfetch.fetch(self.urlbase + '/queryConferences',
+                        payload=json.dumps({'filters': [], 'limit': 2}),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        # a page that ends exactly on the last conference has no token
+        self.assertEqual(len(page['items']), 2)
+        self.assertNotIn('nextPageToken', page)
+
+    def test_queryConferences_missingOrganizer(self):
+        # Two conferences by one organizer and one with no profile
+        p_key = Profile(id='organizer', displayName='Org').put()
+        Conference(name='A', organizerUserId='organizer', parent=p_key).put()
+        Conference(name='B', organizerUserId='organizer', parent=p_key).put()
+        Conference(name='C', organizerUserId='nobody').put()
+        sleep(0.1)
+        res = urlfetch.fetch(self.urlbase + '/queryConferences',
+                        payload=json.dumps({'filters': []}),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        items = json.loads(res.content)['items']
+        self.assertEqual(len(items), 3)
+        names = [item.get('organizerDisplayName') for item in items]
+        self.assertEqual(names, ['Org', 'Org', None])
+
+    def test_queryConferences_fields(self):
+        p_key = Profile(id='organizer', displayName='Org').put()
+        Conference(name='A', city='London', startDate=date(2015,8,8),
+                   organizerUserId='organizer', parent=p_key).put()
+        sleep(0.1)
+        # Only the selected fields and the key come back
+        params = {'filters': [], 'fields': 'name,startDate'}
+        res = urlfetch.fetch(self.urlbase + '/queryConferences',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        item = json.loads(res.content)['items'][0]
+        self.assertEqual(sorted(item.keys()),
+                         ['name', 'startDate', 'websafeKey'])
+        # Unknown field names are rejected
+        params = {'filters': [], 'fields': 'name,nope'}
+        res = urlfetch.fetch(self.urlbase + '/queryConferences',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_queryConferences_multiInequality(self):
+        for i in range(6):
+            Conference(name='Conf %d' % i, city='London', month=i + 1,
+                       maxAttendees=10 * i).put()
+        sleep(0.1)
+        # Inequalities on two fields; one is applied as a post-filter
+        params = {'debug': True, 'filters': [
+            {'field': 'MONTH', 'operator': 'GT', 'value': '2'},
+            {'field': 'MAX_ATTENDEES', 'operator': 'LT', 'value': '50'},
+            {'field': 'CITY', 'operator': 'NE', 'value': 'Paris'}]}
+        res = urlfetch.fetch(self.urlbase + '/queryConferences',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(['Conf 2', 'Conf 3', 'Conf 4'],
+                         sorted(item['name'] for item in page['items']))
+        self.assertIn('post-filter', page['queryPlan'])
+
     def test_getConferenceSessions(self):
         # Create conference and get websafe key
         url = '/conference'
@@ -100,6 +210,23 @@ class EndpointsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(json.loads(res.content)['items']), 3)
 
+    def test_getConferenceSessions_cached(self):
+        conf = Conference(name='Test Conference')
+        wck = conf.put()
+        wcksafe = wck.urlsafe()
+        props = {'name': 'Monkey Business', 'date': date(2015,8,8),
+                 'parent': wck, 'conferenceKey': wcksafe,
+                 'startTime': time(10,15)}
+        Session(**props).put()
+        url = self.urlbase + '/conference/{0}/session'.format(wcksafe)
+        # First call fills the cache, second one is served from it
+        self.assertEqual(len(json.loads(urlfetch.fetch(url).content)['items']), 1)
+        Session(**props).put()
+        self.assertEqual(len(json.loads(urlfetch.fetch(url).content)['items']), 1)
+        stats = json.loads(urlfetch.fetch(self.urlbase + '/cache/stats').content)
+        self.assertEqual(stats['hits'], '1')
+        self.assertEqual(stats['misses'], '1')
+
     def test_getConferenceSessionsByType(self):
         # Create conference and get websafe key
         conf = Conference(name='Test Conference')
@@ -136,18 +263,195 @@ class EndpointsTestCase(unittest.TestCase):
         propsB = {'name': 'Monkey Business', 'date': date(2015,9,12),
                   'parent': wckB, 'conferenceKey': wckBsafe,
                   'typeOfSession': 'workshop', 'startTime': time(12,15)}
-        # Add two to first created conference
-        Session(speaker=['Sarah', 'Frodo'], **propsA).put()
-        Session(speaker=['Frodo'], **propsA).put()
-        # Add two to second created conference
-        Session(speaker=['Saruman'], **propsB).put()
-        Session(speaker=['Gollum', 'Frodo'], **propsB).put()
-        # Test the endpoint
+        sessions = [
+            # Add two to first created conference
+            Session(speaker=['Sarah', 'Frodo'], **propsA),
+            Session(speaker=['Frodo'], **propsA),
+            # Add two to second created conference
+            Session(speaker=['Saruman'], **propsB),
+            Session(speaker=['Gollum', ' frodo '], **propsB),
+        ]
+        ndb.put_multi(sessions)
+        # Index them, as session writes through the API do
+        speaker_index.add(sessions)
+        # Test the endpoint; names match regardless of case and spacing
         url = '/speaker/{0}'.format('Frodo')
         res = urlfetch.fetch(self.urlbase + url)
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(json.loads(res.content)['items']), 3)
 
+    def test_getSessionsBySpeaker_afterCreate(self):
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        conf = Conference(name='Test Conference',
+                          organizerUserId=json.loads(res.content)['mainEmail'])
+        url = '/conference/{0}/session'.format(conf.put().urlsafe())
+        params = {'name': 'Keynote', 'date': '2015-8-10',
+                  'startTime': '9:10', 'speaker': ['Frodo Baggins']}
+        res = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        # Visible straight away, with no wait for indexes to catch up
+        res = urlfetch.fetch(self.urlbase + '/speaker/frodo%20baggins')
+        self.assertEqual(['Keynote'], [item['name'] for item in
+                                       json.loads(res.content)['items']])
+
+    def test_getSessionsBySpeaker_fields(self):
+        conf = Conference(name='Test Conference')
+        wck = conf.put()
+        sess = Session(name='Monkey Business', speaker=['Frodo'],
+                       date=date(2015,8,8), startTime=time(18,15),
+                       parent=wck, conferenceKey=wck.urlsafe())
+        sess.put()
+        speaker_index.add([sess])
+        url = '/speaker/{0}?fields={1}'.format('Frodo', 'name,speaker')
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertEqual(res.status_code, 200)
+        item = json.loads(res.content)['items'][0]
+        self.assertEqual(sorted(item.keys()), ['name', 'speaker', 'websafeKey'])
+
+    def test_search(self):
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        email = json.loads(res.content)['mainEmail']
+        params = {'name': 'Python Summit',
+                  'description': 'All about python packaging'}
+        res = urlfetch.fetch(self.urlbase + '/conference',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        conf = Conference.query().get()
+        url = '/conference/{0}/session'.format(conf.key.urlsafe())
+        for name in ('Packaging in Python', 'Testing Go'):
+            params = {'name': name, 'date': '2015-8-10', 'startTime': '9:10',
+                      'highlights': 'Hands on', 'speaker': ['Frodo']}
+            res = urlfetch.fetch(self.urlbase + url,
+                            payload=json.dumps(params),
+                            method=urlfetch.POST,
+                            headers={'Content-Type': 'application/json'})
+            self.assertEqual(res.status_code, 200)
+        # written documents are searchable straight away, names rank first
+        res = urlfetch.fetch(self.urlbase + '/search?q=Python%20packaging')
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(2, int(page['total']))
+        self.assertEqual(['Packaging in Python', 'Python Summit'],
+                         [item['name'] for item in page['items']])
+        res = urlfetch.fetch(self.urlbase +
+                             '/search?q=python&kind=Session&limit=1')
+        page = json.loads(res.content)
+        self.assertEqual(['Session'], [item['kind'] for item in page['items']])
+        self.assertNotIn('nextPageToken', page)
+        res = urlfetch.fetch(self.urlbase + '/search?q=frodo&limit=1')
+        page = json.loads(res.content)
+        self.assertEqual('1', page['nextPageToken'])
+        res = urlfetch.fetch(self.urlbase + '/search?q=the')
+        self.assertEqual(res.status_code, 400)
+
+    def test_getConferenceFacets(self):
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        self.assertEqual(res.status_code, 200)
+        params = {'name': 'Facets', 'city': 'London', 'topics': ['Web'],
+                  'startDate': '2015-08-08', 'maxAttendees': 10}
+        res = urlfetch.fetch(self.urlbase + '/conference',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        wck = Conference.query().get().key.urlsafe()
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             payload=json.dumps({'city': 'Paris'}),
+                             method=urlfetch.PUT,
+                             headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        # the 10th seat taken moves the conference to the 1-9 bucket
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             method='POST')
+        self.assertEqual(res.status_code, 200)
+        res = urlfetch.fetch(self.urlbase + '/conferences/facets')
+        self.assertEqual(res.status_code, 200)
+        found = dict((facet['name'],
+                      [(v['value'], int(v['count'])) for v in facet['values']])
+                     for facet in json.loads(res.content)['items'])
+        self.assertEqual({'city': [('Paris', 1)], 'topic': [('Web', 1)],
+                          'month': [('8', 1)], 'seats': [('1-9', 1)]}, found)
+        # a failed update gives the seat shards their capacity back
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             payload=json.dumps({'maxAttendees': 60,
+                                                 'startDate': 'someday'}),
+                             method=urlfetch.PUT,
+                             headers={'Content-Type': 'application/json'})
+        self.assertNotEqual(res.status_code, 200)
+        self.assertEqual(10, sum(s.capacity for s in SeatShard.query()))
+
+    def test_getAnnouncement(self):
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        self.assertEqual(res.status_code, 200)
+        params = {'name': 'Tiny', 'maxAttendees': 3,
+                  'nearlySoldOutThreshold': 2}
+        res = urlfetch.fetch(self.urlbase + '/conference',
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        wck = Conference.query().get().key.urlsafe()
+        url = '/conference/announcement/get'
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertNotIn('Tiny', json.loads(res.content).get('data', ''))
+        # a registration that crosses the threshold shows up at once
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             method='POST')
+        self.assertEqual(res.status_code, 200)
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertIn('Tiny', json.loads(res.content)['data'])
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             method='DELETE')
+        self.assertEqual(res.status_code, 200)
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertNotIn('Tiny', json.loads(res.content).get('data', ''))
+        # thresholds are bounded
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             payload=json.dumps({'nearlySoldOutThreshold': 101}),
+                             method=urlfetch.PUT,
+                             headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 400)
+        # a new threshold is checked against the live seat count
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             method='POST')
+        self.assertEqual(res.status_code, 200)
+        for threshold, listed in ((1, False), (2, True)):
+            res = urlfetch.fetch(
+                self.urlbase + '/conference/{0}'.format(wck),
+                payload=json.dumps({'nearlySoldOutThreshold': threshold}),
+                method=urlfetch.PUT,
+                headers={'Content-Type': 'application/json'})
+            self.assertEqual(res.status_code, 200)
+            res = urlfetch.fetch(self.urlbase + url)
+            self.assertEqual(listed, 'Tiny' in
+                             json.loads(res.content).get('data', ''))
+
+    def test_getSpeakers(self):
+        wck = Conference(name='Test Conference').put()
+        sess = Session(name='Monkey Business',
+                       speaker=['Frodo', 'Fredegar Bolger', 'Sam'],
+                       date=date(2015,8,8), startTime=time(18,15),
+                       parent=wck, conferenceKey=wck.urlsafe())
+        sess.put()
+        speaker_index.add([sess])
+        res = urlfetch.fetch(self.urlbase + '/speakers?prefix=FR&limit=1')
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(['Fredegar Bolger'],
+                         [item['name'] for item in page['items']])
+        url = '/speakers?prefix=fr&limit=1&pageToken={0}'.format(
+            page['nextPageToken'])
+        page = json.loads(urlfetch.fetch(self.urlbase + url).content)
+        self.assertEqual(['Frodo'], [item['name'] for item in page['items']])
+        self.assertNotIn('nextPageToken', page)
+        res = urlfetch.fetch(self.urlbase + '/speakers?limit=51')
+        self.assertEqual(res.status_code, 400)
+
     def test_addSessionToWishlist(self):
         # Check that no profiles exist in datastore
         prof = Profile.query().get()
@@ -166,9 +470,12 @@ class EndpointsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(json.loads(res.content)['data'])
         sleep(0.1)
-        # Get profile and check for one session key
+        # Get profile and check for one wishlist entry
         prof = Profile.query().get()
-        self.assertEqual(len(prof.sessionKeysToAttend), 1)
+        self.assertEqual(WishlistEntry.query(ancestor=prof.key).count(), 1)
+        # Adding the same session again is a conflict
+        res = urlfetch.fetch(self.urlbase + url, method='POST')
+        self.assertEqual(res.status_code, 409)
 
     def test_getSessionsInWishlist(self):
         # Create conference and get websafe key
@@ -183,7 +490,7 @@ class EndpointsTestCase(unittest.TestCase):
         res = urlfetch.fetch(self.urlbase + '/profile')
         self.assertEqual(res.status_code, 200)
         sleep(0.1)
-        # Create profile with session key in wishlist
+        # Create profile with a legacy session key list in wishlist
         profile = Profile.query().get()
         profile.sessionKeysToAttend = [sk.urlsafe()]
         profile.put()
@@ -193,6 +500,95 @@ class EndpointsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         # Test if one entry in returned items list
         self.assertEqual(len(json.loads(res.content)['items']), 1)
+        # The legacy list was moved into wishlist entries
+        sleep(0.1)
+        profile = profile.key.get(use_cache=False)
+        self.assertEqual(profile.sessionKeysToAttend, [])
+        self.assertEqual(WishlistEntry.query(ancestor=profile.key).count(), 1)
+
+    def test_getConferencesToAttend(self):
+        c_keys = [Conference(name=name, maxAttendees=5,
+                             seatsAvailable=5).put()
+                  for name in ('A', 'B')]
+        for c_key in c_keys:
+            url = '/conference/{0}'.format(c_key.urlsafe())
+            res = urlfetch.fetch(self.urlbase + url, method='POST')
+            self.assertEqual(res.status_code, 200)
+        sleep(0.1)
+        # a deleted conference is skipped
+        c_keys[0].delete()
+        res = urlfetch.fetch(self.urlbase + '/conferences/attending')
+        self.assertEqual(res.status_code, 200)
+        items = json.loads(res.content)['items']
+        self.assertEqual(['B'], [item['name'] for item in items])
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        self.assertEqual(2, len(json.loads(res.content)[
+            'conferenceKeysToAttend']))
+
+    def test_getConferenceAttendees(self):
+        res = urlfetch.fetch(self.urlbase + '/profile')
+        email = json.loads(res.content)['mainEmail']
+        wck = Conference(name='Test', organizerUserId=email,
+                         maxAttendees=5, seatsAvailable=5).put().urlsafe()
+        res = urlfetch.fetch(self.urlbase + '/conference/{0}'.format(wck),
+                             method='POST')
+        self.assertEqual(res.status_code, 200)
+        sleep(0.1)
+        url = '/conference/{0}/attendees?limit=10'.format(wck)
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertEqual(res.status_code, 200)
+        items = json.loads(res.content)['items']
+        self.assertEqual([email], [item['mainEmail'] for item in items])
+        # only the organizer may list attendees
+        other = Conference(name='Other', organizerUserId='someone@else.com')
+        url = '/conference/{0}/attendees'.format(other.put().urlsafe())
+        res = urlfetch.fetch(self.urlbase + url)
+        self.assertEqual(res.status_code, 403)
+
+    def test_wishlistBatch(self):
+        # Create conference and two sessions
+        wck = Conference(name='Test_conference').put()
+        props = {'date': date(2015,8,8), 'startTime': time(18,15),
+                 'parent': wck, 'conferenceKey': wck.urlsafe()}
+        wsks = [Session(name=name, **props).put().urlsafe()
+                for name in ('A', 'B')]
+        gone = Session(name='C', **props).put()
+        gone.delete()
+        url = self.urlbase + '/wishlist/batch/{0}'
+        payload = {'websafeSessionKeys': wsks + [wsks[0], gone.urlsafe()]}
+        res = urlfetch.fetch(url.format('add'), payload=json.dumps(payload),
+                             method=urlfetch.POST,
+                             headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.content)['items']
+        # Both sessions added; the duplicate and deleted session reported
+        self.assertEqual([True, True, False, False],
+                         [r['changed'] for r in results])
+        self.assertEqual([False, False, True, True],
+                         ['error' in r for r in results])
+        sleep(0.1)
+        self.assertEqual(WishlistEntry.query().count(), 2)
+        # Remove one in a batch, then the other on its own
+        payload = {'websafeSessionKeys': wsks[:1]}
+        res = urlfetch.fetch(url.format('remove'),
+                             payload=json.dumps(payload),
+                             method=urlfetch.POST,
+                             headers={'Content-Type': 'application/json'})
+        self.assertTrue(json.loads(res.content)['items'][0]['changed'])
+        single = self.urlbase + '/wishlist/{0}'.format(wsks[1])
+        res = urlfetch.fetch(single, method=urlfetch.DELETE)
+        self.assertEqual(res.status_code, 200)
+        res = urlfetch.fetch(single, method=urlfetch.DELETE)
+        self.assertEqual(res.status_code, 404)
+        # Keys that are not session keys are rejected
+        for wsk in ('not-a-key', wck.urlsafe()):
+            for method in (urlfetch.POST, urlfetch.DELETE):
+                res = urlfetch.fetch(
+                    self.urlbase + '/wishlist/{0}'.format(wsk),
+                    method=method)
+                self.assertEqual(res.status_code, 400)
+        sleep(0.1)
+        self.assertEqual(WishlistEntry.query().count(), 0)
 
     # Test for the solution to the special query related problem.
     def test_getQuerySolution(self):
@@ -214,6 +610,40 @@ class EndpointsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(json.loads(res.content)['items']), 2)
 
+    def test_querySessions(self):
+        wck = Conference(name='Test Conference').put()
+        props = {'date': date(2015,8,8), 'parent': wck,
+                 'conferenceKey': wck.urlsafe()}
+        Session(name='A', typeOfSession='workshop', startTime=time(10,15),
+                duration=60, speaker=['Frodo'], **props).put()
+        Session(name='B', typeOfSession='lecture', startTime=time(15,15),
+                duration=45, speaker=['Frodo'], **props).put()
+        Session(name='C', typeOfSession='lecture', startTime=time(19,15),
+                duration=30, speaker=['Sam'], **props).put()
+        sleep(0.1)
+        url = '/conference/{0}/sessions/query'.format(wck.urlsafe())
+        params = {'debug': True, 'filters': [
+            {'field': 'TYPE', 'operator': 'NE', 'value': 'workshop'},
+            {'field': 'START_TIME', 'operator': 'LT', 'value': '19:00'},
+            {'field': 'DURATION', 'operator': 'GTEQ', 'value': '40'},
+            {'field': 'SPEAKER', 'operator': 'EQ', 'value': 'Frodo'}]}
+        res = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 200)
+        page = json.loads(res.content)
+        self.assertEqual(['B'], [item['name'] for item in page['items']])
+        self.assertIn('queryPlan', page)
+        # Values must parse for their field
+        params = {'filters': [
+            {'field': 'DATE', 'operator': 'EQ', 'value': 'soon'}]}
+        res = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps(params),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 400)
+
     def test_getConferenceSessionsBySpeaker(self):
         # Create conference and get websafe key
         conf = Conference(name='Test Conference')
@@ -267,6 +697,103 @@ class EndpointsTestCase(unittest.TestCase):
 
 
 
+    def test_createSessions(self):
+        # Ensure default profile is created
+        res = urlfetch.fetch(self.urlbase + '/profile', method='GET')
+        self.assertEqual(res.status_code, 200)
+        conf = Conference(
+            name='Test Conference',
+            organizerUserId=json.loads(res.content)['mainEmail'],
+            startDate=date(2015,8,8), endDate=date(2015,8,10)
+        )
+        wcksafe = conf.put().urlsafe()
+        items = [
+            {'name': 'A', 'date': '2015-8-8', 'startTime': '9:10',
+             'speaker': ['Frodo']},
+            {'name': 'B', 'date': '2015-9-8', 'startTime': '9:10'},
+            {'name': 'C', 'date': '2015-8-9', 'startTime': '10:10',
+             'speaker': ['Frodo']},
+            {'name': 'D'},
+        ]
+        url = '/conference/{0}/sessions'.format(wcksafe)
+        response = urlfetch.fetch(self.urlbase + url,
+                        payload=json.dumps({'items': items}),
+                        method=urlfetch.POST,
+                        headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['items']
+        # Out of range and incomplete items are reported, the rest written
+        self.assertEqual([False, True, False, True],
+                         ['error' in result for result in results])
+        self.assertEqual(['A', 'C'], [r['session']['name'] for r in results
+                                      if 'session' in r])
+        self.assertEqual(2, len(Session.query().fetch()))
+        url = '/conference/featuredspeaker?websafeConferenceKey={0}'
+        res = urlfetch.fetch(self.urlbase + url.format(wcksafe))
+        self.assertEqual(json.loads(res.content)['data'], 'Frodo')
+
+    def test_getConferenceSessions_schedule(self):
+        # Ensure default profile is created
+        res = urlfetch.fetch(self.urlbase + '/profile', method='GET')
+        self.assertEqual(res.status_code, 200)
+        conf = Conference(
+            name='Test Conference',
+            organizerUserId=json.loads(res.content)['mainEmail']
+        )
+        wcksafe = conf.put().urlsafe()
+        sess_url = self.urlbase + '/conference/{0}/session'.format(wcksafe)
+        # Create sessions out of chronological order
+        keys = []
+        for start in ('15:00', '9:30', '11:00'):
+            props = {'name': 'Session ' + start, 'date': '2015-8-8',
+                     'startTime': start, 'conferenceKey': wcksafe}
+            res = urlfetch.fetch(sess_url, payload=json.dumps(props),
+                            method=urlfetch.POST,
+                            headers={'Content-Type': 'application/json'})
+            self.assertEqual(res.status_code, 200)
+            keys.append(json.loads(res.content)['websafeKey'])
+        # The schedule lists them sorted by start time
+        items = json.loads(urlfetch.fetch(sess_url).content)['items']
+        self.assertEqual([i['startTime'] for i in items],
+                         ['09:30:00', '11:00:00', '15:00:00'])
+        # Deleting a session updates the schedule
+        res = urlfetch.fetch(self.urlbase + '/session/' + keys[1],
+                             method=urlfetch.DELETE)
+        self.assertEqual(res.status_code, 200)
+        items = json.loads(urlfetch.fetch(sess_url).content)['items']
+        self.assertEqual([i['startTime'] for i in items],
+                         ['11:00:00', '15:00:00'])
+
+    def test_getConferenceSessions_oversizedSchedule(self):
+        # Ensure default profile is created
+        res = urlfetch.fetch(self.urlbase + '/profile', method='GET')
+        self.assertEqual(res.status_code, 200)
+        conf = Conference(
+            name='Test Conference',
+            organizerUserId=json.loads(res.content)['mainEmail']
+        )
+        wcksafe = conf.put().urlsafe()
+        sess_url = self.urlbase + '/conference/{0}/session'.format(wcksafe)
+        max_payload = schedule.MAX_PAYLOAD
+        schedule.MAX_PAYLOAD = 1
+        try:
+            for start in ('15:00', '9:30'):
+                props = {'name': 'Session ' + start, 'date': '2015-8-8',
+                         'startTime': start, 'conferenceKey': wcksafe}
+                res = urlfetch.fetch(sess_url, payload=json.dumps(props),
+                                method=urlfetch.POST,
+                                headers={'Content-Type': 'application/json'})
+                self.assertEqual(res.status_code, 200)
+            items = json.loads(urlfetch.fetch(sess_url).content)['items']
+        finally:
+            schedule.MAX_PAYLOAD = max_payload
+        # The sessions are queried; only the marker is stored
+        self.assertEqual([i['startTime'] for i in items],
+                         ['09:30:00', '15:00:00'])
+        sched = schedule.scheduleKey(conf.key).get()
+        self.assertTrue(sched.oversized)
+        self.assertEqual(None, sched.payload)
+
     def test_getFeaturedSpeaker(self):
         test_url = '/conference/featuredspeaker?websafeConferenceKey={wcksafe}'
         sess_url = '/conference/{wcksafe}/session'
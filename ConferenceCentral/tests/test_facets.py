@@ -0,0 +1,81 @@
+import unittest
+from datetime import date
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, FacetShard, Profile
+import facets
+import seats
+
+
+class FacetsTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _conference(self, **props):
+        conf = Conference(name='Conf', **props)
+        conf.put()
+        facets.update(after=facets.values(conf))
+        return conf
+
+    #### TESTS ####
+    def test_values(self):
+        conf = Conference(name='Conf', city='London', topics=['Web', 'Web'],
+                          month=8, seatsAvailable=0)
+        self.assertEqual(['topic:Web', 'city:London', 'month:8', 'seats:0'],
+                         facets.values(conf))
+        self.assertEqual([], facets.values(Conference(name='Bare')))
+        self.assertEqual('1-9', facets.seatsBucket(9))
+        self.assertEqual('100+', facets.seatsBucket(500))
+        self.assertEqual(None, facets.seatsBucket(None))
+
+    def test_update_and_counts(self):
+        for city in ('London', 'London', 'Paris'):
+            self._conference(city=city, topics=['Web'])
+        self.assertEqual({'city:London': 2, 'city:Paris': 1, 'topic:Web': 3},
+                         facets.counts())
+        # a cached count is dropped when a conference moves
+        conf = Conference.query(Conference.city == 'Paris').get()
+        before = facets.values(conf)
+        conf.city = 'London'
+        facets.update(before, facets.values(conf))
+        self.assertEqual({'city:London': 3, 'topic:Web': 3}, facets.counts())
+
+    def test_counts_spread_over_shards(self):
+        for i in range(40):
+            self._conference(city='London')
+        shards = FacetShard.query().fetch()
+        self.assertTrue(len(shards) > 1)
+        self.assertEqual(40, sum(s.counts.get('city:London', 0)
+                                 for s in shards))
+
+    def test_rollup_moves_seats_bucket(self):
+        conf = self._conference(maxAttendees=10, seatsAvailable=10)
+        conf = seats.ensureShards(conf, 2)
+        self.assertEqual({'seats:10-49': 1}, facets.counts())
+        seats.reserve(conf, Profile(id='a').put())
+        seats.rollup(conf.key)
+        self.assertEqual({'seats:1-9': 1}, facets.counts())
+
+    def test_rebuild(self):
+        Conference(name='Old', city='Rome', startDate=date(2015,3,1),
+                   month=3).put()
+        self._conference(city='Paris')
+        memcache.flush_all()
+        totals = facets.rebuild()
+        self.assertEqual({'city:Rome': 1, 'city:Paris': 1, 'month:3': 1},
+                         dict(totals))
+        self.assertEqual(dict(totals), facets.counts())
+        self.assertEqual(1, len([s for s in FacetShard.query() if s.counts]))
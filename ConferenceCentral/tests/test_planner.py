@@ -0,0 +1,102 @@
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from datetime import date, time
+
+from models import Conference, Session
+import planner
+import queries
+
+
+class PlannerTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _populate(self):
+        for i in range(12):
+            Conference(name='Conf %02d' % i, city=['London', 'Paris'][i % 2],
+                       month=i % 12 + 1, maxAttendees=10 * i,
+                       topics=['Web'] if i % 3 else ['Web', 'Data']).put()
+
+    def _names(self, filters, limit=100):
+        p = planner.plan(Conference, filters)
+        confs, _, cursor = queries.fetchPage(p.query, limit, match=p.match,
+                                             organizers=False)
+        return [c.name for c in confs], cursor
+
+    #### TESTS ####
+    def test_equality_pushed_first(self):
+        p = planner.plan(Conference, [('maxAttendees', '>', 20),
+                                      ('city', '=', 'London')])
+        # (city, maxAttendees, name) is in index.yaml
+        self.assertEqual([('city', '=', 'London'), ('maxAttendees', '>', 20)],
+                         p.pushed)
+        self.assertEqual(None, p.match)
+        self.assertEqual(['maxAttendees', 'name'], p.orders)
+
+    def test_second_range_post_filtered(self):
+        filters = [('month', '>', 2), ('maxAttendees', '>=', 30),
+                   ('maxAttendees', '<', 90), ('city', '!=', 'Paris')]
+        p = planner.plan(Conference, filters)
+        # the bounded range is the most selective one
+        self.assertEqual(filters[1:3], p.pushed)
+        self.assertEqual([filters[0], filters[3]], p.post)
+        self.assertIn('post-filter: month > 2', planner.describe(p))
+
+    def test_results_match_filters(self):
+        self._populate()
+        filters = [('month', '>', 4), ('maxAttendees', '<', 100),
+                   ('city', '!=', 'Paris'), ('topics', '=', 'Data')]
+        names, _ = self._names(filters)
+        self.assertEqual(['Conf 06'], names)
+
+    def test_paging_with_post_filter(self):
+        self._populate()
+        filters = [('month', '>=', 3), ('maxAttendees', '<', 110)]
+        expected, _ = self._names(filters)
+        self.assertEqual(['Conf %02d' % i for i in range(2, 11)], expected)
+        p = planner.plan(Conference, filters)
+        seen, cursor = [], None
+        while True:
+            confs, _, cursor = queries.fetchPage(
+                p.query, 4, cursor, match=p.match, organizers=False)
+            seen.extend(c.name for c in confs)
+            if not cursor:
+                break
+        self.assertEqual(sorted(expected), sorted(seen))
+
+    def test_session_plan(self):
+        c_key = Conference(name='Conf').put()
+        for i, kind in enumerate(['workshop', 'lecture', 'social'] * 4):
+            Session(parent=c_key, name='S%d' % i, typeOfSession=kind,
+                    date=date(2015,8,8 + i % 2), startTime=time(9 + i, 0),
+                    duration=30 + 10 * i, conferenceKey=c_key.urlsafe()).put()
+        p = planner.plan(Session, [('typeOfSession', '!=', 'workshop'),
+                                   ('startTime', '<', time(19))],
+                         ancestor=c_key, orders=('date', 'startTime'))
+        self.assertEqual(['startTime', 'date'], p.orders)
+        self.assertEqual([('typeOfSession', '!=', 'workshop')], p.post)
+        names = [s.name for s in planner.iterate(p, batch_size=2)]
+        self.assertEqual(['S1', 'S2', 'S4', 'S5', 'S7', 'S8'], names)
+        # a page stops when full and resumes from its cursor
+        page, cursor = planner.fetchPage(p, 4)
+        rest, cursor = planner.fetchPage(p, 4, cursor)
+        self.assertEqual(names, [s.name for s in page + rest])
+        self.assertEqual(None, cursor)
+
+    def test_matcher_repeated(self):
+        match = planner.matcher([('topics', '>', 'A'), ('topics', '<', 'C')])
+        self.assertFalse(match(Conference(topics=['A', 'C'])))
+        self.assertTrue(match(Conference(topics=['A', 'Big'])))
+        self.assertFalse(match(Conference(topics=[])))
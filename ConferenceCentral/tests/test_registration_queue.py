@@ -0,0 +1,91 @@
+import os
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile
+import registration_queue
+import seats
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RegistrationQueueTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        # root_path makes the stub load queue.yaml (registrations pull queue)
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        conf = Conference(name='Test', maxAttendees=3, seatsAvailable=3)
+        conf.put()
+        self.conf = seats.ensureShards(conf, 2)
+        self.p_keys = ndb.put_multi(
+            [Profile(id='user%d' % i) for i in range(5)])
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    #### TESTS ####
+    def test_drain(self):
+        tickets = [registration_queue.enqueue(self.conf.key, p_key)
+                   for p_key in self.p_keys]
+        self.assertEqual(5, registration_queue.drain(self.conf.key))
+        tickets = ndb.get_multi([t.key for t in tickets])
+        self.assertTrue(all(t.status == registration_queue.DONE
+                            for t in tickets))
+        self.assertEqual(3, [t.result for t in tickets].count(True))
+        self.assertEqual(0, seats.seatsAvailable(self.conf))
+
+    def test_batch_register_and_unregister(self):
+        p_key = self.p_keys[0]
+        keys = [
+            registration_queue.enqueue(self.conf.key, p_key).key,
+            registration_queue.enqueue(self.conf.key, p_key).key,
+            registration_queue.enqueue(self.conf.key, p_key, False).key,
+        ]
+        self.assertEqual(set(keys),
+                         registration_queue.applyBatch(self.conf, keys))
+        first, again, unreg = ndb.get_multi(keys)
+        self.assertTrue(first.result)
+        self.assertFalse(again.result)
+        self.assertEqual(registration_queue.ALREADY_REGISTERED, again.error)
+        self.assertTrue(unreg.result)
+        self.assertEqual([], seats.registrationIds(p_key))
+        self.assertEqual(3, seats.seatsAvailable(self.conf))
+
+    def test_pool_filled_outside_batch(self):
+        t_key = registration_queue.enqueue(self.conf.key, self.p_keys[0]).key
+        planBatch = registration_queue._planBatch
+
+        def planThenFill(conf, tickets, reservations):
+            plan = planBatch(conf, tickets, reservations)
+            # direct registrations fill the chosen shards meanwhile
+            others = iter(self.p_keys[1:])
+            for s_key in plan[1]:
+                shard = s_key.get()
+                for i in range(shard.capacity - shard.reserved):
+                    seats._reserveOnShard(s_key, conf.key, next(others))
+            return plan
+        registration_queue._planBatch = planThenFill
+        try:
+            self.assertEqual(set(),
+                             registration_queue.applyBatch(self.conf, [t_key]))
+        finally:
+            registration_queue._planBatch = planBatch
+        # not sold out: another shard has a seat, so it is planned again
+        self.assertEqual(registration_queue.PENDING, t_key.get().status)
+        self.assertEqual(set([t_key]),
+                         registration_queue.applyBatch(self.conf, [t_key]))
+        self.assertTrue(t_key.get().result)
+
+    def test_applied_twice(self):
+        t_key = registration_queue.enqueue(self.conf.key, self.p_keys[0]).key
+        registration_queue.applyBatch(self.conf, [t_key])
+        registration_queue.applyBatch(self.conf, [t_key])
+        self.assertEqual(2, seats.seatsAvailable(self.conf))
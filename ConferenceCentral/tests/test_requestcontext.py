@@ -0,0 +1,58 @@
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Profile
+import requestcontext
+
+
+class RequestContextTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.calls = []
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _resolve(self):
+        self.calls.append(1)
+        return 'value'
+
+    def _request(self, handler, path='/_ah/spi/ConferenceApi.test'):
+        app = requestcontext.middleware(
+            lambda environ, start_response: handler())
+        return app({'PATH_INFO': path}, lambda status, headers: None)
+
+    #### TESTS ####
+    def test_memoized_within_request(self):
+        def handler():
+            requestcontext.memoize('key', self._resolve)
+            return [requestcontext.memoize('key', self._resolve)]
+        self.assertEqual(['value'], self._request(handler))
+        self.assertEqual(1, len(self.calls))
+        # a new request resolves again
+        self._request(handler)
+        self.assertEqual(2, len(self.calls))
+
+    def test_not_memoized_outside_request(self):
+        requestcontext.memoize('key', self._resolve)
+        requestcontext.memoize('key', self._resolve)
+        self.assertEqual(2, len(self.calls))
+
+    def test_counts_datastore_rpcs(self):
+        p_key = Profile(id='user').put()
+        counts = []
+        def handler():
+            p_key.get()
+            ndb.get_multi([p_key, ndb.Key(Profile, 'other')])
+            counts.append(requestcontext.rpcCounts())
+            return []
+        self._request(handler)
+        self.assertEqual({'Get': 2}, counts[0])
@@ -0,0 +1,152 @@
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.api.datastore_errors import TransactionFailedError
+
+from models import Conference, Profile, SeatShard, SeatReservation
+import seats
+
+
+class SeatShardTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _conference(self, maxAttendees, seatsAvailable=None, shards=None):
+        if seatsAvailable is None:
+            seatsAvailable = maxAttendees
+        conf = Conference(name='Test', maxAttendees=maxAttendees,
+                          seatsAvailable=seatsAvailable)
+        conf.put()
+        return seats.ensureShards(conf, shards)
+
+    def _profiles(self, count):
+        return ndb.put_multi([Profile(id='user%d' % i) for i in range(count)])
+
+    #### TESTS ####
+    def test_shards_split_capacity(self):
+        conf = self._conference(7, shards=3)
+        shards = SeatShard.query().fetch()
+        self.assertEqual(3, conf.seatShards)
+        self.assertEqual(7, sum(s.capacity for s in shards))
+        self.assertEqual(7, seats.seatsAvailable(conf))
+
+    def test_legacy_seats_carried_over(self):
+        conf = self._conference(10, seatsAvailable=4, shards=4)
+        self.assertEqual(6, sum(s.reserved for s in SeatShard.query()))
+        self.assertEqual(4, seats.seatsAvailable(conf))
+
+    def test_never_oversell(self):
+        conf = self._conference(3, shards=2)
+        results = [seats.reserve(conf, p_key) for p_key in self._profiles(5)]
+        self.assertEqual(3, results.count(seats.RESERVED))
+        self.assertEqual(2, results.count(seats.SOLD_OUT))
+        self.assertEqual(3, len(SeatReservation.query().fetch()))
+        self.assertEqual(0, seats.seatsAvailable(conf))
+
+    def test_reserve_contended(self):
+        conf = self._conference(3, shards=2)
+        p_key = self._profiles(1)[0]
+        reserveOnShard = seats._reserveOnShard
+        failures = []
+
+        def contended(s_key, c_key, p_key):
+            if len(failures) < limit:
+                failures.append(s_key)
+                raise TransactionFailedError()
+            return reserveOnShard(s_key, c_key, p_key)
+        seats._reserveOnShard = contended
+        try:
+            # free seats are never reported as sold out
+            limit = 2 * seats.RESERVE_ATTEMPTS
+            self.assertEqual(seats.BUSY, seats.reserve(conf, p_key))
+            # a shard contended once is tried again
+            del failures[:]
+            limit = 2
+            self.assertEqual(seats.RESERVED, seats.reserve(conf, p_key))
+        finally:
+            seats._reserveOnShard = reserveOnShard
+        self.assertEqual(2, seats.seatsAvailable(conf))
+
+    def test_reserve_twice(self):
+        conf = self._conference(5)
+        p_key = self._profiles(1)[0]
+        self.assertEqual(seats.RESERVED, seats.reserve(conf, p_key))
+        self.assertEqual(seats.ALREADY_RESERVED, seats.reserve(conf, p_key))
+        self.assertEqual([conf.key.urlsafe()], seats.registrationIds(p_key))
+        self.assertEqual([conf.key],
+                         seats.conferenceKeysAsync(p_key).get_result())
+        # registrations do not write the Profile
+        self.assertEqual([], p_key.get().conferenceKeysToAttend)
+
+    def test_release(self):
+        conf = self._conference(1)
+        p_key, other = self._profiles(2)
+        self.assertEqual(seats.NOT_RESERVED, seats.release(conf, p_key))
+        seats.reserve(conf, p_key)
+        self.assertEqual(seats.SOLD_OUT, seats.reserve(conf, other))
+        self.assertEqual(seats.RELEASED, seats.release(conf, p_key))
+        self.assertEqual([], seats.registrationIds(p_key))
+        self.assertEqual(seats.RESERVED, seats.reserve(conf, other))
+
+    def test_attendeesPage(self):
+        conf = self._conference(5)
+        p_keys = self._profiles(3)
+        for p_key in p_keys:
+            seats.reserve(conf, p_key)
+        first, cursor = seats.attendeesPage(conf.key, 2)
+        self.assertEqual(p_keys[:2], first)
+        rest, cursor = seats.attendeesPage(conf.key, 2, cursor)
+        self.assertEqual(p_keys[2:], rest)
+        self.assertEqual(None, cursor)
+
+    def test_migrate_legacy_registration(self):
+        # registered before sharding and before SeatReservations
+        conf = Conference(name='Test', maxAttendees=2, seatsAvailable=1)
+        conf.put()
+        p_key = Profile(id='legacy',
+                        conferenceKeysToAttend=[conf.key.urlsafe()]).put()
+        prof = seats.migrate(p_key)
+        self.assertEqual([], prof.conferenceKeysToAttend)
+        self.assertEqual([conf.key.urlsafe()], seats.registrationIds(p_key))
+        conf = seats.ensureShards(conf, 2)
+        self.assertEqual(seats.ALREADY_RESERVED, seats.reserve(conf, p_key))
+        self.assertEqual(seats.RELEASED, seats.release(conf, p_key))
+        self.assertEqual(2, seats.seatsAvailable(conf))
+
+    def test_reserve_legacy_registration(self):
+        # legacy registrants are migrated by reserve() and release()
+        conf = self._conference(2, seatsAvailable=0, shards=2)
+        p_key = Profile(id='legacy',
+                        conferenceKeysToAttend=[conf.key.urlsafe()]).put()
+        self.assertEqual(seats.ALREADY_RESERVED, seats.reserve(conf, p_key))
+        self.assertEqual([], p_key.get().conferenceKeysToAttend)
+        other = Profile(id='other',
+                        conferenceKeysToAttend=[conf.key.urlsafe()]).put()
+        self.assertEqual(seats.RELEASED, seats.release(conf, other))
+        self.assertEqual(1, seats.seatsAvailable(conf))
+
+    def test_resize(self):
+        conf = self._conference(4, shards=2)
+        for p_key in self._profiles(3):
+            seats.reserve(conf, p_key)
+        self.assertEqual(None, seats.resize(conf, 2))
+        self.assertEqual(3, seats.resize(conf, 6))
+        self.assertEqual(6, sum(s.capacity for s in SeatShard.query()))
+
+    def test_rollup(self):
+        conf = self._conference(5)
+        seats.reserve(conf, self._profiles(1)[0])
+        self.assertEqual(5, conf.key.get().seatsAvailable)
+        seats.rollup(conf.key)
+        self.assertEqual(4, conf.key.get().seatsAvailable)
@@ -0,0 +1,112 @@
+import unittest
+from datetime import date, time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Session, SpeakerPrefix
+import speaker_index
+
+
+class SpeakerIndexTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.c_key = Conference(name='Conf').put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _session(self, name, speakers, hour=9):
+        sess = Session(parent=self.c_key, name=name, speaker=speakers,
+                       date=date(2015,8,8), startTime=time(hour, 0),
+                       conferenceKey=self.c_key.urlsafe())
+        sess.put()
+        return sess
+
+    def _names(self, speaker):
+        return [s.name for s in speaker_index.sessions(speaker)]
+
+    #### TESTS ####
+    def test_normalize(self):
+        self.assertEqual(u'frodo baggins',
+                         speaker_index.normalize(' Frodo \t BAGGINS '))
+        self.assertEqual(None, speaker_index.speakerKey('  '))
+
+    def test_add_and_lookup(self):
+        sessions = [self._session('Late', ['Frodo Baggins'], hour=15),
+                    self._session('Early', ['frodo  baggins', 'Sam'])]
+        speaker_index.add(sessions)
+        self.assertEqual(['Early', 'Late'], self._names('FRODO BAGGINS'))
+        self.assertEqual(['Early'], self._names('sam'))
+        self.assertEqual([], self._names('Gollum'))
+        # adding again does not duplicate keys
+        speaker_index.add(sessions)
+        speaker = speaker_index.speakerKey('Frodo Baggins').get()
+        self.assertEqual(2, len(speaker.sessionKeys))
+
+    def test_stale_keys_pruned(self):
+        gone = self._session('Gone', ['Frodo'])
+        moved = self._session('Moved', ['Frodo'])
+        kept = self._session('Kept', ['Frodo'])
+        speaker_index.add([gone, moved, kept])
+        gone.key.delete()
+        moved.speaker = ['Sam']
+        moved.put()
+        speaker_index.add([moved])
+        self.assertEqual(['Kept'], self._names('Frodo'))
+        self.assertEqual([kept.key],
+                         speaker_index.speakerKey('Frodo').get().sessionKeys)
+        self.assertEqual(['Moved'], self._names('Sam'))
+
+    def test_suggest(self):
+        self._session('One', ['Frodo Baggins', 'Fredegar', 'fatty'])
+        self._session('Two', ['frodo  BAGGINS', 'Sam', 'Folco'])
+        speaker_index.add(Session.query().fetch())
+        self.assertEqual((['Fredegar', 'Frodo Baggins'], None),
+                         speaker_index.suggest('fr', 5))
+        self.assertEqual((['Frodo Baggins'], None),
+                         speaker_index.suggest(' Frodo  B', 5))
+        self.assertEqual(([], None), speaker_index.suggest('bilbo', 5))
+        # a short prefix spans the buckets 'fa', 'fo' and 'fr'
+        names, token = speaker_index.suggest('F', 2)
+        self.assertEqual(['fatty', 'Folco'], names)
+        self.assertEqual((['Fredegar', 'Frodo Baggins'], None),
+                         speaker_index.suggest('f', 2, token))
+        self.assertEqual(5, len(speaker_index.suggest('', 10)[0]))
+
+    def test_suggest_unlisted_when_pruned(self):
+        gone = self._session('Gone', ['Frodo'])
+        speaker_index.add([gone, self._session('Kept', ['Fredegar'])])
+        gone.key.delete()
+        self.assertEqual([], self._names('Frodo'))
+        self.assertEqual(None, speaker_index.speakerKey('Frodo').get())
+        self.assertEqual((['Fredegar'], None), speaker_index.suggest('fr', 5))
+
+    def test_backfill(self):
+        for i in range(3):
+            self._session('S%d' % i, ['Frodo'], hour=9 + i)
+        size = speaker_index.BACKFILL_BATCH_SIZE
+        speaker_index.BACKFILL_BATCH_SIZE = 2
+        try:
+            speaker_index.backfill()
+        finally:
+            speaker_index.BACKFILL_BATCH_SIZE = size
+        self.assertEqual(['S0', 'S1'], self._names('Frodo'))
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/tasks/index_speakers')
+        self.assertEqual(1, len(tasks))
+        speaker_index.backfill(self.c_key)
+        self.assertEqual(['S0', 'S1', 'S2'], self._names('Frodo'))
+        # speakers indexed before the directory existed are listed
+        SpeakerPrefix.query().get().key.delete()
+        speaker_index.backfill(self.c_key)
+        self.assertEqual((['Frodo'], None), speaker_index.suggest('fr', 5))
@@ -0,0 +1,87 @@
+import unittest
+from datetime import date, time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Session
+import speakers
+
+
+class SpeakerTallyTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.c_key = Conference(name='Test').put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _session(self, *names):
+        sess = Session(parent=self.c_key, name='Session', speaker=list(names),
+                       date=date(2015,8,8), startTime=time(10,15))
+        sess.put()
+        return sess
+
+    def _write(self, changed=(), deleted=()):
+        ndb.transaction(lambda: speakers.update(
+            self.c_key, changed=changed, deleted=deleted))
+
+    def _tally(self):
+        return speakers.tallyKey(self.c_key).get()
+
+    def _tasks(self):
+        return self.taskqueue_stub.get_filtered_tasks(
+            url='/tasks/set_featured_speaker')
+
+    #### TESTS ####
+    def test_create(self):
+        self._write(changed=[self._session('Sarah', 'Frodo')])
+        self.assertEqual('', self._tally().featured)
+        self.assertEqual(0, len(self._tasks()))
+        self._write(changed=[self._session('Frodo')])
+        tally = self._tally()
+        self.assertEqual({'Sarah': 1, 'Frodo': 2}, tally.counts)
+        self.assertEqual('Frodo', tally.featured)
+        # one task for the write that changed the featured speaker
+        self.assertEqual(1, len(self._tasks()))
+
+    def test_update_and_delete(self):
+        first = self._session('Frodo')
+        second = self._session('Frodo')
+        self._write(changed=[first, second])
+        self.assertEqual('Frodo', self._tally().featured)
+        # moving a session to another speaker drops Frodo's count
+        second.speaker = ['Sam']
+        self._write(changed=[second])
+        tally = self._tally()
+        self.assertEqual({'Frodo': 1, 'Sam': 1}, tally.counts)
+        self.assertEqual('', tally.featured)
+        self._write(deleted=[first.key])
+        self.assertEqual({'Sam': 1}, self._tally().counts)
+
+    def test_rewrite_is_idempotent(self):
+        sess = self._session('Frodo')
+        self._write(changed=[sess])
+        self._write(changed=[sess])
+        self.assertEqual({'Frodo': 1}, self._tally().counts)
+
+    def test_legacy_sessions_counted(self):
+        self._session('Frodo')
+        new = self._session('Frodo')
+        build = lambda: Session.query(ancestor=self.c_key).fetch()
+        ndb.transaction(lambda: speakers.update(
+            self.c_key, changed=[new], build=build))
+        self.assertEqual({'Frodo': 2}, self._tally().counts)
+
+    def test_publish(self):
+        self._write(changed=[self._session('Frodo'), self._session('Frodo')])
+        self.assertEqual('Frodo', speakers.featured(self.c_key))
@@ -0,0 +1,126 @@
+import unittest
+from datetime import date, time
+
+from google.appengine.api import search
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Session
+import textsearch
+
+
+class FailingIndex(textsearch.MemoryIndex):
+    def put(self, documents):
+        raise search.Error('unavailable')
+
+
+class TextSearchTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.testbed.init_search_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.index = textsearch.MemoryIndex()
+        self.previous_index = textsearch.setIndex(self.index)
+
+    def tearDown(self):
+        textsearch.setIndex(self.previous_index)
+        self.testbed.deactivate()
+
+    def _populate(self):
+        c_key = Conference(name='Python Summit', city='London',
+                           description='Talks on python packaging',
+                           topics=['Programming Languages']).put()
+        sessions = [
+            Session(parent=c_key, name='Packaging in Python',
+                    speaker=['Frodo'], highlights='Wheels and eggs',
+                    date=date(2015,8,8), startTime=time(9,0),
+                    conferenceKey=c_key.urlsafe()),
+            Session(parent=c_key, name='Testing Go',
+                    speaker=['Sam Python'], typeOfSession='workshop',
+                    date=date(2015,8,8), startTime=time(10,0),
+                    conferenceKey=c_key.urlsafe()),
+        ]
+        ndb.put_multi(sessions)
+        return c_key, sessions
+
+    def _names(self, text, **kwargs):
+        hits, _ = textsearch.query(text, **kwargs)
+        return [hit.name for hit in hits]
+
+    #### TESTS ####
+    def test_tokenize(self):
+        self.assertEqual([u'caf\xe9', u'python', u'2015'],
+                         textsearch.tokenize('The Caf\xc3\xa9 of Python, 2015!'))
+        self.assertEqual([], textsearch.tokenize(None))
+
+    def test_rank_and_filter(self):
+        c_key, sessions = self._populate()
+        textsearch.indexConferences([c_key.get()])
+        textsearch.indexSessions(sessions)
+        # every term must match; a name outranks other fields
+        self.assertEqual(['Packaging in Python', 'Python Summit'],
+                         self._names('python packaging'))
+        self.assertEqual(['Python Summit', 'Packaging in Python',
+                          'Testing Go'], self._names('PYTHON'))
+        self.assertEqual(['Testing Go'],
+                         self._names('python workshop', kind='Session'))
+        self.assertEqual([], self._names('python ruby'))
+        hits, total = textsearch.query('python', limit=1, offset=1)
+        self.assertEqual((['Packaging in Python'], 3),
+                         ([hit.name for hit in hits], total))
+
+    def test_update_and_delete(self):
+        c_key, sessions = self._populate()
+        textsearch.indexSessions(sessions)
+        sessions[0].name = 'Distributing code'
+        sessions[0].put()
+        textsearch.indexSessions([sessions[0]], [sessions[1].key])
+        self.assertEqual([], self._names('python'))
+        self.assertEqual(['Distributing code'], self._names('wheels'))
+        self.assertEqual(1, len(self.index))
+
+    def test_failed_writes_reindexed(self):
+        c_key, sessions = self._populate()
+        textsearch.setIndex(FailingIndex())
+        textsearch.indexSessions(sessions)
+        tasks = self.taskqueue_stub.get_filtered_tasks(url='/tasks/index_search')
+        self.assertEqual(1, len(tasks))
+        self.assertTrue(tasks[0].name.startswith(
+            'index-search-%s-' % c_key.urlsafe()))
+        textsearch.setIndex(self.index)
+        textsearch.reindex(c_key)
+        self.assertEqual(3, len(self.index))
+
+    def test_reindex_all(self):
+        for i in range(3):
+            Conference(name='Conf %d' % i).put()
+        size = textsearch.REINDEX_BATCH_SIZE
+        textsearch.REINDEX_BATCH_SIZE = 2
+        try:
+            textsearch.reindex()
+        finally:
+            textsearch.REINDEX_BATCH_SIZE = size
+        self.assertEqual(2, len(self.index))
+        tasks = self.taskqueue_stub.get_filtered_tasks(url='/tasks/index_search')
+        self.assertEqual(1, len(tasks))
+
+    def test_search_api_backend(self):
+        c_key, sessions = self._populate()
+        textsearch.setIndex(textsearch.SearchApiIndex('test-index'))
+        textsearch.indexConferences([c_key.get()])
+        textsearch.indexSessions(sessions)
+        self.assertEqual(['Packaging in Python'],
+                         self._names('packaging wheels'))
+        hits, total = textsearch.query('python', kind='Session')
+        self.assertEqual(2, total)
+        self.assertEqual(set(['Session']), set(hit.kind for hit in hits))
+        textsearch.indexSessions(deleted=[sessions[0].key])
+        self.assertEqual([], self._names('wheels'))
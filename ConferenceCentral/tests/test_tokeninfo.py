@@ -0,0 +1,70 @@
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import tokeninfo
+
+
+class FakeTokenService(object):
+    """Local stand-in for the tokeninfo service."""
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.calls = []
+
+    @ndb.tasklet
+    def verify(self, token, token_type):
+        self.calls.append((token, token_type))
+        raise ndb.Return(self.tokens.get(token))
+
+
+class TokenInfoTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        self.service = FakeTokenService({
+            'good': {'user_id': '42', 'expires_in': 3000},
+            'expiring': {'user_id': '7', 'expires_in': 10},
+        })
+        self.previous = tokeninfo.setVerifier(self.service.verify)
+
+    def tearDown(self):
+        tokeninfo.setVerifier(self.previous)
+        self.testbed.deactivate()
+
+    #### TESTS ####
+    def test_cached_in_instance(self):
+        self.assertEqual('42', tokeninfo.verify('good')['user_id'])
+        self.assertEqual('42', tokeninfo.verify('good')['user_id'])
+        self.assertEqual(1, len(self.service.calls))
+
+    def test_cached_in_memcache_by_hash(self):
+        tokeninfo.verify('good')
+        # a new instance starts with an empty instance cache
+        tokeninfo._local.clear()
+        self.assertEqual('42', tokeninfo.verify('good')['user_id'])
+        self.assertEqual(1, len(self.service.calls))
+        key = tokeninfo.MEMCACHE_TOKEN_KEY % tokeninfo.tokenHash('good')
+        self.assertIsNotNone(memcache.get(key))
+        self.assertIsNone(memcache.get(tokeninfo.MEMCACHE_TOKEN_KEY % 'good'))
+
+    def test_ttl_bounded_by_expiry(self):
+        # expires within the safety margin, so it is never cached
+        tokeninfo.verify('expiring')
+        tokeninfo.verify('expiring')
+        self.assertEqual(2, len(self.service.calls))
+
+    def test_failures_not_cached(self):
+        self.assertIsNone(tokeninfo.verify('bad'))
+        self.service.tokens['bad'] = {'user_id': '1', 'expires_in': 3000}
+        self.assertEqual('1', tokeninfo.verify('bad')['user_id'])
+
+    def test_stats(self):
+        hits, misses = tokeninfo.stats()
+        tokeninfo.verify('good')
+        tokeninfo.verify('good')
+        self.assertEqual((hits + 1, misses + 1), tokeninfo.stats())
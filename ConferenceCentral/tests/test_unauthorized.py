@@ -54,6 +54,12 @@ class DeployedAuthorizationTestCase(unittest.TestCase):
         res = urlfetch.fetch(self.urlbase + url)
         self.assertEqual(res.status_code, 401)
 
+    def test_removeSessionFromWishlist(self):
+        url = '/_ah/api/conference/v1/wishlist/dummy'
+        res = urlfetch.fetch(self.urlbase + url,
+                             method=urlfetch.DELETE)
+        self.assertEqual(res.status_code, 401)
+
     def test_getConferencesToAttend(self):
         url = '/_ah/api/conference/v1/conferences/attending'
         res = urlfetch.fetch(self.urlbase + url)
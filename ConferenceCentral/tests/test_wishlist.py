@@ -0,0 +1,95 @@
+import unittest
+from datetime import date, time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference, Profile, Session, WishlistEntry
+import wishlist
+
+
+class WishlistTestCase(unittest.TestCase):
+    #### SET UP and TEAR DOWN ####
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        ndb.get_context().set_cache_policy(False)
+        self.p_key = Profile(id='a@x.com', mainEmail='a@x.com').put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _sessions(self, name, count):
+        c_key = Conference(name=name).put()
+        return c_key, [Session(parent=c_key, name='S%d' % i,
+                               date=date(2015,8,8), startTime=time(9,i),
+                               conferenceKey=c_key.urlsafe()).put()
+                       for i in range(count)]
+
+    #### TESTS ####
+    def test_add(self):
+        c_key, (s_key,) = self._sessions('Conf', 1)
+        self.assertTrue(wishlist.add(self.p_key, s_key))
+        self.assertFalse(wishlist.add(self.p_key, s_key))
+        self.assertEqual([s_key.urlsafe()], wishlist.sessionKeys(self.p_key))
+        entry = wishlist.entryKey(self.p_key, s_key).get()
+        self.assertEqual(c_key, entry.conferenceKey)
+        # the Profile itself is not rewritten
+        self.assertEqual([], self.p_key.get().sessionKeysToAttend)
+
+    def test_addMany_removeMany(self):
+        c_key, s_keys = self._sessions('Conf', 3)
+        wishlist.add(self.p_key, s_keys[0])
+        self.assertEqual(set(s_keys[1:]),
+                         wishlist.addMany(self.p_key, s_keys))
+        self.assertEqual(3, len(wishlist.sessionKeys(self.p_key)))
+        self.assertEqual(set(s_keys[:2]),
+                         wishlist.removeMany(self.p_key, s_keys[:2]))
+        self.assertFalse(wishlist.remove(self.p_key, s_keys[0]))
+        self.assertTrue(wishlist.remove(self.p_key, s_keys[2]))
+        self.assertEqual([], wishlist.sessionKeys(self.p_key))
+
+    def test_sessionKeysFor(self):
+        c1_key, s1_keys = self._sessions('One', 2)
+        c2_key, s2_keys = self._sessions('Two', 3)
+        for s_key in s1_keys + s2_keys:
+            wishlist.add(self.p_key, s_key)
+        self.assertEqual(sorted(s1_keys),
+                         sorted(wishlist.sessionKeysFor(self.p_key, c1_key)))
+        self.assertEqual(sorted(s2_keys),
+                         sorted(wishlist.sessionKeysFor(self.p_key, c2_key)))
+
+    def test_migrate(self):
+        c_key, s_keys = self._sessions('Conf', 2)
+        prof = self.p_key.get()
+        prof.sessionKeysToAttend = [k.urlsafe() for k in s_keys]
+        prof.put()
+        prof = wishlist.migrate(self.p_key)
+        self.assertEqual([], prof.sessionKeysToAttend)
+        self.assertEqual([], self.p_key.get().sessionKeysToAttend)
+        self.assertEqual(sorted(s_keys),
+                         sorted(wishlist.sessionKeysFor(self.p_key, c_key)))
+
+    def test_migrateAll(self):
+        c_key, (s_key,) = self._sessions('Conf', 1)
+        for i in range(3):
+            Profile(id='p%d' % i,
+                    sessionKeysToAttend=[s_key.urlsafe()]).put()
+        wishlist.MIGRATE_BATCH_SIZE, size = 2, wishlist.MIGRATE_BATCH_SIZE
+        try:
+            wishlist.migrateAll()
+        finally:
+            wishlist.MIGRATE_BATCH_SIZE = size
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url='/tasks/migrate_wishlists')
+        self.assertEqual(1, len(tasks))
+        wishlist.migrateAll()
+        self.assertEqual(3, WishlistEntry.query().count())
+        self.assertEqual(0, len([p for p in Profile.query()
+                                 if p.sessionKeysToAttend]))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+
+Full-text search over conferences and sessions.
+
+Conference names, descriptions, cities and topics and session names,
+highlights, speakers and types are indexed as documents whose id is
+the websafe key of the entity. Text is split into lowercase word tokens
+with stop words dropped (tokenize()); a query matches the documents
+that hold all of its tokens, best ranked first.
+
+The index is a pluggable backend with put(), delete() and search():
+
+- MemoryIndex is an in-process inverted index ranked by TF-IDF with
+  field weights. Tests and benchmarks use it; nothing outside the
+  process is needed.
+- SearchApiIndex keeps the documents in an App Engine Search API index
+  ranked by its match scorer. It is the default.
+
+Conference and session writes update the index once they commit (see
+conference.py). If that fails, a /tasks/index_search task indexes the
+conference and its sessions again; the same task without a conference
+re-indexes everything page by page.
+
+$Id$
+
+"""
+
+import collections
+import heapq
+import logging
+import math
+import re
+import time
+
+from google.appengine.api import search
+
+from models import Conference
+from models import Session
+import dispatch
+
+INDEX_NAME = 'conference-search'
+MAX_RESULTS = 1000  # deepest result a page may reach
+PUT_BATCH_SIZE = 200    # Search API limit per put or delete call
+REINDEX_BATCH_SIZE = 100
+REPAIR_INTERVAL = 10    # seconds between re-index tasks of a conference
+
+CONFERENCE = 'Conference'
+SESSION = 'Session'
+
+# a term found in a more important field counts more often
+FIELD_WEIGHTS = {
+    'name': 3,
+    'speaker': 2,
+    'text': 1,
+}
+
+STOP_WORDS = frozenset((
+    'an and are as at be but by for from has have in into is it its of on '
+    'or that the this to was were will with').split())
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+Document = collections.namedtuple('Document', 'docId kind name fields')
+Hit = collections.namedtuple('Hit', 'docId kind name score')
+
+
+def tokenize(text):
+    """Return the index terms of a text, in order."""
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return [word for word in _WORD.findall(text.lower())
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+def conferenceDocument(conf):
+    """Return the search Document of a Conference."""
+    fields = [('name', conf.name), ('text', conf.description),
+              ('text', conf.city)]
+    fields.extend(('text', topic) for topic in conf.topics)
+    return Document(conf.key.urlsafe(), CONFERENCE, conf.name,
+                    [(field, text) for field, text in fields if text])
+
+
+def sessionDocument(sess):
+    """Return the search Document of a Session."""
+    fields = [('name', sess.name), ('text', sess.highlights),
+              ('text', sess.typeOfSession)]
+    fields.extend(('speaker', name) for name in sess.speaker)
+    return Document(sess.key.urlsafe(), SESSION, sess.name,
+                    [(field, text) for field, text in fields if text])
+
+
+class MemoryIndex(object):
+    """In-process inverted index ranked by TF-IDF."""
+
+    def __init__(self):
+        # term -> {doc id: 1 + log(weighted term frequency)}
+        self._postings = collections.defaultdict(dict)
+        # doc id -> (kind, name, terms)
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def put(self, documents):
+        for doc in documents:
+            self._remove(doc.docId)
+            counts = collections.Counter()
+            for field, text in doc.fields:
+                for term in tokenize(text):
+                    counts[term] += FIELD_WEIGHTS[field]
+            for term, count in counts.iteritems():
+                self._postings[term][doc.docId] = 1.0 + math.log(count)
+            self._docs[doc.docId] = (doc.kind, doc.name, list(counts))
+
+    def delete(self, doc_ids):
+        for doc_id in doc_ids:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            posting = self._postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self._postings[term]
+
+    def search(self, terms, kind=None, limit=20, offset=0):
+        """Return (hits, number of matches) for documents holding all
+        `terms`, optionally only of one `kind`."""
+        terms = set(terms)
+        if not terms or any(term not in self._postings for term in terms):
+            return [], 0
+        # intersect starting from the rarest term
+        postings = sorted((self._postings[term] for term in terms), key=len)
+        matches = [doc_id for doc_id in postings[0]
+                   if all(doc_id in posting for posting in postings[1:])]
+        if kind:
+            matches = [doc_id for doc_id in matches
+                       if self._docs[doc_id][0] == kind]
+        total = len(self._docs)
+        idf = [(posting, math.log(1.0 + float(total) / len(posting)))
+               for posting in postings]
+
+        def score(doc_id):
+            return sum(posting[doc_id] * weight for posting, weight in idf)
+        ranked = heapq.nsmallest(offset + limit,
+                                 ((-score(doc_id), doc_id)
+                                  for doc_id in matches))
+        hits = [Hit(doc_id, self._docs[doc_id][0], self._docs[doc_id][1],
+                    -negative)
+                for negative, doc_id in ranked[offset:]]
+        return hits, len(matches)
+
+
+class SearchApiIndex(object):
+    """App Engine Search API index."""
+
+    def __init__(self, name=INDEX_NAME):
+        self._index = search.Index(name=name)
+
+    def put(self, documents):
+        documents = [self._document(doc) for doc in documents]
+        for i in range(0, len(documents), PUT_BATCH_SIZE):
+            self._index.put(documents[i:i + PUT_BATCH_SIZE])
+
+    def delete(self, doc_ids):
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), PUT_BATCH_SIZE):
+            self._index.delete(doc_ids[i:i + PUT_BATCH_SIZE])
+
+    @staticmethod
+    def _document(doc):
+        fields = [search.AtomField(name='kind', value=doc.kind)]
+        fields.extend(search.TextField(name=field, value=text)
+                      for field, text in doc.fields)
+        return search.Document(doc_id=doc.docId, fields=fields)
+
+    def search(self, terms, kind=None, limit=20, offset=0):
+        """Return (hits, number of matches) for documents holding all
+        `terms`, optionally only of one `kind`."""
+        # quoted terms are never read as query operators
+        query = ' '.join('"%s"' % term for term in sorted(set(terms)))
+        if not query:
+            return [], 0
+        if kind:
+            query += ' kind:%s' % kind
+        sort = search.SortOptions(
+            match_scorer=search.MatchScorer(),
+            expressions=[search.SortExpression(
+                expression='_score', default_value=0.0,
+                direction=search.SortExpression.DESCENDING)])
+        options = search.QueryOptions(
+            limit=limit, offset=offset, sort_options=sort,
+            returned_fields=['kind', 'name'])
+        results = self._index.search(search.Query(query, options=options))
+        hits = [Hit(doc.doc_id, self._value(doc, 'kind'),
+                    self._value(doc, 'name'),
+                    doc.sort_scores[0] if doc.sort_scores else 0.0)
+                for doc in results.results]
+        return hits, results.number_found
+
+    @staticmethod
+    def _value(doc, name):
+        values = [field.value for field in doc.fields if field.name == name]
+        return values[0] if values else None
+
+
+_index = SearchApiIndex()
+
+
+def setIndex(index):
+    """Replace the search backend. Returns the previous one."""
+    global _index
+    previous, _index = _index, index
+    return previous
+
+
+def query(text, kind=None, limit=20, offset=0):
+    """Search for `text`. Returns (hits, number of matches)."""
+    return _index.search(tokenize(text), kind, limit, offset)
+
+
+def _reindexLater(c_keys):
+    # One named task per conference per interval, so a later failure
+    # re-indexes again instead of hitting a tombstoned name.
+    for c_key in set(c_keys):
+        wsck = c_key.urlsafe()
+        dispatch.enqueue(
+            url='/tasks/index_search',
+            params={'websafeConferenceKey': wsck},
+            name=dispatch.taskName('index-search', wsck,
+                                   int(time.time() // REPAIR_INTERVAL)),
+            countdown=REPAIR_INTERVAL,
+        )
+
+
+def indexConferences(confs):
+    """Add or replace the documents of Conferences. Call after they are
+    committed."""
+    try:
+        _index.put([conferenceDocument(conf) for conf in confs])
+    except search.Error:
+        logging.exception('Conference indexing failed')
+        _reindexLater(conf.key for conf in confs)
+
+
+def indexSessions(changed=(), deleted=()):
+    """Add or replace the documents of `changed` Sessions and drop those
+    of `deleted` Session keys. Call after they are committed."""
+    try:
+        if changed:
+            _index.put([sessionDocument(sess) for sess in changed])
+        if deleted:
+            _index.delete([s_key.urlsafe() for s_key in deleted])
+    except search.Error:
+        logging.exception('Session indexing failed')
+        _reindexLater([sess.key.parent() for sess in changed] +
+                      [s_key.parent() for s_key in deleted])
+
+
+def reindex(c_key=None, cursor=None):
+    """Index one conference and its sessions, or one batch of all
+    conferences with their sessions and enqueue a task for the next."""
+    if c_key:
+        confs, more = filter(None, [c_key.get()]), False
+    else:
+        confs, cursor, more = Conference.query().fetch_page(
+            REINDEX_BATCH_SIZE, start_cursor=cursor)
+    documents = [conferenceDocument(conf) for conf in confs]
+    for conf in confs:
+        documents.extend(sessionDocument(sess) for sess
+                         in Session.query(ancestor=conf.key))
+    _index.put(documents)
+    if more and cursor:
+        # named after its contents, which is safe: every page has its own
+        # cursor, and a retried page re-enqueues the same next page once
+        dispatch.enqueue(url='/tasks/index_search',
+                         params={'cursor': cursor.urlsafe()})
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""tokeninfo.py
+
+Cached OAuth token verification for getUserId(id_type="oauth").
+
+Verified token info is cached in the instance and in memcache under a
+SHA-256 hash of the token (tokens themselves are never stored), for no
+longer than the token stays valid. On a miss the token is checked by a
+pluggable verifier; the default one calls the Google tokeninfo service
+asynchronously with one deadline for all of its attempts, instead of
+sleeping between retries.
+
+$Id$
+
+"""
+
+import hashlib
+import json
+import time
+import urllib
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+DEADLINE = 5            # seconds, for all attempts together
+ATTEMPTS = 3
+MAX_CACHE_TIME = 60 * 60    # seconds
+EXPIRY_MARGIN = 30      # forget tokens this many seconds before expiry
+LOCAL_CACHE_SIZE = 1000
+MEMCACHE_TOKEN_KEY = 'tokeninfo_%s'
+MEMCACHE_HITS_KEY = 'tokenHits'
+MEMCACHE_MISSES_KEY = 'tokenMisses'
+
+_local = {}     # token hash -> (expiry time, token info)
+_localHits = [0]
+
+
+def tokenHash(token):
+    """Return the cache key part for a token."""
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+def urlVerifier(url=TOKENINFO_URL, deadline=DEADLINE):
+    """Return a verifier asking the tokeninfo service at `url`, which
+    has `token_type` and `token` substituted into it.
+
+    A verifier is a tasklet taking (token, token_type) and returning the
+    token info dict, or None if the token could not be verified."""
+    @ndb.tasklet
+    def verify(token, token_type):
+        ctx = ndb.get_context()
+        stop = time.time() + deadline
+        for i in range(ATTEMPTS):
+            remaining = stop - time.time()
+            if remaining <= 0:
+                break
+            try:
+                resp = yield ctx.urlfetch(
+                    url % (token_type, urllib.quote(token)),
+                    deadline=remaining)
+            except urlfetch.Error:
+                continue
+            if resp.status_code == 200:
+                raise ndb.Return(json.loads(resp.content))
+            if resp.status_code == 400 and 'invalid_token' in resp.content:
+                if token_type == 'access_token':
+                    break
+                token_type = 'access_token'
+        raise ndb.Return(None)
+    return verify
+
+
+_verifier = urlVerifier()
+
+
+def setVerifier(verifier):
+    """Replace the token verifier (see urlVerifier()) and drop the
+    instance cache. Returns the previous verifier."""
+    global _verifier
+    previous, _verifier = _verifier, verifier
+    _local.clear()
+    return previous
+
+
+def _cacheTime(info):
+    """Seconds a token info may be cached for, bounded by its expiry."""
+    try:
+        expires_in = int(info.get('expires_in', 0))
+    except (TypeError, ValueError):
+        return 0
+    return min(expires_in - EXPIRY_MARGIN, MAX_CACHE_TIME)
+
+
+def _remember(h, expires, info):
+    if len(_local) >= LOCAL_CACHE_SIZE:
+        now = time.time()
+        for key, entry in _local.items():
+            if entry[0] <= now:
+                _local.pop(key, None)
+        if len(_local) >= LOCAL_CACHE_SIZE:
+            _local.clear()
+    _local[h] = (expires, info)
+
+
+@ndb.tasklet
+def verifyAsync(token, token_type='id_token'):
+    """Return the token info dict of a token, or None if it could not be
+    verified. Failures are not cached."""
+    h = tokenHash(token)
+    entry = _local.get(h)
+    if entry and entry[0] > time.time():
+        _localHits[0] += 1
+        raise ndb.Return(entry[1])
+    ctx = ndb.get_context()
+    key = MEMCACHE_TOKEN_KEY % h
+    entry = yield ctx.memcache_get(key)
+    if entry and entry[0] > time.time():
+        yield ctx.memcache_incr(MEMCACHE_HITS_KEY, initial_value=0)
+        _remember(h, *entry)
+        raise ndb.Return(entry[1])
+    info, _ = yield (_verifier(token, token_type),
+                     ctx.memcache_incr(MEMCACHE_MISSES_KEY, initial_value=0))
+    ttl = _cacheTime(info) if info else 0
+    if ttl > 0:
+        expires = time.time() + ttl
+        _remember(h, expires, info)
+        yield ctx.memcache_set(key, (expires, info), time=ttl)
+    raise ndb.Return(info)
+
+
+def verify(token, token_type='id_token'):
+    """Synchronous version of verifyAsync()."""
+    return verifyAsync(token, token_type).get_result()
+
+
+def stats():
+    """Return (hits, misses): memcache hits and misses of all instances,
+    plus the instance cache hits of this instance."""
+    counts = memcache.get_multi([MEMCACHE_HITS_KEY, MEMCACHE_MISSES_KEY])
+    return (counts.get(MEMCACHE_HITS_KEY, 0) + _localHits[0],
+            counts.get(MEMCACHE_MISSES_KEY, 0))
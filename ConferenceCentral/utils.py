@@ -1,12 +1,16 @@
-import json
 import os
-import time
 import uuid
 
-from google.appengine.api import urlfetch
 from models import Profile
+import requestcontext
+import tokeninfo
 
 def getUserId(user, id_type="email"):
+    """Return the user id, resolved once per request."""
+    return requestcontext.memoize(('userId', id_type, user),
+                                  lambda: _getUserId(user, id_type))
+
+def _getUserId(user, id_type):
     if id_type == "email":
         return user.email()
 
@@ -17,21 +21,8 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
+        # cached, and verified asynchronously with a deadline on a miss
+        user = tokeninfo.verify(token, token_type) or {}
         return user.get('user_id', '')
 
     if id_type == "custom":
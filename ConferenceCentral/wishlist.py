@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""wishlist.py
+
+Session wishlists stored as `WishlistEntry` children of the Profile.
+
+The key id of an entry is the websafe key of the session, so checking
+whether a session is wishlisted is a single key lookup and adding one
+writes a small entity instead of the whole Profile. Each entry also
+records its conference, so a conference's wishlisted sessions are read
+with one keys-only ancestor query. Batches of sessions are added or
+removed with one get_multi and one write in a single transaction.
+
+Profiles that still hold the legacy `sessionKeysToAttend` list are
+migrated when they are next loaded, or all at once by the
+/tasks/migrate_wishlists task.
+
+$Id$
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import WishlistEntry
+import dispatch
+
+MIGRATE_BATCH_SIZE = 100
+
+
+def entryKey(p_key, s_key):
+    """Return the key of the wishlist entry for a session."""
+    return ndb.Key(WishlistEntry, s_key.urlsafe(), parent=p_key)
+
+
+def _sessionKey(e_key):
+    return ndb.Key(urlsafe=e_key.id())
+
+
+@ndb.transactional
+def addMany(p_key, s_keys):
+    """Add sessions to a user's wishlist in one transaction.
+
+    Returns the set of session keys that were not there yet."""
+    s_keys = list(set(s_keys))
+    e_keys = [entryKey(p_key, s_key) for s_key in s_keys]
+    added = [s_key for s_key, entry in zip(s_keys, ndb.get_multi(e_keys))
+             if not entry]
+    ndb.put_multi([WishlistEntry(key=entryKey(p_key, s_key),
+                                 conferenceKey=s_key.parent())
+                   for s_key in added])
+    return set(added)
+
+
+@ndb.transactional
+def removeMany(p_key, s_keys):
+    """Remove sessions from a user's wishlist in one transaction.
+
+    Returns the set of session keys that were there."""
+    s_keys = list(set(s_keys))
+    e_keys = [entryKey(p_key, s_key) for s_key in s_keys]
+    removed = [(s_key, e_key) for s_key, e_key, entry
+               in zip(s_keys, e_keys, ndb.get_multi(e_keys)) if entry]
+    ndb.delete_multi([e_key for _, e_key in removed])
+    return set(s_key for s_key, _ in removed)
+
+
+def add(p_key, s_key):
+    """Add a session to a user's wishlist.
+
+    Returns False if it was already there."""
+    return bool(addMany(p_key, [s_key]))
+
+
+def remove(p_key, s_key):
+    """Remove a session from a user's wishlist.
+
+    Returns False if it was not there."""
+    return bool(removeMany(p_key, [s_key]))
+
+
+def sessionKeys(p_key):
+    """Return the websafe keys of all sessions in a user's wishlist."""
+    e_keys = WishlistEntry.query(ancestor=p_key).fetch(keys_only=True)
+    return [e_key.id() for e_key in e_keys]
+
+
+def sessionKeysFor(p_key, c_key):
+    """Return the keys of a user's wishlisted sessions of one conference."""
+    e_query = WishlistEntry.query(ancestor=p_key)
+    e_query = e_query.filter(WishlistEntry.conferenceKey == c_key)
+    return [_sessionKey(e_key) for e_key in e_query.iter(keys_only=True)]
+
+
+@ndb.transactional
+def migrate(p_key):
+    """Move a Profile's legacy sessionKeysToAttend into wishlist entries.
+
+    Returns the updated Profile."""
+    prof = p_key.get()
+    if not prof or not prof.sessionKeysToAttend:
+        return prof
+    entries = []
+    for wsk in set(prof.sessionKeysToAttend):
+        s_key = ndb.Key(urlsafe=wsk)
+        entries.append(WishlistEntry(key=entryKey(p_key, s_key),
+                                     conferenceKey=s_key.parent()))
+    prof.sessionKeysToAttend = []
+    ndb.put_multi(entries + [prof])
+    return prof
+
+
+def migrateAll(cursor=None):
+    """Migrate one page of Profiles and enqueue a task for the next."""
+    profiles, cursor, more = Profile.query().fetch_page(
+        MIGRATE_BATCH_SIZE, start_cursor=cursor)
+    for prof in profiles:
+        if prof.sessionKeysToAttend:
+            migrate(prof.key)
+    if more and cursor:
+        dispatch.enqueue(url='/tasks/migrate_wishlists',
+                         params={'cursor': cursor.urlsafe()})